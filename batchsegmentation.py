@@ -0,0 +1,142 @@
+import argparse
+import glob
+import os
+import time
+
+from src.MultiresFramework import MultiResolutionFramework
+from src.config import Config
+from src.pipeline import Pipeline
+from src.radiograph import Radiograph
+from src.segmentationexporter import SegmentationExporter
+from src.searchbudget import SearchBudget
+from src.segmentationmodel import SegmentationModel
+
+__author__ = "Ivan Sevcik"
+
+
+class BatchItem(object):
+    """
+    Radiograph passing through the pipeline. Data that are no longer needed are released by the stages.
+    """
+    path = None
+    name = None
+    image_shape = None
+    image = None
+    crop_translation = None
+    pyramid = None
+    initial_poses = None
+    teeth = None
+    converged = None
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+
+    def __str__(self):
+        return self.path
+
+
+def decode(item):
+    radiograph = Radiograph()
+    radiograph.path_to_img = item.path
+    # Only the region of interest is decoded
+    item.crop_translation, item.image, item.image_shape = radiograph.load_cropped()
+    return item
+
+
+def build_pyramid(item):
+    item.pyramid = MultiResolutionFramework.build_pyramid_from_crop(item.crop_translation, item.image,
+                                                                   item.image_shape)
+    item.image = None
+    return item
+
+
+def create_export(exporter):
+    def export(item):
+        exporter.export(item.name, item.teeth, item.image_shape)
+        item.teeth = None
+        return item.path
+    return export
+
+
+def find_radiographs(inputs):
+    '''
+    Expands directories to radiographs they contain.
+    :param inputs: list of radiograph files and directories
+    :return: list of paths
+    '''
+    paths = list()
+    for path in inputs:
+        if os.path.isdir(path):
+            paths.extend(sorted(glob.glob(os.path.join(path, "*.tif"))))
+        else:
+            paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Segments incisors in radiographs. For every radiograph, landmarks "
+                                                 "and segmentation of the 8 teeth are exported.")
+    parser.add_argument("inputs", nargs="+", help="radiograph files or directories with .tif radiographs")
+    parser.add_argument("--model", default="./data/segmentation.model",
+                        help="trained model file, it's created from the data set if it doesn't exist")
+    parser.add_argument("--threshold", type=float, default=0.9, help="PCA threshold used when training the model")
+    parser.add_argument("--output", default="./data/Out", help="directory for exported results")
+    parser.add_argument("--segmentation-export", choices=SegmentationExporter.segmentation_modes,
+                        default=Config.segmentation_export,
+                        help="one image with labels of all teeth, one image with bit per tooth or image per tooth")
+    parser.add_argument("--landmarks-export", choices=SegmentationExporter.landmarks_modes,
+                        default=Config.landmarks_export,
+                        help="one compressed file per radiograph or text file per tooth")
+    parser.add_argument("--queue-size", type=int, default=4, help="maximum number of radiographs waiting for a stage")
+    parser.add_argument("--decode-workers", type=int, default=1)
+    parser.add_argument("--filter-workers", type=int, default=2)
+    parser.add_argument("--pose-workers", type=int, default=1)
+    parser.add_argument("--search-workers", type=int, default=4)
+    parser.add_argument("--export-workers", type=int, default=1)
+    parser.add_argument("--initial-poses", choices=("lines", "profiles"), default=Config.initial_pose_model,
+                        help="how initial poses are found: Hough lines between teeth or search at the coarsest level")
+    parser.add_argument("--starts", type=int, default=1,
+                        help="number of perturbed initial poses searched for every tooth, the best one is kept")
+    parser.add_argument("--search-budget", type=float, help="time limit of search of one tooth in seconds")
+    parser.add_argument("--image-budget", type=float,
+                        help="time limit of search of all teeth of one radiograph in seconds")
+    args = parser.parse_args()
+    Config.initial_pose_model = args.initial_poses
+
+    model = SegmentationModel.load_or_create(args.model, args.threshold)
+    if args.initial_poses == "profiles" and not model.supports_profile_poses():
+        parser.error("--initial-poses profiles needs model trained with appearance or PCA landmark model")
+    paths = find_radiographs(args.inputs)
+    print "Segmenting %d radiographs." % len(paths)
+
+    def find_poses(item):
+        item.initial_poses = model.find_initial_poses(item.pyramid)
+        return item
+
+    def search(item):
+        budget = None
+        if args.search_budget is not None or args.image_budget is not None:
+            deadline = time.time() + args.image_budget if args.image_budget is not None else None
+            budget = SearchBudget(args.search_budget, deadline=deadline)
+        item.converged = list()
+        item.teeth = model.segment(item.pyramid, item.initial_poses, budget=budget, converged=item.converged,
+                                   starts_count=args.starts)
+        item.pyramid = None
+        if not all(item.converged):
+            print "%s: %d of %d teeth didn't converge" % (item.name, item.converged.count(False), len(item.converged))
+        return item
+
+    pipeline = Pipeline(args.queue_size)
+    pipeline.add_stage("decode", decode, args.decode_workers)
+    pipeline.add_stage("filter", build_pyramid, args.filter_workers)
+    pipeline.add_stage("pose", find_poses, args.pose_workers)
+    pipeline.add_stage("search", search, args.search_workers)
+    # Export stage only queues the teeth, they are rasterized and written by the exporter thread
+    exporter = SegmentationExporter(args.output, args.segmentation_export, args.landmarks_export, args.queue_size)
+    pipeline.add_stage("export", create_export(exporter), args.export_workers)
+
+    start = time.time()
+    pipeline.run(BatchItem(path) for path in paths)
+    exporter.close()
+    pipeline.print_report(time.time() - start)
@@ -0,0 +1,66 @@
+import multiprocessing
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from src.filter import Filter
+from src.filterexecutor import FilterExecutor
+from src.radiograph import Radiograph
+
+__author__ = "Ivan Sevcik"
+
+
+def measure(function, repeats):
+    '''
+    Measures the best time of several calls of function.
+    :param function: Function without parameters.
+    :param repeats: Number of calls.
+    :return: tuple of best time in seconds and result of last call
+    '''
+    best_time = float("inf")
+    result = None
+    for i in range(0, repeats):
+        start = time.time()
+        result = function()
+        best_time = min(best_time, time.time() - start)
+    return best_time, result
+
+
+if __name__ == '__main__':
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else multiprocessing.cpu_count()
+    tile_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    repeats = 3
+
+    # Parallelism is provided only by the executor, so internal OpenCV threads must not interfere
+    cv2.setNumThreads(1)
+
+    radiograph = Radiograph()
+    radiograph.load(0)
+    # Whole uncropped radiograph is filtered
+    image = radiograph.image
+    print "Image size: %dx%d, tile size: %d" % (image.shape[1], image.shape[0], tile_size)
+
+    # Every processing mode is checked, tiled np.float32 results are allowed to differ within tolerance
+    for dtype, quantize in ((np.float64, False), (np.float64, True), (np.float32, False), (np.float32, True)):
+        rtol, atol = FilterExecutor.get_tolerance(dtype, quantize)
+        print
+        print "Type: %s%s, tolerance: rtol=%g, atol=%g" % (np.dtype(dtype).name, " quantized" if quantize else "",
+                                                           rtol, atol)
+        reference_time, reference = measure(lambda: Filter.process_image(image, dtype=dtype, quantize=quantize),
+                                            repeats)
+
+        print "Workers | Time [s] | Speedup | Identical | Max diff | Within tolerance"
+        print "-" * 69
+        print "{0: >7} | {1: >8.3f} | {2: >7.2f} | {3: >9} | {4: >8} | {5: >16}".format("untiled", reference_time, 1.0,
+                                                                                      "-", "-", "-")
+        for workers in range(1, max_workers + 1):
+            executor = FilterExecutor(workers, tile_size)
+            tiled_time, result = measure(lambda: executor.process_image(image, dtype=dtype, quantize=quantize),
+                                         repeats)
+            executor.close()
+            max_difference = np.max(np.abs(reference.astype(np.float64) - result.astype(np.float64)))
+            print "{0: >7} | {1: >8.3f} | {2: >7.2f} | {3: >9} | {4: >8.2g} | {5: >16}".format(
+                workers, tiled_time, reference_time / tiled_time, np.array_equal(reference, result), max_difference,
+                np.allclose(result.astype(np.float64), reference.astype(np.float64), rtol, atol))
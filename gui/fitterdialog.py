@@ -91,6 +91,24 @@ class Ui_fitterDialog(object):
         self.startingPoseSpinBox.setObjectName("startingPoseSpinBox")
         self.horizontalLayout_5.addWidget(self.startingPoseSpinBox)
         self.verticalLayout_5.addLayout(self.horizontalLayout_5)
+        self.horizontalLayout_6 = QtWidgets.QHBoxLayout()
+        self.horizontalLayout_6.setContentsMargins(-1, 0, -1, -1)
+        self.horizontalLayout_6.setObjectName("horizontalLayout_6")
+        self.fullSpeedCheckBox = QtWidgets.QCheckBox(self.groupBox_2)
+        self.fullSpeedCheckBox.setChecked(True)
+        self.fullSpeedCheckBox.setObjectName("fullSpeedCheckBox")
+        self.horizontalLayout_6.addWidget(self.fullSpeedCheckBox)
+        self.budgetSpinBox = QtWidgets.QDoubleSpinBox(self.groupBox_2)
+        self.budgetSpinBox.setMaximum(60.0)
+        self.budgetSpinBox.setSingleStep(0.1)
+        self.budgetSpinBox.setObjectName("budgetSpinBox")
+        self.horizontalLayout_6.addWidget(self.budgetSpinBox)
+        spacerItem2 = QtWidgets.QSpacerItem(40, 20, QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Minimum)
+        self.horizontalLayout_6.addItem(spacerItem2)
+        self.replayButton = QtWidgets.QPushButton(self.groupBox_2)
+        self.replayButton.setObjectName("replayButton")
+        self.horizontalLayout_6.addWidget(self.replayButton)
+        self.verticalLayout_5.addLayout(self.horizontalLayout_6)
         self.verticalLayout_3.addWidget(self.groupBox_2)
         self.paramsScrollArea = QtWidgets.QScrollArea(self.groupBox)
         self.paramsScrollArea.setWidgetResizable(True)
@@ -103,8 +121,8 @@ class Ui_fitterDialog(object):
         self.paramsScrollArea.setWidget(self.paramsScrollAreaContents)
         self.verticalLayout_3.addWidget(self.paramsScrollArea)
         self.verticalLayout_2.addWidget(self.groupBox)
-        spacerItem2 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
-        self.verticalLayout_2.addItem(spacerItem2)
+        spacerItem3 = QtWidgets.QSpacerItem(20, 40, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
+        self.verticalLayout_2.addItem(spacerItem3)
         self.horizontalLayout.addLayout(self.verticalLayout_2)
         self.verticalLayout.addLayout(self.horizontalLayout)
         self.buttonBox = QtWidgets.QDialogButtonBox(fitterDialog)
@@ -132,4 +150,9 @@ class Ui_fitterDialog(object):
         self.animateButton.setText(_translate("fitterDialog", "Animate"))
         self.fullAsmCheckBox.setText(_translate("fitterDialog", "Perform full algorithm"))
         self.label_3.setText(_translate("fitterDialog", "Starting pose"))
+        self.fullSpeedCheckBox.setText(_translate("fitterDialog", "Run at full speed"))
+        self.budgetSpinBox.setSpecialValueText(_translate("fitterDialog", "No time limit"))
+        self.budgetSpinBox.setPrefix(_translate("fitterDialog", "Time limit: "))
+        self.budgetSpinBox.setSuffix(_translate("fitterDialog", " s"))
+        self.replayButton.setText(_translate("fitterDialog", "Replay"))
 
@@ -8,7 +8,10 @@ from PyQt5.QtWidgets import QGraphicsScene, QApplication
 from src.ActiveShapeModel import ActiveShapeModel
 from src.InitialPoseModel import InitialPoseModel
 from src.StatisticalShapeModel import StatisticalShapeModel
+from src.config import Config
 from src.datamanager import DataManager
+from src.evaluation import SegmentationEvaluator, EvaluationResults
+from src.segmentationexporter import SegmentationExporter
 from src.simplescenewindow import SimpleSceneWindow
 from src.tooth import Tooth
 from src.utils import toQImage
@@ -20,7 +23,7 @@ def process_jaw(data_manager):
     '''
     Performs learning from data and search by ASM for jaw currently selected in data manager
     :param data_manager: Data manager supplying training data and images
-    :return: A set of teeth that were found in image
+    :return: A set of teeth that were found in image and shape of the image
     '''
     pca = StatisticalShapeModel.create(data_manager)
     pca.threshold(0.9)
@@ -36,7 +39,7 @@ def process_jaw(data_manager):
     first_resolution_level = asm.multi_resolution_framework.get_level(0)
     first_resolution_image = first_resolution_level.default_image
     initial_pose_model = InitialPoseModel(data_manager)
-    initial_poses = initial_pose_model.find(first_resolution_image)
+    initial_poses = initial_pose_model.find(first_resolution_image, first_resolution_level.image)
 
     # Prepare list for gathering results
     results = []
@@ -46,12 +49,19 @@ def process_jaw(data_manager):
         print "Performing search #%d." % i
         asm.set_up(position, scale, rotation)
         result = asm.run()
+        if Config.lazy_filtering:
+            print "Filtered fraction of levels: %s" % ", ".join("%.3f" % f for f in asm.search_filtered_fractions)
+        print "Sampled profiles of levels: %s" % ", ".join("%d/%d" % tuple(c) for c in asm.search_profile_counts)
+        print "Sampled pixels of levels: %s" % ", ".join("%d/%d" % tuple(c) for c in asm.search_sample_counts)
+        print "Steps of levels: %s" % ", ".join("%d" % c for c in asm.search_iteration_counts)
+        if Config.adaptive_search:
+            print "Frozen fraction of levels: %s" % ", ".join("%.2f" % f for f in asm.search_frozen_fractions)
 
         # Save the result to list
         results.append(result)
 
     print "All searching done."
-    return results
+    return results, reference_image.shape
 
 
 def measure_errors(data_manager, search_results):
@@ -106,28 +116,51 @@ def visualize_data(window, data_manager, search_results):
     window.set_scene(scene)
 
 
-def export_data(data_manager, search_results):
-    assert isinstance(data_manager, DataManager)
-    reference_radiograph = data_manager.left_out_radiograph
-    reference_image = reference_radiograph.image
+def export_data(search_results, image_shape):
+    '''
+    Exports teeth of both jaws found in the left out radiograph. Format is controlled by Config.segmentation_export and
+    Config.landmarks_export.
+    :param search_results: All 8 teeth found in the radiograph.
+    :param image_shape: Shape of the radiograph image, known from the search, so the image isn't decoded again.
+    '''
+    exporter = SegmentationExporter(segmentation_mode=Config.segmentation_export,
+                                    landmarks_mode=Config.landmarks_export)
+    exporter.export("loo", search_results, image_shape)
+    exporter.close()
 
-    for i, tooth in enumerate(search_results):
-        assert isinstance(tooth, Tooth)
-        real_tooth_idx = data_manager.selector[i] + 1
-        tooth.export_landmarks("loo-%d" % real_tooth_idx)
-        tooth.export_segmentation("loo-%d" % real_tooth_idx, reference_image.shape)
+
+def evaluate_segmentation(data_manager, search_results, evaluation_results=None):
+    '''
+    Compares teeth of both jaws found in the left out radiograph with reference segmentations and prints the metrics.
+    :param data_manager: Data manager supplying the left out radiograph.
+    :param search_results: All 8 teeth found in the radiograph.
+    :param evaluation_results: EvaluationResults where to add the metrics, e.g. for computing totals.
+    '''
+    radiograph_idx = data_manager.left_out_radiograph.idx
+    tooth_indices = range(0, len(search_results))
+    metrics = SegmentationEvaluator().evaluate(radiograph_idx, tooth_indices, search_results)
+
+    fold_results = EvaluationResults()
+    fold_results.add(radiograph_idx, tooth_indices, metrics)
+    print "Segmentation results."
+    fold_results.print_summary()
+    print ""
+    if evaluation_results is not None:
+        evaluation_results.add(radiograph_idx, tooth_indices, metrics)
 
 
-def compute_results(data_manager, all, export_flag):
+def compute_results(data_manager, all, export_flag, evaluation_results=None):
     '''
     Compute leave one out results for one leaved tooth.
     :param data_manager: Data manager instance initialized with leaved tooth.
     :param all:
+    :param export_flag: Boolean whether to export found teeth.
+    :param evaluation_results: EvaluationResults where to add segmentation metrics of found teeth.
     :return:
     '''
     print "Processing upper jaw."
     data_manager.select_upper_jaw()
-    upper_jaw_teeth = process_jaw(data_manager)
+    upper_jaw_teeth, image_shape = process_jaw(data_manager)
 
     print "Results upper jaw."
     upper_errors = measure_errors(data_manager, upper_jaw_teeth)
@@ -137,12 +170,10 @@ def compute_results(data_manager, all, export_flag):
         visualize_data(window, data_manager, upper_jaw_teeth)
         window.show()
         myApp.exec_()
-    if export_flag:
-        export_data(data_manager, upper_jaw_teeth)
 
     print "Processing lower jaw."
     data_manager.select_lower_jaw()
-    lower_jaw_teeth = process_jaw(data_manager)
+    lower_jaw_teeth, _ = process_jaw(data_manager)
 
     print "Results lower jaw."
     lower_errors = measure_errors(data_manager, lower_jaw_teeth)
@@ -152,46 +183,51 @@ def compute_results(data_manager, all, export_flag):
         visualize_data(window, data_manager, lower_jaw_teeth)
         window.show()
         myApp.exec_()
+    evaluate_segmentation(data_manager, upper_jaw_teeth + lower_jaw_teeth, evaluation_results)
     if export_flag:
-        export_data(data_manager, lower_jaw_teeth)
+        export_data(upper_jaw_teeth + lower_jaw_teeth, image_shape)
     return upper_errors, lower_errors
 
 
-# Create main app
-myApp = QApplication(sys.argv)
-window = SimpleSceneWindow()
-computeTotal = False
-
-leave_out = int(input("Enter radiograph to leave out (1-14, 0 for all): ")) - 1
-if leave_out > 14 or leave_out < -1:
-    print 'Invalid selection'
-    exit()
-if leave_out == -1:
-    computeTotal = True
-
-upper_errors_sum = None
-lower_errors_sum = None
-if computeTotal:
-    for leave_out in range(0,14):
-        print "Leaving out image #",leave_out+1
+if __name__ == '__main__':
+    # Create main app
+    myApp = QApplication(sys.argv)
+    window = SimpleSceneWindow()
+    computeTotal = False
+
+    leave_out = int(input("Enter radiograph to leave out (1-14, 0 for all): ")) - 1
+    if leave_out > 14 or leave_out < -1:
+        print 'Invalid selection'
+        exit()
+    if leave_out == -1:
+        computeTotal = True
+
+    upper_errors_sum = None
+    lower_errors_sum = None
+    evaluation_results = EvaluationResults()
+    if computeTotal:
+        for leave_out in range(0,14):
+            print "Leaving out image #",leave_out+1
+            data_manager = DataManager(leave_out)
+            upper_errors, lower_errors = compute_results(data_manager, True, False, evaluation_results)
+            if upper_errors_sum is None:
+                upper_errors_sum = upper_errors
+            else:
+                upper_errors_sum = [(a+c, b+d) for (a,b),(c,d) in zip(upper_errors_sum, upper_errors)]
+            if lower_errors_sum is None:
+                lower_errors_sum = lower_errors
+            else:
+                lower_errors_sum = [(a+c, b+d) for (a,b),(c,d) in zip(lower_errors_sum, lower_errors)]
+        print "#" * 50
+        print "TOTAL Results upper jaw."
+        print_errors(upper_errors_sum, divider=14)
+        print "TOTAL Results lower jaw."
+        print_errors(lower_errors_sum, divider=14)
+        print "TOTAL Segmentation results."
+        evaluation_results.print_summary()
+    else:
+        export_flag = (raw_input("Should the result be exported? (n/y): ") == "y")
         data_manager = DataManager(leave_out)
-        upper_errors, lower_errors = compute_results(data_manager, True, False)
-        if upper_errors_sum is None:
-            upper_errors_sum = upper_errors
-        else:
-            upper_errors_sum = [(a+c, b+d) for (a,b),(c,d) in zip(upper_errors_sum, upper_errors)]
-        if lower_errors_sum is None:
-            lower_errors_sum = lower_errors
-        else:
-            lower_errors_sum = [(a+c, b+d) for (a,b),(c,d) in zip(lower_errors_sum, upper_errors)]
-    print "#" * 50
-    print "TOTAL Results upper jaw."
-    print_errors(upper_errors_sum, divider=14)
-    print "TOTAL Results lower jaw."
-    print_errors(lower_errors_sum, divider=14)
-else:
-    export_flag = (raw_input("Should the result be exported? (n/y): ") == "y")
-    data_manager = DataManager(leave_out)
-    compute_results(data_manager, False, export_flag)
-    if export_flag:
-        print "Data have been exported to .\data\Out"
+        compute_results(data_manager, False, export_flag)
+        if export_flag:
+            print "Data have been exported to .\data\Out"
@@ -1,4 +1,5 @@
 import sys
+from collections import OrderedDict
 from copy import deepcopy
 
 import cv2
@@ -15,8 +16,11 @@ from src.datamanager import DataManager
 from src.filteringdialog import FilteringDialog
 from src.fitterdialog import FitterDialog
 from src.interactivegraphicsscene import InteractiveGraphicsScene
+from src.modelregistry import ModelRegistry
 from src.pcavisualizerdialog import PcaVisualizerDialog
+from src.radiographprefetcher import RadiographPrefetcher
 from src.sampler import Sampler
+from src.toothitem import ToothItem
 from src.trainerdialog import TrainerDialog
 from src.utils import toQImage
 
@@ -34,6 +38,16 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     pca = None
     mean_shape = None
 
+    # Items kept in the scene between redraws
+    pixmap_item = None
+    displayed_image = None
+    tooth_items = None
+
+    # Radiograph images are prepared in background and converted pixmaps are cached
+    prefetcher = None
+    pixmap_cache = None
+    max_cached_pixmaps = 8
+
     def __init__(self):
         super(MainWindow, self).__init__()
 
@@ -42,9 +56,18 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.scene = InteractiveGraphicsScene()
         # self.scene.clicked.connect()
+        self.pixmap_item = self.scene.addPixmap(QPixmap())
+        self.tooth_items = list()
 
         self.data_manager = DataManager()
 
+        self.pixmap_cache = OrderedDict()
+        self.prefetcher = RadiographPrefetcher(self.data_manager.radiographs)
+        self.prefetcher.image_ready.connect(self._image_ready)
+        self.prefetcher.start()
+        # Prepare models for all jaw selections in background, so the dialogs don't have to wait for training
+        ModelRegistry.get().preload(self.data_manager, [0.9], [range(0, 8), range(0, 4), range(4, 8)])
+
         self.graphicsView.setScene(self.scene)
 
         self.display_radiograph(self.current_sample)
@@ -130,32 +153,71 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # Show new selection
         self.display_radiograph(self.current_sample)
 
-    def display_radiograph(self, idx):
-        self.scene.clear()
+    def closeEvent(self, event):
+        self.prefetcher.stop()
 
+    def display_radiograph(self, idx):
         radiograph = self.data_manager.radiographs[idx]
-
-        image = radiograph.image
         teeth = self.data_manager.get_all_teeth_from_radiograph(radiograph, True)
 
         # Apply sampling level
-        for i in range(0, self.sampling_level):
-            image, teeth = MultiResolutionFramework.downsample(image, teeth)
+        for tooth in teeth:
+            for i in range(0, self.sampling_level):
+                tooth.downsample_transform()
 
-        # Load and draw image
-        qimg = toQImage(image)
-        size = (qimg.width(), qimg.height())
-        self.scene.addPixmap(QPixmap.fromImage(qimg))
+        # Draw image if it's already prepared. Otherwise the previous one is shown until _image_ready is called.
+        self.prefetcher.request(idx)
+        self._update_pixmap(idx)
 
-        for tooth in teeth:
-            tooth.draw(self.scene, True, True, True)
+        # Update items of teeth and hide those that are not needed
+        while len(self.tooth_items) < len(teeth):
+            self.tooth_items.append(ToothItem(self.scene, True, True, True))
+        for i, tooth_item in enumerate(self.tooth_items):
+            if i < len(teeth):
+                tooth_item.update(teeth[i])
+            tooth_item.set_visible(i < len(teeth))
 
         # Set generated scene into the view
-        self.scene.setSceneRect(QRectF(0, 0, size[0], size[1]))
+        self._update_scene_rect()
         self.graphicsView.resetTransform()
         self.graphicsView.centerOn(self.scene.width() / 2, self.scene.height() / 2)
         self.current_scale = 0
         self.zoomSlider.setValue(0)
+
+    def _update_pixmap(self, idx):
+        '''
+        Shows image of the radiograph at current sampling level, if it's cached or already prepared by prefetcher.
+        :param idx: Index of radiograph.
+        :return: True if the shown image has changed.
+        '''
+        key = (idx, self.sampling_level)
+        if self.displayed_image == key:
+            return False
+
+        pixmap = self.pixmap_cache.pop(key, None)
+        if pixmap is None:
+            qimg = self.prefetcher.get_image(idx, self.sampling_level)
+            if qimg is None:
+                return False
+            pixmap = QPixmap.fromImage(qimg)
+
+        # Reinsert to mark as most recently used and drop the oldest ones
+        self.pixmap_cache[key] = pixmap
+        while len(self.pixmap_cache) > self.max_cached_pixmaps:
+            self.pixmap_cache.popitem(last=False)
+
+        self.pixmap_item.setPixmap(pixmap)
+        self.displayed_image = key
+        return True
+
+    def _image_ready(self, idx):
+        if idx == self.current_sample and self._update_pixmap(idx):
+            self._update_scene_rect()
+
+    def _update_scene_rect(self):
+        pixmap = self.pixmap_item.pixmap()
+        size = (pixmap.width(), pixmap.height())
+        self.scene.setSceneRect(QRectF(0, 0, size[0], size[1]))
         self.update_size_label(size)
 
     def update_size_label(self, size):
@@ -0,0 +1,73 @@
+import subprocess
+import sys
+
+import numpy as np
+
+from src.config import Config
+
+__author__ = "Ivan Sevcik"
+
+# Mode name: image dtype, quantization
+modes = [("float64", np.float64, False),
+         ("float32", np.float32, False),
+         ("uint16", np.float32, True)]
+
+
+def get_peak_rss():
+    '''
+    Returns peak resident set size of the current process in megabytes.
+    :return: Peak RSS or None if it can't be determined on this platform.
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def run_fold(mode_name, leave_out):
+    '''
+    Runs one leave one out fold for both jaws in given processing mode and prints the measurements.
+    :param mode_name: Name of the mode from 'modes'.
+    :param leave_out: Index of radiograph that is left out.
+    '''
+    from leaveoneout import process_jaw
+    from src.datamanager import DataManager
+
+    _, Config.image_dtype, Config.quantize_images = [mode for mode in modes if mode[0] == mode_name][0]
+
+    data_manager = DataManager(leave_out)
+    data_manager.select_upper_jaw()
+    process_jaw(data_manager)
+    data_manager.select_lower_jaw()
+    process_jaw(data_manager)
+
+    peak_rss = get_peak_rss()
+    print "PEAK_RSS %s" % ("n/a" if peak_rss is None else "%.1f" % peak_rss)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == "--fold":
+        run_fold(sys.argv[2], int(sys.argv[3]))
+        exit()
+
+    leave_out = int(sys.argv[1]) - 1 if len(sys.argv) > 1 else 0
+
+    # Every mode runs in its own process so that peak RSS values are not affected by each other
+    results = []
+    for mode_name, _, _ in modes:
+        print "Running fold #%d in %s mode." % (leave_out + 1, mode_name)
+        output = subprocess.check_output([sys.executable, __file__, "--fold", mode_name, str(leave_out)])
+        peak_rss = None
+        for line in output.splitlines():
+            if line.startswith("PEAK_RSS"):
+                peak_rss = line.split()[1]
+        results.append((mode_name, peak_rss))
+
+    print "Mode    | Peak RSS [MB]"
+    print "-" * 23
+    for mode_name, peak_rss in results:
+        print "{0: <7} | {1: >13}".format(mode_name, peak_rss)
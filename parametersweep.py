@@ -0,0 +1,359 @@
+import argparse
+import csv
+import itertools
+import multiprocessing
+import random
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from src.ActiveShapeModel import ActiveShapeModel
+from src.InitialPoseModel import InitialPoseModel
+from src.MultiresFramework import MultiResolutionFramework, ImagePyramid, ResolutionLevel
+from src.StatisticalShapeModel import StatisticalShapeModel
+from src.datamanager import DataManager
+from src.filter import Filter
+
+__author__ = "Ivan Sevcik"
+
+# Filter presets and model parameters of a point are used at the finest level, coarser levels keep the defaults
+SweepPoint = namedtuple("SweepPoint", ["median_kernel", "bilateral_kernel", "bilateral_color", "k", "m", "threshold",
+                                       "levels"])
+SweepResult = namedtuple("SweepResult", ["point", "avg_error", "max_error", "search_time", "total_time"])
+
+default_filter_presets = list(MultiResolutionFramework._filter_presets)
+default_model_params = list(MultiResolutionFramework._model_params)
+jaw_selectors = [range(0, 4), range(4, 8)]
+
+
+class SweepCache(object):
+    """
+    Intermediate results that don't depend on all swept parameters, kept by every worker process. Cropped images and
+    shape models are kept for the whole sweep, filtered images only while the filter presets don't change.
+    """
+    data_managers = None
+    _crops = None
+    _filtered = None
+    _filtered_presets = None
+    _pcas = None
+    _initial_poses = None
+    _landmark_models = None
+
+    def __init__(self):
+        self.data_managers = dict()
+        self._crops = dict()
+        self._filtered = dict()
+        self._pcas = dict()
+        self._initial_poses = dict()
+        self._landmark_models = dict()
+
+    def get_data_manager(self, fold):
+        '''
+        :param fold: Index of radiograph that is left out.
+        :return: DataManager instance for the fold
+        '''
+        if fold not in self.data_managers:
+            self.data_managers[fold] = DataManager(fold)
+        return self.data_managers[fold]
+
+    def use_filter_presets(self, presets):
+        '''
+        Drops filtered images that were created with other presets.
+        :param presets: Filter presets of all levels that will be used next.
+        '''
+        presets = tuple(presets)
+        if presets != self._filtered_presets:
+            self._filtered_presets = presets
+            self._filtered = dict((key, image) for key, image in self._filtered.iteritems() if key[2] in presets)
+
+    def get_default_images(self, radiograph, levels):
+        '''
+        Returns cropped and subsampled, but not filtered, images of the radiograph.
+        :param radiograph: Radiograph instance
+        :param levels: Number of levels.
+        :return: tuple of crop translation and list of images
+        '''
+        entry = self._crops.get(radiograph.idx)
+        if entry is None:
+            image = radiograph.image
+            entry = (-Filter.get_cropping_region(image).left_top, [Filter.crop_image(image)])
+            self._crops[radiograph.idx] = entry
+
+        crop_translation, images = entry
+        while len(images) < levels:
+            images.append(MultiResolutionFramework.downsample_image(images[-1]))
+        return crop_translation, images[:levels]
+
+    def get_filtered_image(self, radiograph, level):
+        '''
+        Returns image of the radiograph filtered with current presets of the level.
+        :param radiograph: Radiograph instance
+        :param level: Index of the level.
+        :return: filtered image
+        '''
+        key = (radiograph.idx, level, MultiResolutionFramework.get_filter_presets(level))
+        image = self._filtered.get(key)
+        if image is None:
+            _, images = self.get_default_images(radiograph, level + 1)
+            image = MultiResolutionFramework.filter_image(images[level], level)
+            self._filtered[key] = image
+        return image
+
+    def get_pyramid(self, radiograph, levels):
+        crop_translation, default_images = self.get_default_images(radiograph, levels)
+        images = [self.get_filtered_image(radiograph, level) for level in range(0, levels)]
+        return ImagePyramid(crop_translation, images, default_images)
+
+    def get_pca(self, fold, data_manager, threshold):
+        key = (fold, tuple(data_manager.selector), threshold)
+        pca = self._pcas.get(key)
+        if pca is None:
+            pca = StatisticalShapeModel.create(data_manager)
+            pca.threshold(threshold)
+            self._pcas[key] = pca
+        return pca
+
+    def get_initial_poses(self, fold, data_manager):
+        key = (fold, tuple(data_manager.selector))
+        poses = self._initial_poses.get(key)
+        if poses is None:
+            _, images = self.get_default_images(data_manager.left_out_radiograph, 1)
+            poses = InitialPoseModel(data_manager).find(images[0])
+            self._initial_poses[key] = poses
+        return poses
+
+    def get_landmark_model(self, fold, data_manager, level):
+        '''
+        Returns landmark model of the level trained with current presets and model parameters.
+        :param fold: Index of radiograph that is left out.
+        :param data_manager: Data manager of the fold with selected jaw.
+        :param level: Index of the level.
+        :return: trained landmark model
+        '''
+        k, m = MultiResolutionFramework._model_params[level]
+        key = (fold, tuple(data_manager.selector), level, MultiResolutionFramework.get_filter_presets(level), k, m)
+        landmark_model = self._landmark_models.get(key)
+        if landmark_model is None:
+            landmark_model = ResolutionLevel.create_landmark_model((k, m))
+            for radiograph in data_manager.radiographs:
+                crop_translation, _ = self.get_default_images(radiograph, level + 1)
+                teeth = data_manager.get_all_teeth_from_radiograph(radiograph, True)
+                for tooth in teeth:
+                    tooth.translate(crop_translation)
+                    for i in range(0, level):
+                        tooth.downsample_transform()
+                landmark_model.add_training_data(teeth, self.get_filtered_image(radiograph, level))
+            landmark_model.finish_training()
+            self._landmark_models[key] = landmark_model
+        return landmark_model
+
+
+def apply_point(point):
+    '''
+    Sets filter presets, model parameters and number of levels of the point to MultiResolutionFramework.
+    :param point: SweepPoint instance
+    '''
+    MultiResolutionFramework._filter_presets = [(point.median_kernel, point.bilateral_kernel, point.bilateral_color)] + \
+                                               default_filter_presets[1:]
+    MultiResolutionFramework._model_params = [(point.k, point.m)] + default_model_params[1:]
+    MultiResolutionFramework.levels_count = point.levels
+
+
+def evaluate_point(cache, point, folds):
+    '''
+    Performs leave one out search of both jaws with parameters of the point.
+    :param cache: SweepCache of the current process.
+    :param point: SweepPoint instance
+    :param folds: Indices of radiographs that are left out.
+    :return: SweepResult instance
+    '''
+    start = time.time()
+    apply_point(point)
+    cache.use_filter_presets(MultiResolutionFramework._filter_presets[:point.levels])
+
+    errors = []
+    search_time = 0
+    for fold in folds:
+        data_manager = cache.get_data_manager(fold)
+        for selector in jaw_selectors:
+            data_manager.selector = selector
+            pca = cache.get_pca(fold, data_manager, point.threshold)
+            landmark_models = [cache.get_landmark_model(fold, data_manager, level) for level in range(0, point.levels)]
+            pyramid = cache.get_pyramid(data_manager.left_out_radiograph, point.levels)
+            initial_poses = cache.get_initial_poses(fold, data_manager)
+            reference_teeth = data_manager.get_all_teeth_from_radiograph(data_manager.left_out_radiograph, True)
+
+            # Only the search itself is timed, everything else is shared by multiple points
+            search_start = time.time()
+            asm = ActiveShapeModel(data_manager, pca, landmark_models)
+            asm.set_pyramid_to_search(pyramid)
+            for i, (position, scale, rotation) in enumerate(initial_poses):
+                asm.set_up(position, scale, rotation)
+                errors.append(reference_teeth[i].measure_error(asm.run()))
+            search_time += time.time() - search_start
+
+    avg_error, max_error = np.mean(errors, axis=0)
+    return SweepResult(point, avg_error, max_error, search_time / len(folds), time.time() - start)
+
+
+_worker_cache = None
+_worker_folds = None
+
+
+def _init_worker(folds):
+    global _worker_cache, _worker_folds
+    _worker_cache = SweepCache()
+    _worker_folds = folds
+
+
+def _evaluate_points(points):
+    return [evaluate_point(_worker_cache, point, _worker_folds) for point in points]
+
+
+def create_points(grid, samples=None, seed=0):
+    '''
+    Creates all points of the grid or their random subset.
+    :param grid: Dictionary with list of values for every field of SweepPoint.
+    :param samples: Number of randomly selected points. If None, all points are used.
+    :param seed: Seed of random selection.
+    :return: list of SweepPoint
+    '''
+    points = [SweepPoint(*values) for values in itertools.product(*[grid[name] for name in SweepPoint._fields])]
+    if samples is not None and samples < len(points):
+        points = random.Random(seed).sample(points, samples)
+    return points
+
+
+def create_tasks(points, workers):
+    '''
+    Groups points with same filter presets, so every task filters each image only once. If there are less groups than
+    workers, the groups are split.
+    :param points: list of SweepPoint
+    :param workers: Number of worker processes.
+    :return: list of tasks, each being a list of points
+    '''
+    groups = dict()
+    for point in points:
+        groups.setdefault((point.median_kernel, point.bilateral_kernel, point.bilateral_color), []).append(point)
+
+    splits = max(1, workers // len(groups))
+    tasks = []
+    for key in sorted(groups):
+        # Points differing only in PCA threshold share landmark models, so they are kept together
+        group = sorted(groups[key], key=lambda p: (p.levels, p.k, p.m, p.threshold))
+        chunk_size = -(-len(group) // splits)
+        tasks.extend(group[i:i + chunk_size] for i in range(0, len(group), chunk_size))
+    return tasks
+
+
+def run_sweep(points, folds, workers):
+    '''
+    Evaluates all points, in parallel if more workers are requested.
+    :param points: list of SweepPoint
+    :param folds: Indices of radiographs that are left out.
+    :param workers: Number of worker processes.
+    :return: list of SweepResult
+    '''
+    tasks = create_tasks(points, workers)
+    results = []
+    if workers == 1:
+        _init_worker(folds)
+        task_results = itertools.imap(_evaluate_points, tasks)
+    else:
+        pool = multiprocessing.Pool(workers, _init_worker, (folds,))
+        task_results = pool.imap_unordered(_evaluate_points, tasks)
+
+    for task_result in task_results:
+        results.extend(task_result)
+        print "### Evaluated %d of %d points" % (len(results), len(points))
+
+    if workers != 1:
+        pool.close()
+        pool.join()
+    return results
+
+
+def rank_results(results):
+    '''
+    Sorts results by average error and search time and marks those for which no other result is both more precise and
+    faster.
+    :param results: list of SweepResult
+    :return: list of tuples (result, Boolean whether the result is Pareto optimal)
+    '''
+    results = sorted(results, key=lambda r: (r.avg_error, r.search_time))
+    ranked = []
+    best_time = float("inf")
+    for result in results:
+        ranked.append((result, result.search_time < best_time))
+        best_time = min(best_time, result.search_time)
+    return ranked
+
+
+def print_results(ranked):
+    print "Rank | Med | BiK | BiC |  k |  m | Thresh | Lvl | Avg error | Max error | Search [s] | Total [s] | Pareto"
+    print "-" * 103
+    for rank, (result, pareto) in enumerate(ranked):
+        point = result.point
+        print "{0: >4} | {1: >3} | {2: >3} | {3: >3} | {4: >2} | {5: >2} | {6: >6.3f} | {7: >3} | {8: >9.6f} | " \
+              "{9: >9.6f} | {10: >10.2f} | {11: >9.2f} | {12: >6}".format(
+               rank + 1, point.median_kernel, point.bilateral_kernel, point.bilateral_color, point.k, point.m,
+               point.threshold, point.levels, result.avg_error, result.max_error, result.search_time,
+               result.total_time, "*" if pareto else "")
+
+
+def write_results(ranked, path):
+    with open(path, "wb") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(list(SweepPoint._fields) + ["avg_error", "max_error", "search_time", "total_time", "pareto"])
+        for result, pareto in ranked:
+            writer.writerow(list(result.point) + [result.avg_error, result.max_error, result.search_time,
+                                                  result.total_time, int(pareto)])
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(",")]
+
+
+def _float_list(text):
+    return [float(value) for value in text.split(",")]
+
+
+if __name__ == '__main__':
+    median_kernel, bilateral_kernel, bilateral_color = default_filter_presets[0]
+    k, m = default_model_params[0]
+
+    parser = argparse.ArgumentParser(description="Evaluates leave one out error for a grid of parameters. Filter "
+                                                 "presets and k, m are used at the finest level. Lists of values are "
+                                                 "separated by commas.")
+    parser.add_argument("--median-kernel", type=_int_list, default=[median_kernel])
+    parser.add_argument("--bilateral-kernel", type=_int_list, default=[bilateral_kernel])
+    parser.add_argument("--bilateral-color", type=_int_list, default=[bilateral_color])
+    parser.add_argument("--k", type=_int_list, default=[k])
+    parser.add_argument("--m", type=_int_list, default=[m])
+    parser.add_argument("--threshold", type=_float_list, default=[0.9])
+    parser.add_argument("--levels", type=_int_list, default=[MultiResolutionFramework.levels_count])
+    parser.add_argument("--random", type=int, default=None, help="evaluate only this many randomly selected points")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--folds", type=_int_list, default=range(1, DataManager.number_of_radiographs + 1),
+                        help="radiographs to leave out (1-14)")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--csv", default=None, help="file where to write ranked results")
+    args = parser.parse_args()
+
+    if max(args.levels) > len(default_filter_presets):
+        parser.error("at most %d levels are supported" % len(default_filter_presets))
+    if any(kernel <= 1 or kernel % 2 == 0 for kernel in args.median_kernel):
+        parser.error("median kernel sizes must be odd and greater than 1")
+    if any(kernel <= 0 for kernel in args.bilateral_kernel):
+        parser.error("bilateral kernel sizes must be positive")
+
+    grid = dict((name, getattr(args, name)) for name in SweepPoint._fields)
+    points = create_points(grid, args.random, args.seed)
+    folds = [fold - 1 for fold in args.folds]
+    print "Evaluating %d points on %d folds with %d workers." % (len(points), len(folds), args.workers)
+
+    ranked = rank_results(run_sweep(points, folds, args.workers))
+    print_results(ranked)
+    if args.csv is not None:
+        write_results(ranked, args.csv)
@@ -0,0 +1,38 @@
+import argparse
+import os
+
+from src.segmentationmodel import SegmentationModel
+from src.segmentationserver import SegmentationServer, create_http_server
+
+__author__ = "Ivan Sevcik"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves segmentation of incisors over HTTP on localhost or Unix "
+                                                 "socket. Models are loaded only once at start.")
+    parser.add_argument("--model", default="./data/segmentation.model",
+                        help="trained model file, it's created from the data set if it doesn't exist")
+    parser.add_argument("--threshold", type=float, default=0.9, help="PCA threshold used when training the model")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", default=None, help="listen on this Unix socket instead of TCP port")
+    parser.add_argument("--workers", type=int, default=2, help="number of segmentation threads")
+    parser.add_argument("--max-batch", type=int, default=8, help="maximum number of requests processed together")
+    parser.add_argument("--batch-window", type=float, default=5, help="time in ms to wait for more requests")
+    args = parser.parse_args()
+
+    model = SegmentationModel.load_or_create(args.model, args.threshold)
+    segmentation_server = SegmentationServer(model, args.workers, args.max_batch, args.batch_window / 1000.0)
+
+    if args.socket is not None and os.path.exists(args.socket):
+        os.remove(args.socket)
+    http_server = create_http_server(segmentation_server, args.host, args.port, args.socket)
+    print "Listening on %s." % (args.socket if args.socket is not None else "http://%s:%d" % (args.host, args.port))
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        http_server.server_close()
+        if args.socket is not None:
+            os.remove(args.socket)
@@ -1,10 +1,14 @@
+import time
 from copy import deepcopy
 
 import cv2
 import numpy as np
 
 from src.MultiresFramework import MultiResolutionFramework
+from src.adaptivesearch import AdaptiveSearchState
+from src.config import Config
 from src.datamanager import DataManager
+from src.profilecache import ProfileCache
 from src.tooth import Tooth
 from src.utils import to_landmarks_format, StopIterationToken
 
@@ -21,6 +25,34 @@ class ActiveShapeModel(object):
     current_params = None
     current_level = 0
     max_steps_per_level = 100
+    profile_cache = None
+    search_state = None
+    # Number of profiles sampled during last step
+    recomputed_profiles = 0
+    # Fraction of image at each level that had to be filtered during last search
+    search_filtered_fractions = None
+    # Number of sampled profiles and number of profiles that would be sampled without cache at each level during last
+    # search
+    search_profile_counts = None
+    # Number of sampled pixels and number of pixels that would be sampled with full search ranges and without cache at
+    # each level during last search
+    search_sample_counts = None
+    # Number of steps and fraction of frozen landmarks at the end of each level during last search
+    search_iteration_counts = None
+    search_frozen_fractions = None
+    # Relative weights of levels, indexed by level. When the search has time budget, every level gets share of the
+    # remaining time given by its weight relative to the levels that are still to be searched. If None, the weights are
+    # expected times the levels need to converge, estimated from previous searches (see _get_default_level_weights).
+    level_time_weights = None
+    # Estimated duration of one step at each level, updated by every search, None until the level is searched
+    step_durations = None
+    # Estimated number of steps each level needs to converge, updated by searches where the level converged, None until
+    # the level converges for the first time
+    level_step_counts = None
+    # True if every level of last search finished by converging, False if some level ran out of steps or time
+    search_converged = None
+    # True if some level of last search was cut short by time budget
+    search_expired = None
 
     @property
     def current_image(self):
@@ -30,12 +62,20 @@ class ActiveShapeModel(object):
         """
         return self.multi_resolution_framework.get_level(self.current_level).image
 
-    def __init__(self, _data_manager, pca):
+    def __init__(self, _data_manager, pca, landmark_models=None):
+        """
+        :param _data_manager: Data manager supplying training data.
+        :param pca: Trained statistical shape model.
+        :param landmark_models: Already trained landmark models for every resolution level (see ModelRegistry). If None,
+                                the models are trained now.
+        """
         assert isinstance(_data_manager, DataManager)
         self.data_manager = _data_manager
         self.pca = pca
-        self.multi_resolution_framework = MultiResolutionFramework(self.data_manager)
-        self.multi_resolution_framework.train()
+        self.profile_cache = ProfileCache(Config.incremental_sampling)
+        self.multi_resolution_framework = MultiResolutionFramework(self.data_manager, landmark_models)
+        if landmark_models is None:
+            self.multi_resolution_framework.train()
 
     def set_image_to_search(self, image):
         """
@@ -44,6 +84,13 @@ class ActiveShapeModel(object):
         """
         self.multi_resolution_framework.set_radiograph_image(image)
 
+    def set_pyramid_to_search(self, pyramid):
+        """
+        Sets already processed image on which the active shape model search will be performed.
+        :param pyramid: ImagePyramid of the image to search (see MultiResolutionFramework.build_pyramid).
+        """
+        self.multi_resolution_framework.set_pyramid(pyramid)
+
     def set_up(self, translation=(0, 0), scale=1, rotation=0):
         """
         Sets up the initial shpae before performing search. The search always start from the mean shape and eigenvalues
@@ -56,6 +103,8 @@ class ActiveShapeModel(object):
         self.current_tooth = deepcopy(self.mean_tooth)
         self.current_tooth.transform(translation, scale, rotation)
         self.current_params = np.zeros(self.pca.eigen_values.shape)
+        self.profile_cache.reset()
+        self.search_state = None
 
     def make_step(self, phase=None):
         """
@@ -64,11 +113,22 @@ class ActiveShapeModel(object):
         instance are updated accordingly.
         :param phase: If None, whole algorithm is performed. If 0, only landmarks will be updated. If 1, everything
                       except landmark updates will be perfomed.
+        :return: Number of profiles that were sampled.
         """
+        self.recomputed_profiles = 0
+        self.profile_cache.incremental = Config.incremental_sampling
         if phase is None or phase == 0:
             # 1. Sample along normals and find best new position for points by comparing with model
             resolution_level = self.multi_resolution_framework.get_level(self.current_level)
-            new_tooth = resolution_level.update_tooth_landmarks(self.current_tooth)
+            if Config.adaptive_search:
+                search_state = self.get_search_state()
+                search_state.release_moved(self.current_tooth.landmarks)
+                new_tooth = resolution_level.update_tooth_landmarks(self.current_tooth, self.profile_cache,
+                                                                    search_state.ranges, search_state.frozen)
+                search_state.update(self.current_tooth.landmarks, new_tooth.landmarks)
+            else:
+                new_tooth = resolution_level.update_tooth_landmarks(self.current_tooth, self.profile_cache)
+            self.recomputed_profiles = self.profile_cache.recomputed_count
         else:
             new_tooth = deepcopy(self.current_tooth)
 
@@ -93,6 +153,18 @@ class ActiveShapeModel(object):
             self.current_params = b
 
         self.current_tooth = new_tooth
+        return self.recomputed_profiles
+
+    def get_search_state(self):
+        """
+        Returns search ranges of landmarks at current level, creating new ones when the level changed.
+        :return: AdaptiveSearchState instance
+        """
+        if self.search_state is None or self.search_state.level != self.current_level:
+            landmark_model = self.get_current_level().landmark_model
+            self.search_state = AdaptiveSearchState(self.current_level, self.current_tooth.landmarks.shape[0],
+                                                    landmark_model.k, landmark_model.m)
+        return self.search_state
 
     def _get_difference(self, previous_tooth):
         """
@@ -102,30 +174,101 @@ class ActiveShapeModel(object):
         """
         return self.current_tooth.sum_of_squared_distances(previous_tooth)
 
-    def run(self, stop_token=None, step_callback=None):
+    def _get_level_end_time(self, budget, end_time, level, last_level=0):
+        """
+        Computes time by which search at the level must finish.
+        :param budget: SearchBudget of the search or None.
+        :param end_time: Time by which the whole search must finish or None.
+        :param level: Index of the level, levels with lower indices down to last_level are searched afterwards.
+        :param last_level: Index of the last searched level.
+        :return: Absolute time or None if the level isn't limited.
+        """
+        now = time.time()
+        level_end_time = None
+        if end_time is not None:
+            weights = self.level_time_weights or self._get_default_level_weights(level, last_level)
+            share = weights[level] / sum(weights[last_level:level + 1])
+            level_end_time = now + max(end_time - now, 0) * share
+
+        level_seconds = budget.get_level_seconds(level) if budget is not None else None
+        if level_seconds is not None:
+            level_end_time = now + level_seconds if level_end_time is None else min(level_end_time, now + level_seconds)
+        return level_end_time
+
+    def _get_default_level_weights(self, level, last_level=0):
+        """
+        Estimates time that levels need to converge as product of their number of steps and duration of one step.
+        Levels where the search usually moves the shape for many steps or where steps are expensive get more time.
+        :param level: Index of the current level.
+        :param last_level: Index of the last searched level.
+        :return: list of weights indexed by level, all the same until every remaining level was searched to convergence
+        """
+        levels_count = MultiResolutionFramework.levels_count
+        if self.step_durations is None or self.level_step_counts is None:
+            return [1.0] * levels_count
+
+        weights = [None if self.level_step_counts[i] is None or self.step_durations[i] is None else
+                   self.level_step_counts[i] * self.step_durations[i] for i in range(0, levels_count)]
+        remaining = weights[last_level:level + 1]
+        if any(weight is None for weight in remaining) or sum(remaining) <= 0:
+            return [1.0] * levels_count
+        return weights
+
+    def run(self, stop_token=None, step_callback=None, budget=None, first_level=None, last_level=0, max_steps=None):
         """
         Performs complete Active Shape Model search in multiple resolution levels.
         :param stop_token: A token that can be used to interrupt the algorithm.
         :param step_callback: A callback function that can be used to report after a step of algorithm has been done.
+        :param budget: SearchBudget limiting duration of the search. A step is not started when it's not expected to
+                       finish in time. When a level runs out of time, the search continues at next level with the time
+                       that is left, so when the whole search runs out of time, the shape found so far is returned.
+                       Whether the search converged is stored in search_converged.
+        :param first_level: Level where the search starts. If None, it starts at the coarsest level.
+        :param last_level: Level where the search ends. The search can be continued from finer level by another call.
+        :param max_steps: Maximum number of steps at every level. If None, max_steps_per_level is used.
         :return: Final tooth that is positioned into original radiograph image (see: set_image_to_search)
         """
-        next_level = MultiResolutionFramework.levels_count - 1
+        end_time = budget.get_end_time() if budget is not None else None
+        next_level = MultiResolutionFramework.levels_count - 1 if first_level is None else first_level
         self.current_level = 0
-
-        while next_level >= 0:
+        filtered_fractions = self.multi_resolution_framework.get_filtered_fractions()
+        levels_count = MultiResolutionFramework.levels_count
+        self.search_profile_counts = [[0, 0] for _ in range(0, levels_count)]
+        self.search_sample_counts = [[0, 0] for _ in range(0, levels_count)]
+        self.search_iteration_counts = [0] * levels_count
+        self.search_frozen_fractions = [0.0] * levels_count
+        if self.step_durations is None:
+            self.step_durations = [None] * levels_count
+            self.level_step_counts = [None] * levels_count
+        self.search_converged = True
+        self.search_expired = False
+
+        while next_level >= last_level:
             self.change_level(next_level)
             # Show initial state
             if step_callback is not None:
                     step_callback()
 
-            steps_left = ActiveShapeModel.max_steps_per_level
+            level_end_time = self._get_level_end_time(budget, end_time, next_level, last_level)
+            converged = False
+            steps_left = ActiveShapeModel.max_steps_per_level if max_steps is None else max_steps
             while steps_left > 0:
                 if isinstance(stop_token, StopIterationToken) and stop_token.stop:
                     return
 
+                # Don't start a step that wouldn't finish in time
+                step_duration = self.step_durations[next_level] or 0.0
+                if level_end_time is not None and time.time() + step_duration > level_end_time:
+                    self.search_expired = True
+                    break
+
+                step_start = time.time()
                 previous_tooth = self.current_tooth
                 self.make_step()
+                self._count_step(next_level, previous_tooth)
                 difference = self._get_difference(previous_tooth)
+                self.step_durations[next_level] = ActiveShapeModel._update_estimate(self.step_durations[next_level],
+                                                                                    time.time() - step_start)
 
                 if step_callback is not None:
                     step_callback()
@@ -133,15 +276,58 @@ class ActiveShapeModel(object):
                 # Test convergence. If new difference is larger than previous, stop algorithm
                 if difference < 1:
                     self.current_tooth = previous_tooth
+                    converged = True
+                    break
+
+                # Most of landmarks settled
+                if Config.adaptive_search and self.search_state.frozen_fraction >= Config.adaptive_frozen_fraction:
+                    converged = True
                     break
 
                 steps_left -= 1
 
+            self.search_converged = self.search_converged and converged
+            if converged:
+                # Levels cut short by time or steps would underestimate the number of steps
+                self.level_step_counts[next_level] = ActiveShapeModel._update_estimate(
+                    self.level_step_counts[next_level], self.search_iteration_counts[next_level])
             next_level -= 1
 
+        # Search may end at coarser level when it runs out of time or when it's limited by last_level
+        self.change_level(0)
+
+        self.search_filtered_fractions = [after - before for before, after in
+                                          zip(filtered_fractions, self.multi_resolution_framework.get_filtered_fractions())]
+
         # At last, position the tooth into original radiograph
         return self.get_current_tooth_positioned()
 
+    @staticmethod
+    def _update_estimate(estimate, value):
+        """
+        Updates exponential moving average by new measurement.
+        :param estimate: Current estimate or None if nothing was measured yet.
+        :param value: New measurement.
+        :return: New estimate, the first measurement is used as is.
+        """
+        return float(value) if estimate is None else 0.5 * (estimate + value)
+
+    def _count_step(self, level, previous_tooth):
+        """
+        Updates statistics of last search after a step.
+        :param level: Index of level where the step was made.
+        :param previous_tooth: Tooth before the step.
+        """
+        points_count = previous_tooth.landmarks.shape[0]
+        m = self.get_current_level().landmark_model.m
+        self.search_profile_counts[level][0] += self.recomputed_profiles
+        self.search_profile_counts[level][1] += points_count
+        self.search_sample_counts[level][0] += self.profile_cache.sampled_count
+        self.search_sample_counts[level][1] += points_count * (2 * m + 1)
+        self.search_iteration_counts[level] += 1
+        if Config.adaptive_search:
+            self.search_frozen_fractions[level] = self.search_state.frozen_fraction
+
     def change_level(self, level):
         """
         Changes the resolution level at which the search takes place.
@@ -164,6 +350,25 @@ class ActiveShapeModel(object):
             for i in range(0, difference):
                 self.current_tooth.downsample_transform()
 
+    def get_fit_costs(self, level=None):
+        """
+        Measures how well current shape fits the image.
+        :param level: Level whose image and landmark model are used. If None, current level is used.
+        :return: tuple of profile cost (see LandmarkModel.get_fit_cost) and shape cost, which is squared Mahalanobis
+                 distance of shape parameters from the mean shape
+        """
+        level = self.current_level if level is None else level
+        tooth = deepcopy(self.current_tooth)
+        for i in range(self.current_level, level):
+            tooth.downsample_transform()
+        for i in range(level, self.current_level):
+            tooth.upsample_transform()
+
+        resolution_level = self.multi_resolution_framework.get_level(level)
+        profile_cost = resolution_level.landmark_model.get_fit_cost(tooth, resolution_level.image)
+        shape_cost = float(np.sum(self.current_params ** 2 / self.pca.eigen_values))
+        return profile_cost, shape_cost
+
     def get_current_level(self):
         """
         Returns current level at which the search is performed.
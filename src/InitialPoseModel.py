@@ -1,8 +1,14 @@
+from collections import OrderedDict
+from threading import Lock
+
 import cv2
 import numpy as np
 
+from src.MultiresFramework import MultiResolutionFramework
 from src.datamanager import DataManager
 from src.filter import Filter
+from src.tiledimage import TiledImage
+from src.utils import Rectangle, image_fingerprint
 
 __author__ = "Jakub Macina, Ivan Sevcik"
 
@@ -16,6 +22,13 @@ class InitialPoseModel(object):
     lower_jaw_line = None
     max_angle = 25
     side_lines_threshold = 100
+    # Presets of the filter applied to jaw images before finding lines: median kernel size, bilateral kernel size,
+    # bilateral color delta
+    filter_presets = (5, 17, 6)
+    # Poses found in the most recently used images, shared by all instances and keyed by image and selector
+    max_cached_poses = 16
+    _cached_poses = OrderedDict()
+    _cache_lock = Lock()
 
     def __init__(self, data_manager):
         assert isinstance(data_manager, DataManager)
@@ -32,29 +45,62 @@ class InitialPoseModel(object):
         translation, scale, rotation = pose
         return translation / (2**count), scale / (2**count), rotation
 
-    def find(self, image):
+    def find(self, image, filtered_image=None, image_key=None):
         '''
-        Finds initial poses for the image and select teeth according to data manager selector.
+        Finds initial poses for the image and select teeth according to data manager selector. Poses are remembered, so
+        each image is processed only once for every selector.
         :param image: image instance
+        :param filtered_image: The image filtered for the first resolution level (see MultiResolutionFramework), either
+                               numpy array or TiledImage. If its presets match filter_presets, jaws are cropped from it
+                               instead of being filtered again.
+        :param image_key: Key identifying the image, e.g. its path. If None, fingerprint of the image is used.
+        :return: array in format [(np.array(x position, y position), scale, rotation), ...]
+        '''
+        if image_key is None:
+            image_key = image_fingerprint(image)
+        key = (image_key, tuple(self.data_manager.selector))
+        with InitialPoseModel._cache_lock:
+            poses = InitialPoseModel._cached_poses.pop(key, None)
+
+        # Poses are found without lock, so different images can be processed in parallel
+        if poses is None:
+            basic_poses = self._find_poses(image, filtered_image)
+            poses = [basic_poses[i] for i in self.data_manager.selector]
+
+        with InitialPoseModel._cache_lock:
+            # Reinsert to mark as most recently used and drop the oldest ones
+            InitialPoseModel._cached_poses[key] = poses
+            while len(InitialPoseModel._cached_poses) > self.max_cached_poses:
+                InitialPoseModel._cached_poses.popitem(last=False)
+        return [(position.copy(), scale, rotation) for position, scale, rotation in poses]
+
+    def find_in_pyramid(self, pyramid, image_key=None):
+        '''
+        Finds initial poses for the radiograph reusing its filtered image of the first resolution level.
+        :param pyramid: ImagePyramid of the radiograph (see MultiResolutionFramework.build_pyramid)
+        :param image_key: Key identifying the radiograph, e.g. its path. If None, fingerprint of the image is used.
         :return: array in format [(np.array(x position, y position), scale, rotation), ...]
         '''
-        basic_poses = self._find_poses(image)
-        return [basic_poses[i] for i in self.data_manager.selector]
+        return self.find(pyramid.default_images[0], pyramid.images[0], image_key)
 
-    def _find_poses(self, image):
+    def _find_poses(self, image, filtered_image=None):
         '''
         Find initial poses for the image.
         :param image: image instance
+        :param filtered_image: The image filtered for the first resolution level or None (see find).
         :return: array in format [(np.array(x position, y position), scale, rotation), ...]
         '''
-        self.top_jaw_line, self.lower_jaw_line = self._find_jaw_separation_line(self._crop_image_sides(image))
+        self.top_jaw_line, self.lower_jaw_line = self.find_jaw_lines(image)
 
-        upper_jaw_image = self.crop_upper_jaw(image, self.top_jaw_line)
-        lower_jaw_image = self.crop_lower_jaw(image, self.lower_jaw_line)
+        upper_jaw_image, lower_jaw_image = self._crop_filtered_jaws(filtered_image)
+        if upper_jaw_image is None:
+            upper_jaw_image = self.crop_upper_jaw(image, self.top_jaw_line)
+            lower_jaw_image = self.crop_lower_jaw(image, self.lower_jaw_line)
 
-        # Filter the image
-        upper_jaw_image = Filter.process_image(upper_jaw_image, median_kernel=5, bilateral_kernel=17, bilateral_color=6)
-        lower_jaw_image = Filter.process_image(lower_jaw_image, median_kernel=5, bilateral_kernel=17, bilateral_color=6)
+            # Filter the image
+            median_kernel, bilateral_kernel, bilateral_color = self.filter_presets
+            upper_jaw_image = Filter.process_image(upper_jaw_image, median_kernel, bilateral_kernel, bilateral_color)
+            lower_jaw_image = Filter.process_image(lower_jaw_image, median_kernel, bilateral_kernel, bilateral_color)
 
         upper_jaw_image = self._convert_to_binary_image(upper_jaw_image)
         lower_jaw_image = self._convert_to_binary_image(lower_jaw_image)
@@ -93,6 +139,38 @@ class InitialPoseModel(object):
                 (position7, 40, -0.15)
                 ]
 
+    def _crop_filtered_jaws(self, filtered_image):
+        '''
+        Crops jaws from the image filtered for the first resolution level if it was filtered the same way as the jaws
+        would be. Quantized images are not used, because rounding could change the binary images.
+        :param filtered_image: Filtered image or None.
+        :return: tuple (upper jaw image, lower jaw image), or (None, None) if the jaws must be filtered
+        '''
+        if filtered_image is None or filtered_image.dtype == np.uint16 or \
+                tuple(MultiResolutionFramework.get_filter_presets(0)) != tuple(self.filter_presets):
+            return None, None
+
+        if isinstance(filtered_image, TiledImage):
+            # Only tiles covering the jaws are filtered
+            h, w = filtered_image.shape
+            left, right = self.crop_sides_size, w - self.crop_sides_size
+            upper_jaw = Rectangle(left, max(self.top_jaw_line - self.crop_upper_jaw_top_size, 0), right,
+                                  self.top_jaw_line)
+            lower_jaw = Rectangle(left, self.lower_jaw_line, right,
+                                  min(self.lower_jaw_line + self.crop_lower_jaw_size, h))
+            return filtered_image.get_region(upper_jaw), filtered_image.get_region(lower_jaw)
+
+        return self.crop_upper_jaw(filtered_image, self.top_jaw_line), \
+            self.crop_lower_jaw(filtered_image, self.lower_jaw_line)
+
+    def find_jaw_lines(self, image):
+        '''
+        Finds y coordinates of the gap between upper and lower jaw.
+        :param image: Cropped radiograph image.
+        :return: tuple (upper jaw line index, lower jaw line index)
+        '''
+        return self._find_jaw_separation_line(self._crop_image_sides(image))
+
     def _find_jaw_separation_line(self, image):
         '''
         Finds y coordinate of lines that separates upper and lower jaws.
@@ -1,71 +1,93 @@
 import numpy as np
-from scipy.spatial.distance import mahalanobis
 
 from src.LandmarkModel import LandmarkModel
 
 __author__ = "Ivan Sevcik, Jakub Macina"
 
-# TODO: Outdated. If gonna be used, needs to be updated to comply with new LandmarkModel class.
-class LandmarkAppearanceModel(LandmarkModel):
-    means_points_model = None
-    inverse_covariance_points_model = None
 
-    k = 5
+class LandmarkAppearanceModel(LandmarkModel):
+    """
+    Matches sampled profiles to mean training profile of every landmark by Mahalanobis distance. Covariances are shrunk
+    towards scaled identity with intensity given by oracle approximating shrinkage (OAS), so they are well conditioned
+    even with few training radiographs. Whitening transforms are precomputed from Cholesky factors, so all windows of
+    all landmarks are compared by a single batched product.
+    """
+    # Shrinkage intensity in range <0, 1>. If None, it's estimated for every landmark by OAS.
+    shrinkage = None
+    means = None
+    # Inverse of lower Cholesky factor of covariance for every landmark, shape (landmarks, 2k + 1, 2k + 1)
+    whitening = None
+    whitened_means = None
 
-    def __init__(self, data_manager, use_file_cache=False):
-        super(LandmarkAppearanceModel, self).__init__(data_manager)
-        self._train_model(use_file_cache)
+    def __init__(self, k, m, shrinkage=None):
+        super(LandmarkAppearanceModel, self).__init__(k, m)
+        self.shrinkage = shrinkage
 
-    def _train_model(self, use_file_cache):
-        self.means_points_model = list()
-        self.inverse_covariance_points_model = list()
+    @staticmethod
+    def _shrink_covariances(covariances, count, shrinkage=None):
+        """
+        Shrinks covariances of profiles of every landmark towards identity scaled by their average variance.
+        :param covariances: Maximum likelihood covariances in shape (landmarks, length, length).
+        :param count: Number of observations the covariances were estimated from.
+        :param shrinkage: Shrinkage intensity or None to estimate it.
+        :return: shrunk covariances
+        """
+        landmarks_count, length = covariances.shape[:2]
+        traces = np.trace(covariances, axis1=1, axis2=2)
+        # Shrinkage target is kept positive for constant profiles
+        scales = np.maximum(traces / length, 1e-12)
+        targets = scales[:, np.newaxis, np.newaxis] * np.eye(length)
 
-        if use_file_cache and self.load_from_file():
-            return
+        if shrinkage is None:
+            # Oracle approximating shrinkage (Chen et al.), it needs only the covariances, not the training profiles
+            squared_traces = np.sum(covariances ** 2, axis=(1, 2))
+            numerators = (1 - 2.0 / length) * squared_traces + traces ** 2
+            denominators = (count + 1 - 2.0 / length) * (squared_traces - traces ** 2 / length)
+            shrinkage = np.where(denominators > 0, numerators / np.maximum(denominators, 1e-300), 1.0)
+        shrinkage = np.clip(np.ones(landmarks_count) * shrinkage, 0, 1)[:, np.newaxis, np.newaxis]
 
-        radiograph_samples = self._get_samples_across_radiographs(self.k)
+        return (1 - shrinkage) * covariances + shrinkage * targets
 
-        # Compute mean and inverse covariance matrix for every landmark point.
-        for i in range(0, radiograph_samples.shape[1]):
-            point_samples = radiograph_samples[:, i, :].T
-            mean, cov_mat = LandmarkAppearanceModel._get_mean_and_covariance(point_samples)
+    def finish_training(self):
+        '''
+        Creates mean profiles and whitening transforms from statistics of data supplied so far.
+        '''
+        self.means = self.statistics.mean.copy()
+        covariances = LandmarkAppearanceModel._shrink_covariances(self.statistics.get_covariances(ddof=0),
+                                                                  self.statistics.count, self.shrinkage)
+        self.whitening = np.linalg.inv(np.linalg.cholesky(covariances))
+        self.whitened_means = np.einsum("lij,lj->li", self.whitening, self.means)
 
-            # Assure that the matrix is inversible
-            assert not np.isclose(np.linalg.det(cov_mat), 0)
-            inv_cov_mat = np.linalg.inv(cov_mat)
-            self.means_points_model.append(mean)
-            self.inverse_covariance_points_model.append(inv_cov_mat)
+    def _find_best_positions(self, sample_matrix, point_indices=None):
+        '''
+        Finds best positions of landmarks by comparing every window of sampled profiles with the model.
+        :param sample_matrix: Sampled profiles along landmark normals, shape (landmarks, 2m + 1).
+        :param point_indices: Indices of landmarks whose profiles are in sample_matrix. If None, all are sampled.
+        :return: Indices to sampled profiles where best match occurred when profiles were center-aligned.
+        '''
+        return self.k + np.argmin(self._get_window_distances(sample_matrix, point_indices), axis=1)
 
-        self.save_to_file()
+    def get_profile_costs(self, profiles):
+        whitened = np.einsum("lij,...lj->...li", self.whitening, profiles) - self.whitened_means
+        return np.sum(whitened ** 2, axis=-1)
 
-    def find_best_position(self, sampled_profile, point_index):
+    def _get_window_distances(self, sample_matrix, point_indices=None):
         '''
-
-        :param sampled_profile: Length 2m + 1
-        :param model: Length 2k + 1
-        :return:
+        Computes squared Mahalanobis distances of all windows of sampled profiles from the model.
+        :param sample_matrix: Sampled profiles along landmark normals, one row for each landmark in point_indices.
+        :param point_indices: Indices of landmarks whose profiles are in sample_matrix. If None, all are sampled.
+        :return: array of shape (landmarks, windows)
         '''
-        model_length = len(self.means_points_model[point_index])
-        sampled_profile_length = len(sampled_profile)
-        min_value = float("inf")
-        min_index = 0
-        for i in range(0, sampled_profile_length - model_length + 1):
-            sampled_profile_part = sampled_profile[i:i + model_length]
-            distance = mahalanobis(sampled_profile_part, self.means_points_model[point_index],
-                                   self.inverse_covariance_points_model[point_index])
-            if distance < min_value:
-                min_value = distance
-                min_index = i
-        return self.k + min_index
+        selection = slice(None) if point_indices is None else point_indices
+        windows = self._get_windows(sample_matrix)
+        whitened = np.einsum("lij,lwj->lwi", self.whitening[selection], windows) - \
+            self.whitened_means[selection][:, np.newaxis, :]
+        return np.sum(whitened ** 2, axis=2)
 
-    def load_from_file(self):
-        try:
-            self.means_points_model = np.load("./data/Trained/appearance_model_means.npy")
-            self.inverse_covariance_points_model = np.load("./data/Trained/appearance_model_covar.npy")
-        except IOError:
-            return False
-        return True
+    def load_from_file(self, name):
+        # Files are named only by level, but the model depends on training data (selected jaw and left out radiograph).
+        # Trained models are shared in memory by ModelRegistry instead.
+        return False
 
-    def save_to_file(self):
-        np.save("./data/Trained/appearance_model_means.npy", self.means_points_model)
-        np.save("./data/Trained/appearance_model_covar.npy", self.inverse_covariance_points_model)
\ No newline at end of file
+    def save_to_file(self, name):
+        pass
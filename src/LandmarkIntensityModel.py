@@ -6,6 +6,8 @@ __author__ = "Ivan Sevcik"
 
 class LandmarkIntensityModel(LandmarkModel):
     factor_array = None
+    # Training profiles aren't used by this model
+    track_covariance = False
 
     def __init__(self, k, m):
         super(LandmarkIntensityModel, self).__init__(k, m)
@@ -25,7 +27,9 @@ class LandmarkIntensityModel(LandmarkModel):
         :return: Index of sampled_profile where best match occurred when profiles were center-aligned.
         '''
 
-        sampled_profile *= self.factor_array
+        # Profiles shorter than 2m + 1 (see LandmarkModel.update_positions) are weighted by the middle of factor array
+        offset = self.m - (len(sampled_profile) - 1) // 2
+        sampled_profile *= self.factor_array[offset:offset + len(sampled_profile)]
 
         max_intensity = -float('inf')
         max_intensity_idx = 0
@@ -37,6 +41,14 @@ class LandmarkIntensityModel(LandmarkModel):
 
         return max_intensity_idx
 
+    def get_profile_costs(self, profiles):
+        '''
+        Computes how far is the strongest intensity along every profile above intensity at the landmark.
+        :param profiles: Sampled profiles of length 2k+1 in shape (..., landmarks, 2k+1).
+        :return: Cost of every profile, 0 when landmark lies at the maximum.
+        '''
+        return np.max(profiles, axis=-1) - profiles[..., self.k]
+
     def load_from_file(self, name):
         return True
 
@@ -6,19 +6,15 @@ __author__ = "Ivan Sevcik"
 
 class LandmarkIntensityModel(LandmarkModel):
     means_points_model = None
+    track_covariance = False
 
     def __init__(self):
         super(LandmarkIntensityModel, self).__init__()
         self.means_points_model = list()
 
     def finish_training(self):
-        radiograph_samples_arr = np.array(self.radiograph_samples)
-
-        # Compute mean and inverse covariance matrix for every landmark point.
-        for i in range(0, radiograph_samples_arr.shape[1]):
-            point_samples = radiograph_samples_arr[:, i, :].T
-            mean, cov_mat = LandmarkModel._get_mean_and_covariance(point_samples)
-            self.means_points_model.append(mean)
+        # Mean profile of every landmark point
+        self.means_points_model = self.statistics.mean.copy()
 
     def _find_best_position(self, sampled_profile, landmark_index):
         '''
@@ -45,6 +41,9 @@ class LandmarkIntensityModel(LandmarkModel):
 
         return self.k + min_index
 
+    def get_profile_costs(self, profiles):
+        return np.sum((profiles - self.means_points_model) ** 2, axis=-1)
+
     @staticmethod
     def sum_of_squared_differences(vec1, vec2):
         assert isinstance(vec1, np.ndarray)
@@ -3,6 +3,7 @@ from copy import deepcopy
 import numpy as np
 
 from src.filter import Filter
+from src.profilestatistics import ProfileStatistics
 from src.sampler import Sampler
 from src.tooth import Tooth
 
@@ -10,12 +11,24 @@ __author__ = "Ivan Sevcik"
 
 
 class LandmarkModel(object):
+    """
+    Base of models matching profiles sampled along normals of landmarks. Training profiles are not stored, only their
+    running statistics, so memory doesn't grow with the training set. The model can be created by finish_training after
+    any number of added teeth and updated later by adding more teeth and calling finish_training again.
+    """
+    # Running mean and covariance of training profiles of every landmark
+    statistics = None
+    # Models that don't use covariance of training profiles can disable it to make training cheaper
+    track_covariance = True
+    # If True, all training profiles are also kept in radiograph_samples (e.g. for inspecting the data)
+    keep_samples = False
     radiograph_samples = None
     k = None
     m = None
     normalize = None
 
     def __init__(self, k=2, m=12, normalize=True):
+        self.statistics = ProfileStatistics(self.track_covariance)
         self.radiograph_samples = list()
         self.k = k
         self.m = m
@@ -33,31 +46,122 @@ class LandmarkModel(object):
             assert isinstance(tooth, Tooth)
             # Get samples (40, X), where X is number 2*number_of_samples+1
             sample_matrix = Sampler.sample(tooth, image, self.k, self.normalize)
-            self.radiograph_samples.append(sample_matrix)
+            self._add_samples(sample_matrix)
             print "Sampling tooth %d done" % (i + 1)
 
+    def _add_samples(self, sample_matrix):
+        '''
+        Adds profiles sampled for one training tooth to statistics.
+        :param sample_matrix: Sampled profiles, one row for each point of the model.
+        '''
+        self.statistics.add(sample_matrix)
+        if self.keep_samples:
+            self.radiograph_samples.append(sample_matrix)
+
+    def merge_training_data(self, other):
+        '''
+        Adds training data of other model of the same type and parameters, e.g. trained by other worker on different
+        radiographs. Call finish_training afterwards to update the model.
+        :param other: LandmarkModel instance, it's not modified.
+        '''
+        assert self.k == other.k
+        self.statistics.merge(other.statistics)
+        if self.keep_samples:
+            self.radiograph_samples.extend(other.radiograph_samples)
+
     def finish_training(self):
         '''
-        Finishes the training by creating the actual model from previously supplied data.
+        Finishes the training by creating the actual model from previously supplied data. It can be called again after
+        more data is supplied.
         '''
         pass
 
-    def update_positions(self, tooth, image):
+    def update_positions(self, tooth, image, cache=None, search_ranges=None, frozen=None):
         '''
         Updates landmark positions of tooth to be in best alignment with the image.
         :param tooth: Tooth with original landmarks.
         :param image: Image that will be sampled for finding new landmark positions. It must be already preprocessed.
+        :param cache: ProfileCache with results of previous update. If given, only points whose sampling positions
+                      changed since then are sampled again.
+        :param search_ranges: Number of pixels sampled at each side of every point, between k + 1 and m. If None, m
+                              pixels are sampled for all points.
+        :param frozen: Boolean mask of points that are not searched and keep their positions.
         :return: New tooth with updated landmarks.
         '''
-        # Sample along normals and find best new position for points by comparing with trained model
-        return_positions = []
-        new_landmarks = []
-        sample_matrix = Sampler.sample(tooth, image, self.m, self.normalize, return_positions)
-        for i, sampled_profile in enumerate(sample_matrix):
-            position = self._find_best_position(sampled_profile, i)
-            new_landmarks.append(return_positions[i][position])
-
-        return Tooth(np.array(new_landmarks))
+        points_count = tooth.landmarks.shape[0]
+        if search_ranges is None:
+            search_ranges = np.full(points_count, self.m, np.int32)
+
+        if cache is None:
+            point_indices = np.arange(0, points_count)
+            if frozen is not None:
+                point_indices = point_indices[~frozen[point_indices]]
+            new_landmarks = np.empty(tooth.landmarks.shape)
+        else:
+            point_indices = cache.get_changed_points(self, tooth, image, search_ranges, frozen)
+            new_landmarks = cache.new_landmarks
+        if frozen is not None:
+            new_landmarks[frozen] = tooth.landmarks[frozen]
+
+        # Sample along normals and find best new position for points by comparing with trained model. Points with the
+        # same search range are compared at once.
+        for sample_count in np.unique(search_ranges[point_indices]):
+            group = point_indices[search_ranges[point_indices] == sample_count]
+            return_positions = []
+            sample_matrix = Sampler.sample(tooth, image, int(sample_count), self.normalize, return_positions, group)
+            best_positions = self._find_best_positions(sample_matrix, group)
+            for point_idx, positions, best in zip(group, return_positions, best_positions):
+                new_landmarks[point_idx] = positions[best]
+
+        return Tooth(new_landmarks.copy())
+
+    def _find_best_positions(self, sample_matrix, point_indices=None):
+        """
+        Finds best alignment positions for points of the model. Models that can compare all profiles at once should
+        override this, others only need to implement _find_best_position.
+        :param sample_matrix: Sampled profiles, one row for each point.
+        :param point_indices: Indices of points whose profiles are in sample_matrix. If None, all points are sampled.
+        :return: Offsets to sampled profiles at which the points exhibit best alignment.
+        """
+        if point_indices is None:
+            point_indices = range(0, sample_matrix.shape[0])
+        return [self._find_best_position(sampled_profile, point_idx)
+                for point_idx, sampled_profile in zip(point_indices, sample_matrix)]
+
+    def _get_windows(self, sample_matrix):
+        '''
+        Creates all windows of length 2k+1 of sampled profiles, so they can be compared with training profiles at once.
+        If the model normalizes profiles, every window is normalized the same way as training profiles.
+        :param sample_matrix: Sampled profiles of length 2m+1, one row for each point of the model.
+        :return: array of shape (points, 2(m-k)+1, 2k+1)
+        '''
+        length = 2 * self.k + 1
+        windows_count = sample_matrix.shape[1] - length + 1
+        windows = sample_matrix[:, np.arange(windows_count)[:, np.newaxis] + np.arange(length)]
+        if self.normalize:
+            abs_sums = np.sum(np.abs(windows), axis=2, keepdims=True)
+            windows = windows / np.where(np.isclose(abs_sums, 0), 1, abs_sums)
+        return windows
+
+    def get_fit_cost(self, tooth, image):
+        '''
+        Measures how well profiles at landmark positions of tooth match the model. Costs are comparable only between
+        teeth evaluated by the same model.
+        :param tooth: Tooth with landmarks positioned in the image.
+        :param image: Image that will be sampled. It must be already preprocessed.
+        :return: Mean cost of profiles, lower is better.
+        '''
+        sample_matrix = Sampler.sample(tooth, image, self.k, self.normalize)
+        return float(np.mean(self.get_profile_costs(sample_matrix)))
+
+    def get_profile_costs(self, profiles):
+        """
+        Computes costs of profiles sampled at landmark positions.
+        :param profiles: Sampled profiles of length 2k+1 in shape (..., points, 2k+1), i.e. one row for each point of
+                         the model, optionally for many shapes at once. They must be normalized if the model normalizes.
+        :return: Cost of every profile in shape (..., points), lower is better.
+        """
+        raise NotImplementedError()
 
     def _find_best_position(self, sampled_profile, point_index):
         """
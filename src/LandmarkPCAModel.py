@@ -0,0 +1,107 @@
+import numpy as np
+
+from src.LandmarkModel import LandmarkModel
+from src.pca import PCA
+
+__author__ = "Ivan Sevcik"
+
+
+class LandmarkPCAModel(LandmarkModel):
+    """
+    Matches sampled profiles to low-rank model of training profiles of every landmark. Only principal components
+    explaining given fraction of variance are kept, the variance of remaining ones is approximated by their average, so
+    a window is scored by its Mahalanobis distance in the subspace plus scaled squared distance from the subspace. Both
+    size of kept components and cost of scoring a window grow linearly with length of profiles.
+    """
+    # Fraction of variance of profiles explained by kept components (see PCA.threshold)
+    threshold = None
+    # Upper limit on number of kept components, None means no limit
+    max_components = None
+
+    means = None
+    # Kept components of every landmark in shape (landmarks, 2k + 1, components)
+    components = None
+    eigen_values = None
+    # Average variance of discarded components of every landmark
+    residual_variances = None
+
+    def __init__(self, k, m, threshold=0.95, max_components=None):
+        super(LandmarkPCAModel, self).__init__(k, m)
+        self.threshold = threshold
+        self.max_components = max_components
+
+    def finish_training(self):
+        '''
+        Finds principal components of profiles of every landmark from statistics of data supplied so far.
+        '''
+        self.means = self.statistics.mean.copy()
+        covariances = self.statistics.get_covariances()
+
+        length = self.means.shape[1]
+        all_eigen_values = list()
+        all_eigen_vectors = list()
+        components_count = 1
+        for mean, covariance in zip(self.means, covariances):
+            pca = PCA()
+            eigen_values, eigen_vectors = np.linalg.eigh(covariance)
+            # Sort descending, eigh returns eigenvalues in ascending order
+            pca.eigen_values = np.maximum(eigen_values[::-1], 0)
+            pca.eigen_vectors = eigen_vectors[:, ::-1]
+            pca.mean = mean
+            all_eigen_values.append(pca.eigen_values)
+            all_eigen_vectors.append(pca.eigen_vectors)
+            pca.threshold(self.threshold)
+            components_count = max(components_count, len(pca.eigen_values))
+
+        # All landmarks keep the same number of components, so they can be scored at once. At least one component is
+        # discarded to estimate residual variance.
+        if self.max_components is not None:
+            components_count = min(components_count, self.max_components)
+        components_count = max(min(components_count, length - 1), 1)
+        all_eigen_values = np.array(all_eigen_values)
+        self.components = np.array(all_eigen_vectors)[:, :, :components_count]
+
+        # Variances are kept positive, so profiles of constant intensity don't cause division by zero
+        total_variances = np.sum(all_eigen_values, axis=1)
+        floor = np.maximum(total_variances / length, 1e-12) * 1e-3
+        self.eigen_values = np.maximum(all_eigen_values[:, :components_count], floor[:, np.newaxis])
+        self.residual_variances = np.maximum(np.sum(all_eigen_values[:, components_count:], axis=1) /
+                                             (length - components_count), floor)
+
+    def _find_best_positions(self, sample_matrix, point_indices=None):
+        '''
+        Finds best positions of landmarks by comparing every window of sampled profiles with the model.
+        :param sample_matrix: Sampled profiles along landmark normals, shape (landmarks, 2m + 1).
+        :param point_indices: Indices of landmarks whose profiles are in sample_matrix. If None, all are sampled.
+        :return: Indices to sampled profiles where best match occurred when profiles were center-aligned.
+        '''
+        return self.k + np.argmin(self._get_window_distances(sample_matrix, point_indices), axis=1)
+
+    def get_profile_costs(self, profiles):
+        demeaned = profiles - self.means
+        projections = np.einsum("...li,lic->...lc", demeaned, self.components)
+        residuals = np.sum(demeaned ** 2, axis=-1) - np.sum(projections ** 2, axis=-1)
+        return np.sum(projections ** 2 / self.eigen_values, axis=-1) + \
+            np.maximum(residuals, 0) / self.residual_variances
+
+    def _get_window_distances(self, sample_matrix, point_indices=None):
+        '''
+        Computes distances of all windows of sampled profiles from the model.
+        :param sample_matrix: Sampled profiles along landmark normals, one row for each landmark in point_indices.
+        :param point_indices: Indices of landmarks whose profiles are in sample_matrix. If None, all are sampled.
+        :return: array of shape (landmarks, windows)
+        '''
+        selection = slice(None) if point_indices is None else point_indices
+        demeaned = self._get_windows(sample_matrix) - self.means[selection][:, np.newaxis, :]
+        projections = np.einsum("lwi,lic->lwc", demeaned, self.components[selection])
+        residuals = np.sum(demeaned ** 2, axis=2) - np.sum(projections ** 2, axis=2)
+        return np.sum(projections ** 2 / self.eigen_values[selection][:, np.newaxis, :], axis=2) + \
+            np.maximum(residuals, 0) / self.residual_variances[selection][:, np.newaxis]
+
+    def load_from_file(self, name):
+        # Files are named only by level, but the model depends on training data (selected jaw and left out radiograph).
+        # Trained models are shared in memory by ModelRegistry instead.
+        return False
+
+    def save_to_file(self, name):
+        pass
@@ -3,10 +3,14 @@ from copy import deepcopy
 import cv2
 import numpy as np
 
+from src.LandmarkAppearenceModel import LandmarkAppearanceModel
 from src.LandmarkIntensityModel import LandmarkIntensityModel
+from src.LandmarkPCAModel import LandmarkPCAModel
 from src.config import Config
 from src.datamanager import DataManager
 from src.filter import Filter
+from src.filterexecutor import FilterExecutor
+from src.tiledimage import TiledImage
 
 __author__ = "Ivan Sevcik"
 
@@ -16,17 +20,52 @@ class ResolutionLevel(object):
     default_image = None
     landmark_model = None
 
-    def __init__(self, model_params):
+    def __init__(self, model_params, landmark_model=None):
+        self.landmark_model = landmark_model if landmark_model is not None else \
+            ResolutionLevel.create_landmark_model(model_params)
+
+    @staticmethod
+    def create_landmark_model(model_params):
+        '''
+        Creates untrained landmark model of type selected by Config.landmark_model.
+        :param model_params: Tuple of k and m (see LandmarkModel).
+        :return: New landmark model
+        '''
         k, m = model_params
-        self.landmark_model = LandmarkIntensityModel(k, m)
+        if Config.landmark_model == "appearance":
+            return LandmarkAppearanceModel(k, m, Config.appearance_shrinkage)
+        if Config.landmark_model == "pca":
+            return LandmarkPCAModel(k, m, Config.profile_pca_threshold, Config.profile_pca_components)
+        return LandmarkIntensityModel(k, m)
 
-    def update_tooth_landmarks(self, tooth):
+    def update_tooth_landmarks(self, tooth, cache=None, search_ranges=None, frozen=None):
         '''
         Convenience method for updating tooth landmarks by using landmark_model and image
         :param tooth: Tooth for which to update landmarks.
+        :param cache: ProfileCache with results of previous update (see LandmarkModel.update_positions).
+        :param search_ranges: Number of pixels sampled at each side of every landmark.
+        :param frozen: Boolean mask of landmarks that are not searched.
         :return: New tooth with updated landmarks
         '''
-        return self.landmark_model.update_positions(tooth, self.image)
+        return self.landmark_model.update_positions(tooth, self.image, cache, search_ranges, frozen)
+
+
+class ImagePyramid(object):
+    """
+    Cropped and filtered images of one radiograph for all resolution levels. Instances are shared (see ModelRegistry),
+    so the images must not be modified.
+    """
+    crop_translation = None
+    images = None
+    default_images = None
+    # Shape of the original radiograph image
+    image_shape = None
+
+    def __init__(self, crop_translation, images, default_images, image_shape=None):
+        self.crop_translation = crop_translation
+        self.images = images
+        self.default_images = default_images
+        self.image_shape = image_shape
 
 
 class MultiResolutionFramework(object):
@@ -40,13 +79,19 @@ class MultiResolutionFramework(object):
     # Params: k and m parameter
     _model_params = [(5, 14), (5, 14), (2, 5)]
 
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, landmark_models=None):
+        '''
+        :param data_manager: Data manager supplying training data.
+        :param landmark_models: Already trained landmark models for every level. If supplied, they are shared with the
+                                caller and train() doesn't need to be called.
+        '''
         assert isinstance(data_manager, DataManager)
         self.data_manager = data_manager
 
         self.resolution_levels = list()
         for i in range(0, self.levels_count):
-            self.resolution_levels.append(ResolutionLevel(MultiResolutionFramework._model_params[i]))
+            landmark_model = landmark_models[i] if landmark_models is not None else None
+            self.resolution_levels.append(ResolutionLevel(MultiResolutionFramework._model_params[i], landmark_model))
 
     def train(self):
         '''
@@ -63,7 +108,7 @@ class MultiResolutionFramework(object):
         # Iterate all radiographs one by one to save memory
         for r, radiograph in enumerate(self.data_manager.radiographs):
             image = radiograph.image
-            teeth = self.datamanager.get_all_teeth_from_radiograph(radiograph, True)
+            teeth = self.data_manager.get_all_teeth_from_radiograph(radiograph, True)
 
             # Crop image to region of interest and translate all teeth into cropped region
             crop_translation = -Filter.get_cropping_region(image).left_top
@@ -79,13 +124,8 @@ class MultiResolutionFramework(object):
                 if i > 0:
                     image, teeth = MultiResolutionFramework.downsample(image, teeth)
 
-                # Create copy of the image to not modify the original one
-                filtered_image = image.copy()
-                assert isinstance(filtered_image, np.ndarray)
-
                 # Filter the image
-                median_kernel, bilateral_kernel, bilateral_color = MultiResolutionFramework.get_filter_presets(i)
-                filtered_image = Filter.process_image(filtered_image, median_kernel, bilateral_kernel, bilateral_color)
+                filtered_image = MultiResolutionFramework.filter_image(image, i)
 
                 # Add new data to the training set for given resolution
                 resolution_level.landmark_model.add_training_data(teeth, filtered_image)
@@ -108,21 +148,86 @@ class MultiResolutionFramework(object):
 
         return self.resolution_levels[level_idx]
 
+    def get_landmark_models(self):
+        '''
+        Get landmark models of all levels.
+        :return: list of landmark models
+        '''
+        return [level.landmark_model for level in self.resolution_levels]
+
     def set_radiograph_image(self, radiograph_image):
         '''
-        Processes image and saves it's subsampled version into appropriate resolution levels
+        Processes image and saves it's subsampled version into appropriate resolution levels. If Config.lazy_filtering is
+        set, the levels receive TiledImage instances that are filtered only where they are sampled.
         :param image: Image to process. Should be original radiograph image without processing.
         '''
-        self.crop_translation = -Filter.get_cropping_region(radiograph_image).left_top
-        image = Filter.crop_image(radiograph_image)
-        for i in range(0, self.levels_count):
+        self.set_pyramid(MultiResolutionFramework.build_pyramid(radiograph_image))
+
+    def set_pyramid(self, pyramid):
+        '''
+        Sets already processed images into resolution levels.
+        :param pyramid: ImagePyramid instance (see build_pyramid)
+        '''
+        assert isinstance(pyramid, ImagePyramid)
+        self.crop_translation = pyramid.crop_translation
+        for i, level in enumerate(self.resolution_levels):
+            level.image = pyramid.images[i]
+            level.default_image = pyramid.default_images[i]
+
+    @staticmethod
+    def build_pyramid(radiograph_image):
+        '''
+        Crops, subsamples and filters the image for every resolution level.
+        :param radiograph_image: Image to process. Should be original radiograph image without processing.
+        :return: ImagePyramid instance
+        '''
+        crop_translation, image = MultiResolutionFramework.crop_radiograph_image(radiograph_image)
+        return MultiResolutionFramework.build_pyramid_from_crop(crop_translation, image, radiograph_image.shape)
+
+    @staticmethod
+    def crop_radiograph_image(radiograph_image):
+        '''
+        Crops image to region of interest.
+        :param radiograph_image: Original radiograph image without processing.
+        :return: tuple of translation from original to cropped image and cropped image
+        '''
+        crop_translation = -Filter.get_cropping_region(radiograph_image).left_top
+        return crop_translation, Filter.crop_image(radiograph_image)
+
+    @staticmethod
+    def build_pyramid_from_crop(crop_translation, image, image_shape=None):
+        '''
+        Subsamples and filters already cropped image for every resolution level.
+        :param crop_translation: Translation from original to cropped image (see crop_radiograph_image).
+        :param image: Cropped image. This image is not modified by the operation.
+        :param image_shape: Shape of the original radiograph image.
+        :return: ImagePyramid instance
+        '''
+        images = list()
+        default_images = list()
+        for i in range(0, MultiResolutionFramework.levels_count):
             if i > 0:
                 image = MultiResolutionFramework.downsample_image(image)
 
-            median_kernel, bilateral_kernel, bilateral_color = MultiResolutionFramework.get_filter_presets(i)
-            filtered_image = Filter.process_image(image.copy(), median_kernel, bilateral_kernel, bilateral_color)
-            self.resolution_levels[i].image = filtered_image
-            self.resolution_levels[i].default_image = image.copy()
+            if Config.lazy_filtering:
+                images.append(TiledImage(image, MultiResolutionFramework.get_filter_presets(i), Config.image_dtype,
+                                         Config.quantize_images))
+            else:
+                images.append(MultiResolutionFramework.filter_image(image, i))
+            default_images.append(image.copy())
+
+        return ImagePyramid(crop_translation, images, default_images, image_shape)
+
+    def get_filtered_fractions(self):
+        '''
+        Get fraction of image that has been filtered at each level so far. It's lower than 1 only for lazily filtered
+        images.
+        :return: list of fractions, one for each level
+        '''
+        fractions = list()
+        for level in self.resolution_levels:
+            fractions.append(level.image.filtered_fraction if isinstance(level.image, TiledImage) else 1.0)
+        return fractions
 
     @staticmethod
     def get_filter_presets(level_idx):
@@ -133,6 +238,23 @@ class MultiResolutionFramework(object):
         '''
         return MultiResolutionFramework._filter_presets[level_idx]
 
+    @staticmethod
+    def filter_image(image, level_idx):
+        '''
+        Filters image with presets of given level. Type of the result is controlled by Config.image_dtype and
+        Config.quantize_images. If Config.filter_workers isn't 1, the image is filtered on multiple threads.
+        :param image: Image to filter. This image is not modified by the operation.
+        :param level_idx: index of the level
+        :return: new, filtered image
+        '''
+        median_kernel, bilateral_kernel, bilateral_color = MultiResolutionFramework.get_filter_presets(level_idx)
+        if Config.filter_workers != 1:
+            executor = FilterExecutor.get_shared(Config.filter_workers, Config.filter_tile_size)
+            return executor.process_image(image, median_kernel, bilateral_kernel, bilateral_color, Config.image_dtype,
+                                          Config.quantize_images)
+        return Filter.process_image(image, median_kernel, bilateral_kernel, bilateral_color, Config.image_dtype,
+                                    Config.quantize_images)
+
     @staticmethod
     def downsample_image(image):
         '''
@@ -0,0 +1,255 @@
+from copy import deepcopy
+
+import numpy as np
+
+from src.InitialPoseModel import InitialPoseModel
+from src.LandmarkIntensityModel import LandmarkIntensityModel
+from src.MultiresFramework import MultiResolutionFramework
+from src.config import Config
+from src.datamanager import DataManager
+from src.filter import Filter
+from src.tiledimage import TiledImage
+from src.tooth import Tooth
+from src.utils import to_landmarks_format
+
+__author__ = "Ivan Sevcik"
+
+
+class ProfilePoseModel(object):
+    """
+    Finds initial poses of teeth of one jaw by exhaustive search at the coarsest resolution level. The mean shape is
+    placed at every position of a dense grid covering the jaw, in a few scales and rotations typical for the training
+    teeth. Profiles along normals of all its landmarks are sampled for many positions at once and matched by the trained
+    landmark model. The best poses that don't overlap are assigned to the teeth of the jaw from left to right.
+
+    The landmark model must score how well profiles match the training ones (appearance or PCA model). Intensity model
+    gives zero cost to every flat profile, so empty regions of the image would be the best poses.
+    """
+    # Distance between searched positions in pixels of the searched level
+    grid_step = 2
+    # Number of searched scales and rotations, spread evenly between percentiles of training poses
+    scales_count = 3
+    rotations_count = 5
+    prior_percentiles = (10, 90)
+    # Number of positions whose profiles are sampled at once, limits memory used by the search
+    chunk_size = 256
+    # Minimal horizontal distance of found teeth relative to width of the mean shape in the smallest searched scale
+    suppression_distance = 0.6
+
+    data_manager = None
+    landmark_model = None
+    level = None
+    mean_tooth = None
+    # Searched scales (in pixels of the searched level) and rotations
+    scales = None
+    rotations = None
+    # Results of last search: searched positions, cost of the best pose at each of them and the pose's scale and
+    # rotation indices
+    positions = None
+    costs = None
+    pose_indices = None
+
+    def __init__(self, data_manager, pca, landmark_models, level=None):
+        '''
+        :param data_manager: Data manager supplying training data of one jaw.
+        :param pca: Trained statistical shape model of the jaw.
+        :param landmark_models: Trained landmark models of all levels.
+        :param level: Index of searched resolution level. If None, the coarsest level is searched.
+        '''
+        assert isinstance(data_manager, DataManager)
+        self.data_manager = data_manager
+        self.level = MultiResolutionFramework.levels_count - 1 if level is None else level
+        if not ProfilePoseModel.is_supported(landmark_models, self.level):
+            raise ValueError("Profile pose search needs appearance or PCA landmark model")
+        self.landmark_model = landmark_models[self.level]
+        self.mean_tooth = Tooth(to_landmarks_format(pca.mean))
+        self._find_pose_priors()
+
+    @staticmethod
+    def is_supported(landmark_models, level=None):
+        '''
+        Checks whether the landmark model of the searched level can rank poses.
+        :param landmark_models: Trained landmark models of all levels.
+        :param level: Index of searched resolution level. If None, the coarsest level is checked.
+        :return: False for intensity model, whose cost doesn't penalize profiles without edge
+        '''
+        level = MultiResolutionFramework.levels_count - 1 if level is None else level
+        return not isinstance(landmark_models[level], LandmarkIntensityModel)
+
+    @property
+    def upper_jaw(self):
+        return max(self.data_manager.selector) < 4
+
+    def _find_pose_priors(self):
+        '''
+        Chooses searched scales and rotations from poses of training teeth.
+        '''
+        scales = list()
+        rotations = list()
+        for tooth in self.data_manager.get_all_teeth(True):
+            _, scale, rotation = tooth.align(self.mean_tooth)
+            scales.append(scale)
+            rotations.append(rotation)
+
+        scale_range = np.percentile(scales, self.prior_percentiles) / 2 ** self.level
+        rotation_range = np.percentile(rotations, self.prior_percentiles)
+        self.scales = np.linspace(scale_range[0], scale_range[1], self.scales_count)
+        self.rotations = np.linspace(rotation_range[0], rotation_range[1], self.rotations_count)
+
+    def find(self, pyramid, jaw_lines=None):
+        '''
+        Finds initial poses of teeth selected by the data manager.
+        :param pyramid: ImagePyramid of the radiograph (see MultiResolutionFramework.build_pyramid)
+        :param jaw_lines: Lines separating the jaws in the cropped image (see InitialPoseModel.find_jaw_lines). If None,
+                          they are found in the pyramid.
+        :return: array in format [(np.array(x position, y position), scale, rotation), ...]
+        '''
+        return [candidates[0] for candidates in self.find_candidates(pyramid, 1, jaw_lines)]
+
+    def find_candidates(self, pyramid, count, jaw_lines=None):
+        '''
+        Finds several best initial poses of every tooth selected by the data manager.
+        :param pyramid: ImagePyramid of the radiograph (see MultiResolutionFramework.build_pyramid)
+        :param count: Maximal number of poses of every tooth.
+        :param jaw_lines: Lines separating the jaws in the cropped image (see InitialPoseModel.find_jaw_lines). If None,
+                          they are found in the pyramid.
+        :return: list of poses of every tooth, each list is ordered from the best one and the poses are in format
+                 (np.array(x position, y position), scale, rotation) in the original resolution
+        '''
+        if jaw_lines is None:
+            jaw_lines = InitialPoseModel(self.data_manager).find_jaw_lines(pyramid.default_images[0])
+
+        image = pyramid.images[self.level]
+        if isinstance(image, TiledImage):
+            # The whole jaw is sampled many times, so it's cheaper to filter the image at once
+            image = image.to_array()
+
+        self.positions = self._get_grid_positions(image.shape, jaw_lines)
+        self.costs = np.full(len(self.positions), np.inf)
+        self.pose_indices = np.zeros((len(self.positions), 2), np.int32)
+        for scale_idx, scale in enumerate(self.scales):
+            for rotation_idx, rotation in enumerate(self.rotations):
+                costs = self._get_costs(image, self.positions, scale, rotation)
+                better = costs < self.costs
+                self.costs[better] = costs[better]
+                self.pose_indices[better] = (scale_idx, rotation_idx)
+
+        candidates = self._select_candidates(count)
+        factor = 2 ** self.level
+        return [[(self.positions[i] * factor, self.scales[self.pose_indices[i, 0]] * factor,
+                  self.rotations[self.pose_indices[i, 1]]) for i in tooth_candidates]
+                for tooth_candidates in candidates]
+
+    def _get_grid_positions(self, image_shape, jaw_lines):
+        '''
+        Creates searched positions of tooth centroids, they cover the same regions of the jaw as InitialPoseModel.
+        :param image_shape: Shape of the searched image.
+        :param jaw_lines: Lines separating the jaws in the cropped image of the original resolution.
+        :return: array of positions (x, y) in the searched level
+        '''
+        top_jaw_line, lower_jaw_line = jaw_lines
+        if self.upper_jaw:
+            rows = (top_jaw_line - InitialPoseModel.crop_upper_jaw_top_size, top_jaw_line)
+        else:
+            rows = (lower_jaw_line, lower_jaw_line + InitialPoseModel.crop_lower_jaw_size)
+
+        factor = 2 ** self.level
+        top = max(rows[0] // factor, 0)
+        bottom = min(rows[1] // factor, image_shape[0])
+        left = InitialPoseModel.crop_sides_size // factor
+        right = max(image_shape[1] - left, left + 1)
+        ys, xs = np.mgrid[top:max(bottom, top + 1):self.grid_step, left:right:self.grid_step]
+        return np.column_stack((xs.ravel(), ys.ravel())).astype(np.float64)
+
+    def _get_costs(self, image, positions, scale, rotation):
+        '''
+        Computes costs of the mean shape transformed by the pose at every position. Every landmark is sampled at pixels
+        lying at integer distances along its normal, which approximates the pixels sampled by Sampler.
+        :param image: Searched image.
+        :param positions: Positions (x, y) of the shape's centroid.
+        :param scale: Scale of the shape.
+        :param rotation: Rotation of the shape.
+        :return: array with mean profile cost of the shape at every position, lower is better
+        '''
+        shape = deepcopy(self.mean_tooth)
+        shape.transform(np.zeros(2), scale, rotation)
+        offsets = np.arange(-self.landmark_model.k, self.landmark_model.k + 1)
+        # Sampled points relative to the centroid, shape (landmarks, 2k+1, 2)
+        relative_points = (shape.landmarks - shape.centroid)[:, np.newaxis, :] + \
+            shape.normals[:, np.newaxis, :] * offsets[:, np.newaxis]
+
+        costs = np.empty(len(positions))
+        for start in range(0, len(positions), self.chunk_size):
+            chunk = positions[start:start + self.chunk_size]
+            points = np.floor(chunk[:, np.newaxis, np.newaxis, :] + relative_points).astype(np.int32)
+            profiles = ProfilePoseModel._sample_image(image, points)
+            if self.landmark_model.normalize:
+                abs_sums = np.sum(np.abs(profiles), axis=-1, keepdims=True)
+                abs_sums[np.isclose(abs_sums, 0)] = 1
+                profiles /= abs_sums
+            costs[start:start + len(chunk)] = np.mean(self.landmark_model.get_profile_costs(profiles), axis=-1)
+        return costs
+
+    @staticmethod
+    def _sample_image(image, points):
+        '''
+        Samples image at many points at once. Points outside of the image are sampled as 0.
+        :param image: Numpy array with the image.
+        :param points: Integer array of points (x, y) of any shape.
+        :return: Array of sampled values of type Config.image_dtype.
+        '''
+        x = points[..., 0]
+        y = points[..., 1]
+        h, w = image.shape
+        inside = (x >= 0) & (y >= 0) & (x < w) & (y < h)
+        samples = np.where(inside, image[np.clip(y, 0, h - 1), np.clip(x, 0, w - 1)], 0).astype(Config.image_dtype)
+        if image.dtype == np.uint16:
+            samples = Filter.dequantize_samples(samples)
+        return samples
+
+    def _select_candidates(self, count):
+        '''
+        Selects the best positions of teeth. Anchors of all teeth are chosen first as the best positions that are far
+        enough from each other. Candidates of each tooth are then the best positions closer to its anchor than to
+        anchors of other teeth.
+        :param count: Maximal number of candidates of every tooth.
+        :return: list of indices of candidate positions of every tooth, ordered from the best one
+        '''
+        teeth_count = len(self.data_manager.selector)
+        order = np.argsort(self.costs)
+        order = order[np.isfinite(self.costs[order])]
+        width = np.ptp(self.mean_tooth.landmarks[:, 0]) * self.scales[0]
+        distance = self.suppression_distance * width
+
+        anchors = ProfilePoseModel._suppress(self.positions, order, distance, teeth_count)
+        anchors = sorted(anchors, key=lambda i: self.positions[i, 0])
+        while len(anchors) < teeth_count:
+            # Not enough separate positions were found, the missing teeth share the last one
+            anchors.append(anchors[-1] if len(anchors) > 0 else order[0])
+
+        anchor_xs = self.positions[anchors, 0]
+        owners = np.argmin(np.abs(self.positions[order, 0][:, np.newaxis] - anchor_xs), axis=1)
+        candidates = list()
+        for tooth_idx, anchor in enumerate(anchors):
+            tooth_order = order[owners == tooth_idx]
+            tooth_candidates = ProfilePoseModel._suppress(self.positions, tooth_order, distance / 2, count)
+            candidates.append(tooth_candidates if len(tooth_candidates) > 0 else [anchor])
+        return candidates
+
+    @staticmethod
+    def _suppress(positions, order, distance, count):
+        '''
+        Greedily selects positions that are far enough from all previously selected ones.
+        :param positions: All positions.
+        :param order: Indices of positions ordered from the best one.
+        :param distance: Minimal horizontal distance of selected positions.
+        :param count: Maximal number of selected positions.
+        :return: list of indices of selected positions
+        '''
+        selected = list()
+        for i in order:
+            if len(selected) >= count:
+                break
+            if all(abs(positions[i, 0] - positions[j, 0]) >= distance for j in selected):
+                selected.append(i)
+        return selected
@@ -0,0 +1,83 @@
+import numpy as np
+
+__author__ = "Ivan Sevcik"
+
+
+class AdaptiveSearchState(object):
+    """
+    Search ranges of landmarks during Active Shape Model search at one level. Every landmark is searched in range
+    proportional to its largest recent displacement, so landmarks that stopped moving sample only short profiles.
+    Landmarks that didn't move for several steps are frozen and not searched at all, until the shape constraints move
+    them away from where they were frozen.
+    """
+    # Number of last steps whose displacements determine the search range
+    history_length = 3
+    # Search half-width in pixels relative to largest recent displacement
+    range_expansion = 2.0
+    # Landmarks whose suggested displacement isn't larger are considered settled
+    freeze_distance = 1.0
+    # Number of consecutive steps a landmark must be settled to be frozen
+    freeze_steps = 3
+
+    level = None
+    k = None
+    m = None
+    # Number of pixels sampled at each side of every landmark (see Sampler.sample)
+    ranges = None
+    frozen = None
+    steps = 0
+    _settled_steps = None
+    _frozen_positions = None
+    _history = None
+
+    def __init__(self, level, points_count, k, m):
+        '''
+        :param level: Index of resolution level.
+        :param points_count: Number of landmarks.
+        :param k: Number of pixels sampled at each side of landmarks in training profiles (see LandmarkModel).
+        :param m: Maximum number of pixels sampled at each side of landmarks during search (see LandmarkModel).
+        '''
+        self.level = level
+        self.k = k
+        self.m = m
+        self.ranges = np.full(points_count, m, np.int32)
+        self.frozen = np.zeros(points_count, bool)
+        self._settled_steps = np.zeros(points_count, np.int32)
+        self._frozen_positions = np.zeros((points_count, 2))
+        self._history = np.full((self.history_length, points_count), np.inf)
+
+    @property
+    def frozen_fraction(self):
+        return np.mean(self.frozen)
+
+    def release_moved(self, landmarks):
+        '''
+        Unfreezes landmarks that were moved away from position where they were frozen. They are searched in full range.
+        :param landmarks: Current landmarks of the searched shape.
+        '''
+        moved = self.frozen & (np.linalg.norm(landmarks - self._frozen_positions, axis=1) > self.freeze_distance)
+        self.frozen[moved] = False
+        self._settled_steps[moved] = 0
+        self._history[:, moved] = np.inf
+        self.ranges[moved] = self.m
+
+    def update(self, landmarks, suggested_landmarks):
+        '''
+        Updates search ranges and frozen landmarks after a step.
+        :param landmarks: Landmarks of the shape before the step.
+        :param suggested_landmarks: Landmarks suggested by landmark model during the step.
+        '''
+        searched = ~self.frozen
+        displacements = np.linalg.norm(suggested_landmarks - landmarks, axis=1)
+        self._history[self.steps % self.history_length, searched] = displacements[searched]
+        self.steps += 1
+
+        offsets = np.maximum(np.ceil(self.range_expansion * np.max(self._history, axis=0)), 1)
+        ranges = np.clip(self.k + offsets, self.k + 1, self.m).astype(np.int32)
+        self.ranges[searched] = ranges[searched]
+
+        settled = searched & (displacements <= self.freeze_distance)
+        self._settled_steps[searched] = np.where(settled[searched], self._settled_steps[searched] + 1, 0)
+        newly_frozen = searched & (self._settled_steps >= self.freeze_steps)
+        self.frozen |= newly_frozen
+        self._frozen_positions[newly_frozen] = landmarks[newly_frozen]
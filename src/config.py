@@ -1,4 +1,40 @@
+import numpy as np
+
 __author__ = "Ivan Sevcik"
 
 class Config(object):
     use_file_cache = True
+    # Floating point type of filtered pyramid images and sampled profiles (np.float64 or np.float32)
+    image_dtype = np.float64
+    # If True, filtered pyramid images are stored as uint16 fixed point numbers (see Filter.quantization_scale)
+    quantize_images = False
+    # If True, pyramid images are filtered lazily by tiles when they are sampled for the first time (see TiledImage)
+    lazy_filtering = False
+    # Number of threads used for filtering of pyramid images (see FilterExecutor). If None, number of CPUs is used.
+    filter_workers = 1
+    # Size of tiles processed by individual filtering threads
+    filter_tile_size = 256
+    # How segmentations of found teeth are exported by scripts: "labels", "bits" or "separate" (see SegmentationExporter)
+    segmentation_export = "separate"
+    # How landmarks of found teeth are exported by scripts: "txt" or "npz"
+    landmarks_export = "txt"
+    # If True, landmarks whose sampling positions didn't change since the previous search step are not sampled again
+    # (see ProfileCache). Found shapes are the same as without it.
+    incremental_sampling = True
+    # If True, search range of every landmark adapts to its recent displacements, settled landmarks are frozen and
+    # search at a level finishes when at least 'adaptive_frozen_fraction' of landmarks is frozen (see
+    # AdaptiveSearchState). It changes found shapes, so full range search is the default.
+    adaptive_search = False
+    adaptive_frozen_fraction = 0.9
+    # Model matching sampled profiles: "intensity" (see LandmarkIntensityModel), "appearance" (Mahalanobis distance,
+    # see LandmarkAppearanceModel) or "pca" (low-rank Mahalanobis distance, see LandmarkPCAModel)
+    landmark_model = "intensity"
+    # Shrinkage of profile covariances of the appearance model in range <0, 1>. If None, it's estimated from data by
+    # oracle approximating shrinkage (OAS).
+    appearance_shrinkage = None
+    # Fraction of variance of profiles explained by components of the PCA model and upper limit on their number
+    profile_pca_threshold = 0.95
+    profile_pca_components = None
+    # How initial poses of teeth are found: "lines" (Hough lines between teeth, see InitialPoseModel) or "profiles"
+    # (exhaustive search at the coarsest level, see ProfilePoseModel, needs "appearance" or "pca" landmark model)
+    initial_pose_model = "lines"
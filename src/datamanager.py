@@ -1,14 +1,23 @@
-from copy import deepcopy
+import numpy as np
 
 from src.radiograph import Radiograph
+from src.tooth import Tooth
 
 __author__ = "Ivan Sevcik"
 
 class DataManager:
+    """
+    Supplies training teeth of selected jaw from all radiographs except the left out one. Landmarks of all radiographs
+    are kept in one read-only array and returned teeth only reference it, so they are cheap to create. A tooth gets its
+    own copy of landmarks only when it's modified (see Tooth.scale, Tooth.translate and Tooth.rotate), so the teeth
+    returned by this class are always independent on each other and on the data manager.
+    """
     number_of_radiographs = 14
     radiographs = None
     left_out_radiograph = None
     selector = None
+    # Read-only array of shape (radiographs, teeth, points, 2) with landmarks of training radiographs
+    _landmarks = None
 
     def __init__(self, leave_one_out=None):
         self.radiographs = list()
@@ -24,57 +33,53 @@ class DataManager:
 
             self.radiographs.append(radiograph)
 
+        self._landmarks = np.array([radiograph.landmarks for radiograph in self.radiographs])
+        self._landmarks.flags.writeable = False
+
     def get_all_teeth(self, make_copy=False):
         """
         Retrieves all teeth instances across all radiographs
-        :param make_copy: If True, the instances will be deep-copied
+        :param make_copy: Kept for compatibility, returned teeth are always independent (see DataManager).
         :return: All teeth instances
         """
-        teeth = list()
-        for r in self.radiographs:
-            assert isinstance(r, Radiograph)
-            teeth_from_one = [r._teeth[i] for i in self.selector]
-            teeth.extend(deepcopy(teeth_from_one) if make_copy else teeth_from_one)
-
-        return teeth
+        return [Tooth(landmarks) for landmarks in self._landmarks[:, self.selector].reshape(
+            (-1,) + self._landmarks.shape[2:])]
 
     def count_all_teeth(self):
         '''
         Count all teeth available.
         :return: teeth count
         '''
-        return len(self.get_all_teeth())
+        return len(self.radiographs) * len(self.selector)
 
     def get_tooth(self, radiograph_idx, tooth_idx, make_copy=False):
         '''
         Get tooth from radiograph.
         :param radiograph_idx: radiograph index
         :param tooth_idx: tooth index
-        :param make_copy: Boolean whether to make a deep copy on return
+        :param make_copy: Kept for compatibility, returned tooth is always independent (see DataManager).
         :return: instance of the tooth
         '''
-        tooth = [self.radiographs[radiograph_idx]._teeth[i] for i in self.selector][tooth_idx]
-        return deepcopy(tooth) if make_copy else tooth
+        return Tooth(self._landmarks[radiograph_idx, self.selector[tooth_idx]])
 
     def get_tooth_from_all(self, total_tooth_idx, make_copy=False):
         '''
         Get tooth with index from all radiographs.
         :param total_tooth_idx: tooth index
-        :param make_copy: Boolean whether to make a deep copy on return
+        :param make_copy: Kept for compatibility, returned tooth is always independent (see DataManager).
         :return: teeth instances
         '''
-        tooth = self.get_all_teeth()[total_tooth_idx]
-        return deepcopy(tooth) if make_copy else tooth
+        radiograph_idx, tooth_idx = divmod(total_tooth_idx, len(self.selector))
+        return self.get_tooth(radiograph_idx, tooth_idx)
 
     def get_all_teeth_from_radiograph(self, radiograph, make_copy=False):
         '''
         Get all incisor teeth from radiograph.
         :param radiograph: instance of radiograph
-        :param make_copy: Boolean whether to make a deep copy on return
+        :param make_copy: Kept for compatibility, returned teeth are always independent (see DataManager).
         :return: teeth instances
         '''
-        teeth = [radiograph._teeth[i] for i in self.selector]
-        return deepcopy(teeth) if make_copy else teeth
+        return [Tooth(radiograph.landmarks[i]) for i in self.selector]
 
     def select_all_teeth(self):
         '''
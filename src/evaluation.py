@@ -0,0 +1,236 @@
+import glob
+import os
+import re
+from threading import Lock
+
+import cv2
+import numpy as np
+
+__author__ = "Ivan Sevcik"
+
+
+class ReferenceSegmentations(object):
+    """
+    Reference segmentations from data/Segmentations. Masks are stored cropped to bounding box of the tooth and packed to
+    bits, so all of them take about a megabyte. The packed masks are cached in a file that is rebuilt whenever some of
+    the images is newer.
+    """
+    directory = "./data/Segmentations"
+    cache_name = "packed.npz"
+
+    _instance = None
+    _instance_lock = Lock()
+
+    # Bounding boxes (left, top, right, bottom) indexed by (radiograph idx, tooth idx)
+    bounding_boxes = None
+    _packed = None
+
+    def __init__(self, directory=None):
+        '''
+        Loads masks from cache or images.
+        :param directory: Directory with images named <radiograph>-<tooth>.png, numbered from 1 and 0 respectively.
+        '''
+        if directory is not None:
+            self.directory = directory
+        self.bounding_boxes = dict()
+        self._packed = dict()
+
+        paths = glob.glob(os.path.join(self.directory, "*-*.png"))
+        cache_path = os.path.join(self.directory, self.cache_name)
+        if os.path.exists(cache_path) and \
+                all(os.path.getmtime(path) <= os.path.getmtime(cache_path) for path in paths):
+            self._load_cache(cache_path)
+            if len(self.bounding_boxes) == len(paths):
+                return
+
+        self._load_images(paths)
+        self._save_cache(cache_path)
+
+    @staticmethod
+    def get():
+        '''
+        Returns shared instance for the default directory.
+        :return: ReferenceSegmentations instance
+        '''
+        with ReferenceSegmentations._instance_lock:
+            if ReferenceSegmentations._instance is None:
+                ReferenceSegmentations._instance = ReferenceSegmentations()
+            return ReferenceSegmentations._instance
+
+    def _load_images(self, paths):
+        self.bounding_boxes = dict()
+        self._packed = dict()
+        for path in paths:
+            match = re.match(r"(\d+)-(\d+)\.png$", os.path.basename(path))
+            if match is None:
+                continue
+            key = (int(match.group(1)) - 1, int(match.group(2)))
+
+            mask = cv2.imread(path, 0) > 127
+            rows = np.flatnonzero(mask.any(axis=1))
+            cols = np.flatnonzero(mask.any(axis=0))
+            if rows.size == 0:
+                bounding_box = (0, 0, 0, 0)
+            else:
+                bounding_box = (cols[0], rows[0], cols[-1] + 1, rows[-1] + 1)
+            self.bounding_boxes[key] = bounding_box
+            self._packed[key] = np.packbits(mask[bounding_box[1]:bounding_box[3], bounding_box[0]:bounding_box[2]])
+
+    def _save_cache(self, path):
+        keys = sorted(self.bounding_boxes)
+        packed = [self._packed[key] for key in keys]
+        offsets = np.cumsum([0] + [p.size for p in packed])
+        np.savez(path, keys=np.array(keys, np.int32).reshape(-1, 2),
+                 bounding_boxes=np.array([self.bounding_boxes[key] for key in keys], np.int32).reshape(-1, 4),
+                 offsets=offsets, packed=np.concatenate(packed) if len(packed) > 0 else np.zeros(0, np.uint8))
+
+    def _load_cache(self, path):
+        data = np.load(path)
+        offsets = data["offsets"]
+        packed = data["packed"]
+        for i, (key, bounding_box) in enumerate(zip(data["keys"], data["bounding_boxes"])):
+            key = tuple(int(v) for v in key)
+            self.bounding_boxes[key] = tuple(int(v) for v in bounding_box)
+            self._packed[key] = packed[offsets[i]:offsets[i + 1]]
+
+    def get_mask(self, radiograph_idx, tooth_idx):
+        '''
+        Returns reference mask cropped to its bounding box.
+        :param radiograph_idx: Index of radiograph (0-13).
+        :param tooth_idx: Index of tooth (0-7).
+        :return: tuple of bounding box (left, top, right, bottom) and boolean mask
+        '''
+        left, top, right, bottom = self.bounding_boxes[(radiograph_idx, tooth_idx)]
+        size = (bottom - top) * (right - left)
+        mask = np.unpackbits(self._packed[(radiograph_idx, tooth_idx)])[:size]
+        return (left, top, right, bottom), mask.reshape((bottom - top, right - left)).astype(bool)
+
+
+class SegmentationEvaluator(object):
+    """
+    Compares found teeth with reference segmentations. All computations are done in a window covering bounding boxes of
+    the found and reference tooth, never in the whole radiograph.
+    """
+    metric_names = ("dice", "iou", "hausdorff", "mean_distance")
+
+    references = None
+
+    def __init__(self, references=None):
+        self.references = references if references is not None else ReferenceSegmentations.get()
+
+    @staticmethod
+    def _get_contour(mask):
+        '''
+        :param mask: uint8 mask with values 0 and 1
+        :return: uint8 mask of pixels at the border of the input mask
+        '''
+        padded = cv2.copyMakeBorder(mask, 1, 1, 1, 1, cv2.BORDER_CONSTANT, value=0)
+        return (padded - cv2.erode(padded, np.ones((3, 3), np.uint8)))[1:-1, 1:-1]
+
+    @staticmethod
+    def _get_distances(contour, other_contour):
+        '''
+        :return: distances of pixels of contour to the nearest pixel of other contour
+        '''
+        distance_map = cv2.distanceTransform((other_contour == 0).astype(np.uint8), cv2.cv.CV_DIST_L2,
+                                             cv2.cv.CV_DIST_MASK_PRECISE)
+        return distance_map[contour > 0]
+
+    def evaluate_tooth(self, radiograph_idx, tooth_idx, tooth):
+        '''
+        Computes metrics of one found tooth.
+        :param radiograph_idx: Index of radiograph (0-13).
+        :param tooth_idx: Index of tooth (0-7).
+        :param tooth: Found tooth positioned in the radiograph.
+        :return: tuple of Dice coefficient, intersection over union, Hausdorff distance and mean contour distance, with
+                 distances in pixels
+        '''
+        (ref_left, ref_top, ref_right, ref_bottom), reference = self.references.get_mask(radiograph_idx, tooth_idx)
+        points = np.round(tooth.landmarks).astype(np.int32)
+        left = min(ref_left, points[:, 0].min())
+        top = min(ref_top, points[:, 1].min())
+        right = max(ref_right, points[:, 0].max() + 1)
+        bottom = max(ref_bottom, points[:, 1].max() + 1)
+
+        found = np.zeros((bottom - top, right - left), np.uint8)
+        cv2.fillConvexPoly(found, points - (left, top), 1)
+        expected = np.zeros(found.shape, np.uint8)
+        expected[ref_top - top:ref_bottom - top, ref_left - left:ref_right - left] = reference
+
+        found_area = np.count_nonzero(found)
+        expected_area = np.count_nonzero(expected)
+        intersection = np.count_nonzero(found & expected)
+        union = found_area + expected_area - intersection
+        dice = 2.0 * intersection / (found_area + expected_area) if found_area + expected_area > 0 else 1.0
+        iou = float(intersection) / union if union > 0 else 1.0
+
+        found_contour = SegmentationEvaluator._get_contour(found)
+        expected_contour = SegmentationEvaluator._get_contour(expected)
+        distances = np.concatenate((SegmentationEvaluator._get_distances(found_contour, expected_contour),
+                                    SegmentationEvaluator._get_distances(expected_contour, found_contour)))
+        hausdorff = float(distances.max()) if distances.size > 0 else 0.0
+        mean_distance = float(distances.mean()) if distances.size > 0 else 0.0
+        return dice, iou, hausdorff, mean_distance
+
+    def evaluate(self, radiograph_idx, tooth_indices, teeth):
+        '''
+        Computes metrics of teeth found in one radiograph.
+        :param radiograph_idx: Index of radiograph (0-13).
+        :param tooth_indices: Indices (0-7) of the found teeth.
+        :param teeth: Found teeth positioned in the radiograph.
+        :return: array of shape (len(teeth), len(metric_names))
+        '''
+        return np.array([self.evaluate_tooth(radiograph_idx, tooth_idx, tooth)
+                         for tooth_idx, tooth in zip(tooth_indices, teeth)]).reshape(-1, len(self.metric_names))
+
+
+class EvaluationResults(object):
+    """
+    Collects metrics of teeth over multiple folds and summarizes them per jaw.
+    """
+    jaw_names = {0: "upper", 1: "lower"}
+
+    _rows = None
+    _metrics = None
+
+    def __init__(self):
+        self._rows = list()
+        self._metrics = list()
+
+    def add(self, radiograph_idx, tooth_indices, metrics):
+        '''
+        :param radiograph_idx: Index of left out radiograph.
+        :param tooth_indices: Indices (0-7) of evaluated teeth.
+        :param metrics: Array returned by SegmentationEvaluator.evaluate
+        '''
+        for tooth_idx, tooth_metrics in zip(tooth_indices, metrics):
+            self._rows.append((radiograph_idx, tooth_idx))
+            self._metrics.append(tooth_metrics)
+
+    def summarize(self):
+        '''
+        Averages metrics over all radiographs for every tooth and jaw. Every jaw is averaged only over its own teeth.
+        :return: list of tuples (name, mean metrics, number of teeth)
+        '''
+        if len(self._rows) == 0:
+            return []
+
+        rows = np.array(self._rows)
+        metrics = np.array(self._metrics)
+        summary = list()
+        for tooth_idx in sorted(set(rows[:, 1])):
+            selected = rows[:, 1] == tooth_idx
+            summary.append(("tooth %d" % (tooth_idx + 1), metrics[selected].mean(axis=0), np.count_nonzero(selected)))
+        for jaw, name in sorted(self.jaw_names.items()):
+            selected = rows[:, 1] // 4 == jaw
+            if np.any(selected):
+                summary.append((name, metrics[selected].mean(axis=0), np.count_nonzero(selected)))
+        summary.append(("all", metrics.mean(axis=0), len(rows)))
+        return summary
+
+    def print_summary(self):
+        print "Teeth    | Count |  Dice  |  IoU   | Hausdorff | Mean dist"
+        print "-" * 57
+        for name, (dice, iou, hausdorff, mean_distance), count in self.summarize():
+            print "{0: <8} | {1: >5} | {2: >6.4f} | {3: >6.4f} | {4: >9.2f} | {5: >9.2f}".format(
+                name, count, dice, iou, hausdorff, mean_distance)
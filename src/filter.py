@@ -6,17 +6,47 @@ from src.utils import Rectangle
 __author__ = "Ivan Sevcik"
 
 class Filter:
+    # Fixed point scale used when filtered images are quantized to uint16. The maximal Scharr magnitude of 8-bit image
+    # is 255 * sqrt(2), which still fits into uint16 after scaling.
+    quantization_scale = 128.0
+
     @staticmethod
-    def _scharr(image):
+    def _scharr(image, dtype=np.float64):
         """
-        Applies Scharr gradient operator to image.
+        Applies Scharr gradient operator to image. Both partial derivatives are written into preallocated buffers and
+        the magnitude is computed natively in place of the first one, so no other temporary images are created.
         :param image: Image that should be filtered. This image is not modified by the operation.
-        :return: Filtered image.
+        :param dtype: Floating point type of the result, either np.float32 or np.float64.
+        :return: New, filtered image.
+        """
+        ddepth = cv2.CV_32F if np.dtype(dtype) == np.float32 else cv2.CV_64F
+        grad_x = np.empty(image.shape, dtype)
+        grad_y = np.empty(image.shape, dtype)
+        cv2.Scharr(image, ddepth, 1, 0, dst=grad_x, scale=1 / 16.0)
+        cv2.Scharr(image, ddepth, 0, 1, dst=grad_y, scale=1 / 16.0)
+        cv2.magnitude(grad_x, grad_y, grad_x)
+        return grad_x
+
+    @staticmethod
+    def quantize_image(image):
+        """
+        Converts filtered image into uint16 fixed point representation.
+        :param image: Floating point image returned by process_image. This image is modified by the operation.
+        :return: Quantized image.
+        """
+        image *= Filter.quantization_scale
+        np.rint(image, out=image)
+        return image.astype(np.uint16)
+
+    @staticmethod
+    def dequantize_samples(samples):
         """
-        grad_x = cv2.Scharr(image, cv2.CV_64F, 1, 0) / 16
-        grad_y = cv2.Scharr(image, cv2.CV_64F, 0, 1) / 16
-        grad = np.sqrt(grad_x ** 2 + grad_y ** 2)
-        return grad
+        Converts values sampled from quantized image back to their original range.
+        :param samples: Floating point array of sampled values. This array is modified by the operation.
+        :return: Dequantized samples.
+        """
+        samples /= Filter.quantization_scale
+        return samples
 
     @staticmethod
     def get_cropping_region(image):
@@ -25,7 +55,16 @@ class Filter:
         :param image: Image for which to return cropping region.
         :return: Cropping region.
         """
-        h, w = image.shape
+        return Filter.get_cropping_region_of_shape(image.shape)
+
+    @staticmethod
+    def get_cropping_region_of_shape(shape):
+        """
+        Returns cropping region for an image of given shape, so it can be found before the image is decoded.
+        :param shape: Shape (height, width) of the image.
+        :return: Cropping region.
+        """
+        h, w = shape[:2]
         h2, w2 = h/2, w/2
         return Rectangle(w2 - 400, 500, w2 + 400, 1400)
 
@@ -40,16 +79,58 @@ class Filter:
         return image[region.top:region.bottom, region.left:region.right].copy()
 
     @staticmethod
-    def process_image(image, median_kernel=5, bilateral_kernel=17, bilateral_color=9):
+    def get_halo_size(median_kernel, bilateral_kernel):
+        """
+        Returns how many pixels around a region influence the result of process_image inside that region.
+        :param median_kernel: The size of median filter kernel.
+        :param bilateral_kernel: The size of bilateral filter kernel.
+        :return: Size of the halo in pixels.
+        """
+        # Non-positive bilateral kernel size is computed by OpenCV from sigma space, which is fixed to 200
+        bilateral_radius = bilateral_kernel // 2 if bilateral_kernel > 0 else int(round(200 * 1.5))
+        # Scharr operator needs one more pixel on each side
+        return median_kernel // 2 + bilateral_radius + 1
+
+    @staticmethod
+    def process_region(image, region, median_kernel=5, bilateral_kernel=17, bilateral_color=9, dtype=np.float64,
+                       quantize=False):
+        """
+        Filters only a region of image in the same way as process_image. The result is identical to the same region of
+        the whole processed image, because the region is filtered together with its halo (see get_halo_size).
+        :param image: Image to process. This image is not modified by the operation.
+        :param region: Rectangle that lies inside the image.
+        :param median_kernel: The size of median filter kernel.
+        :param bilateral_kernel: The size of bilateral filter kernel.
+        :param bilateral_color: A color delta that is still considered to represent the same color.
+        :param dtype: Floating point type of the processed image, either np.float32 or np.float64.
+        :param quantize: If True, the processed region is returned as uint16 (see quantize_image).
+        :return: New, processed region of the image.
+        """
+        h, w = image.shape
+        halo = Filter.get_halo_size(median_kernel, bilateral_kernel)
+        top, left = max(region.top - halo, 0), max(region.left - halo, 0)
+        bottom, right = min(region.bottom + halo, h), min(region.right + halo, w)
+
+        processed = Filter.process_image(image[top:bottom, left:right], median_kernel, bilateral_kernel,
+                                         bilateral_color, dtype, quantize)
+        return processed[region.top - top:region.bottom - top, region.left - left:region.right - left].copy()
+
+    @staticmethod
+    def process_image(image, median_kernel=5, bilateral_kernel=17, bilateral_color=9, dtype=np.float64,
+                      quantize=False):
         """
         Filters image by using median and bilateral filters followed by Scharr operator.
         :param image: Image to process. This image is not modified by the operation.
         :param median_kernel: The size of median filter kernel.
         :param bilateral_kernel: The size of bilateral filter kernel.
         :param bilateral_color: A color delta that is still considered to represent the same color.
+        :param dtype: Floating point type of the processed image, either np.float32 or np.float64.
+        :param quantize: If True, the processed image is returned as uint16 (see quantize_image).
         :return: New, processed image.
         """
         image = cv2.medianBlur(image, median_kernel)
         image = cv2.bilateralFilter(image, bilateral_kernel, bilateral_color, 200)
-        image = Filter._scharr(image)
+        image = Filter._scharr(image, dtype)
+        if quantize:
+            image = Filter.quantize_image(image)
         return image
@@ -0,0 +1,109 @@
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from src.filter import Filter
+from src.utils import Rectangle
+
+__author__ = "Ivan Sevcik"
+
+
+class FilterExecutor(object):
+    """
+    Runs Filter.process_image on multiple cores. The image is split into tiles that are filtered together with their
+    halo (see Filter.process_region) on a pool of threads and stitched back. OpenCV releases GIL while filtering, so the
+    threads run in parallel. The result is identical to the untiled one for np.float64 images. For np.float32 images,
+    the gradient magnitude is rounded differently depending on position of pixel in the tile, so the results differ
+    within tolerance returned by get_tolerance.
+    """
+    # Relative and absolute tolerance of tiled np.float32 results, a few units in the last place
+    float32_tolerance = (1e-6, 1e-6)
+    workers = None
+    tile_size = None
+    _pool = None
+    _shared = None
+
+    def __init__(self, workers=None, tile_size=256):
+        '''
+        :param workers: Number of worker threads. If None, number of CPUs is used.
+        :param tile_size: Size of the square tile in pixels.
+        '''
+        self.workers = workers if workers is not None else multiprocessing.cpu_count()
+        self.tile_size = tile_size
+        self._pool = ThreadPool(self.workers) if self.workers > 1 else None
+
+    @staticmethod
+    def get_shared(workers=None, tile_size=256):
+        '''
+        Returns executor shared by whole process. It's created on first call or when requested parameters change.
+        :param workers: Number of worker threads. If None, number of CPUs is used.
+        :param tile_size: Size of the square tile in pixels.
+        :return: Shared executor instance.
+        '''
+        executor = FilterExecutor._shared
+        workers = workers if workers is not None else multiprocessing.cpu_count()
+        if executor is None or executor.workers != workers or executor.tile_size != tile_size:
+            if executor is not None:
+                executor.close()
+            executor = FilterExecutor(workers, tile_size)
+            FilterExecutor._shared = executor
+        return executor
+
+    def close(self):
+        '''
+        Stops worker threads. The executor can't be used afterwards.
+        '''
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    @staticmethod
+    def get_tolerance(dtype=np.float64, quantize=False):
+        '''
+        Returns how much tiled result may differ from untiled one (see numpy.allclose).
+        :param dtype: Floating point type of the processed image.
+        :param quantize: Whether the processed image is quantized.
+        :return: tuple of relative and absolute tolerance
+        '''
+        if np.dtype(dtype) == np.float64:
+            return 0.0, 0.0
+        if quantize:
+            # Rounding of slightly different values may differ by one
+            return 0.0, 1.0
+        return FilterExecutor.float32_tolerance
+
+    def get_tiles(self, shape):
+        '''
+        Splits image of given shape into tiles.
+        :param shape: Shape of the image.
+        :return: List of rectangles covering the image.
+        '''
+        h, w = shape
+        tiles = list()
+        for top in range(0, h, self.tile_size):
+            for left in range(0, w, self.tile_size):
+                tiles.append(Rectangle(left, top, min(left + self.tile_size, w), min(top + self.tile_size, h)))
+        return tiles
+
+    def process_image(self, image, median_kernel=5, bilateral_kernel=17, bilateral_color=9, dtype=np.float64,
+                      quantize=False):
+        '''
+        Filters image in parallel. See Filter.process_image for description of parameters.
+        :return: New, processed image.
+        '''
+        tiles = self.get_tiles(image.shape)
+        result = np.empty(image.shape, dtype=np.uint16 if quantize else dtype)
+
+        def process_tile(tile):
+            result[tile.top:tile.bottom, tile.left:tile.right] = \
+                Filter.process_region(image, tile, median_kernel, bilateral_kernel, bilateral_color, dtype, quantize)
+
+        if self._pool is None or len(tiles) == 1:
+            for tile in tiles:
+                process_tile(tile)
+        else:
+            self._pool.map(process_tile, tiles, chunksize=1)
+
+        return result
@@ -1,27 +1,177 @@
+from threading import Condition
+
 import cv2
 import numpy as np
-from scipy import signal
-from PyQt5.QtCore import Qt, QRectF
+from PyQt5.QtCore import Qt, QRectF, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QPixmap
-from PyQt5.QtWidgets import QDialog, QGraphicsScene, QSlider, QBoxLayout, QHBoxLayout, QLabel
+from PyQt5.QtWidgets import QDialog, QGraphicsScene, QSlider, QHBoxLayout, QLabel, QCheckBox
 
 from gui.filtering import Ui_Dialog
 from src.MultiresFramework import MultiResolutionFramework
 from src.datamanager import DataManager
+from src.filter import Filter
 from src.utils import toQImage
 
 __author__ = "Ivan Sevcik"
 
+
+class PreviewCancelled(Exception):
+    pass
+
+
+class PreviewWorker(QThread):
+    """
+    Computes filtering previews in background. Only the latest submitted job is computed; older pending jobs are
+    dropped and a running job is cancelled between stages once a newer one is submitted. Result of every stage is
+    kept, so stages whose inputs didn't change are not computed again.
+    """
+    preview_ready = pyqtSignal(int, np.ndarray)
+
+    save_path = "together.png"
+
+    _condition = None
+    _job = None
+    _generation = 0
+    _stop = False
+    _stages = None
+
+    def __init__(self):
+        super(PreviewWorker, self).__init__()
+        self._condition = Condition()
+        self._stages = dict()
+
+    def submit(self, image_key, image, params, save=False):
+        '''
+        Submits new preview job, replacing any pending one.
+        :param image_key: Key identifying the image, e.g. its sampling level.
+        :param image: Image to filter.
+        :param params: tuple of median kernel, bilateral kernel, bilateral color, outer and inner radius of frequency band
+        :param save: If True, the preview is also written to 'save_path'.
+        :return: Generation of the job that is passed to preview_ready signal.
+        '''
+        with self._condition:
+            self._generation += 1
+            self._job = (self._generation, image_key, image, params, save)
+            self._condition.notify()
+            return self._generation
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        # Note: This is never called directly. It is called by Qt once the
+        # thread environment has been set up.
+        while True:
+            with self._condition:
+                while not self._stop and self._job is None:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                job = self._job
+                self._job = None
+
+            try:
+                preview = self._process(job)
+            except PreviewCancelled:
+                continue
+
+            self.preview_ready.emit(job[0], preview)
+
+    def _stage(self, name, key, compute, generation):
+        '''
+        Returns result of the stage, computing it only if its key has changed since last time.
+        :param name: Name of the stage.
+        :param key: Key describing all inputs of the stage.
+        :param compute: Function computing the result.
+        :param generation: Generation of the processed job. If newer job was submitted, PreviewCancelled is raised.
+        :return: Result of the stage.
+        '''
+        if self._stop or self._generation != generation:
+            raise PreviewCancelled()
+
+        cached = self._stages.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        result = compute()
+        self._stages[name] = (key, result)
+        return result
+
+    @staticmethod
+    def _band_filter(spectrum, shape, outer_radius, inner_radius):
+        '''
+        Keeps only frequencies within the band and transforms the image back.
+        :param spectrum: Half spectrum from rfft2 shifted along rows, so zero frequency is at (rows / 2, 0).
+        :param shape: Shape of the original image.
+        :param outer_radius: Frequencies farther than this are removed. If 0, no frequency is removed.
+        :param inner_radius: Frequencies closer than this are removed.
+        :return: tuple of masked spectrum and filtered image
+        '''
+        if outer_radius != 0:
+            mask = np.zeros(spectrum.shape)
+            crow = shape[0] / 2
+            cv2.circle(mask, (0, crow), outer_radius, 1, -1)
+            cv2.circle(mask, (0, crow), inner_radius, 0, -1)
+            spectrum = spectrum * mask
+
+        img_back = np.fft.irfft2(np.fft.ifftshift(spectrum, axes=0), s=shape)
+        return spectrum, np.abs(img_back)
+
+    def _process(self, job):
+        generation, image_key, img, params, save = job
+        med_kernel, bi_kernel, bi_color, outer_radius, inner_radius = params
+
+        med_key = (image_key, med_kernel)
+        med = self._stage("median", med_key,
+                          lambda: cv2.medianBlur(img, med_kernel) if med_kernel > 1 else img, generation)
+
+        bi_key = med_key + (bi_kernel, bi_color)
+        med_bi = self._stage("bilateral", bi_key,
+                             lambda: cv2.bilateralFilter(med, bi_kernel, bi_color, 200) if bi_kernel > 1 else med,
+                             generation)
+        # Image is real, so half of the spectrum is enough
+        spectrum = self._stage("spectrum", bi_key, lambda: np.fft.fftshift(np.fft.rfft2(med_bi), axes=0), generation)
+
+        band_key = bi_key + (outer_radius, inner_radius)
+        spectrum, img_back = self._stage("band", band_key, lambda: PreviewWorker._band_filter(
+            spectrum, img.shape, outer_radius, inner_radius), generation)
+        grad_med_bi = self._stage("scharr", band_key, lambda: Filter._scharr(img_back), generation)
+
+        def compose():
+            mag = 20 * np.log(np.abs(spectrum) + 1)
+            images = [img.astype(np.uint8)]
+            for part in (mag, img_back, grad_med_bi):
+                max_value = part.max()
+                images.append(((part / max_value) * 255 if max_value > 0 else part).astype(np.uint8))
+            return np.hstack(images)
+
+        together = self._stage("compose", band_key, compose, generation)
+        if save:
+            cv2.imwrite(self.save_path, together)
+        return together
+
+
 class FilteringDialog(QDialog, Ui_Dialog):
     scene = None
+    pixmap_item = None
     base_image = None
     image = None
     current_sampling_level = 0
 
     sliders = None
     labels = None
+    save_check_box = None
     fit_allowed = False
 
+    # Slider changes are collected for this long before a preview is requested
+    debounce_interval = 30
+    debounce_timer = None
+    worker = None
+    latest_generation = None
+
     def __init__(self, data_manager):
         super(FilteringDialog, self).__init__()
         self.setupUi(self)
@@ -36,6 +186,16 @@ class FilteringDialog(QDialog, Ui_Dialog):
 
         self.scene = QGraphicsScene()
         self.graphicsView.setScene(self.scene)
+        self.pixmap_item = self.scene.addPixmap(QPixmap())
+
+        self.worker = PreviewWorker()
+        self.worker.preview_ready.connect(self._show_preview)
+        self.worker.start()
+
+        self.debounce_timer = QTimer(self)
+        self.debounce_timer.setSingleShot(True)
+        self.debounce_timer.setInterval(self.debounce_interval)
+        self.debounce_timer.timeout.connect(self._redraw)
 
         self.levelSlider.setRange(1, MultiResolutionFramework.levels_count)
         self.levelSlider.setValue(self.current_sampling_level + 1)
@@ -58,9 +218,18 @@ class FilteringDialog(QDialog, Ui_Dialog):
             self.sliders.append(slider)
             self.labels.append(label)
 
+        self.save_check_box = QCheckBox("Save to %s" % PreviewWorker.save_path, self.scrollAreaWidgetContents)
+        self.save_check_box.stateChanged.connect(self._slider_moved)
+        self.scrollAreaWidgetContents.layout().addWidget(self.save_check_box)
+
         self._set_labels()
         self._redraw()
 
+    def done(self, result):
+        self.debounce_timer.stop()
+        self.worker.stop()
+        super(FilteringDialog, self).done(result)
+
     def _sampling_level_changed(self, value):
         self.current_sampling_level = value - 1
 
@@ -76,7 +245,7 @@ class FilteringDialog(QDialog, Ui_Dialog):
 
     def _slider_moved(self, value):
         self._set_labels()
-        self._redraw()
+        self.debounce_timer.start()
 
     def _set_labels(self):
         for i, label in enumerate(self.labels):
@@ -85,17 +254,6 @@ class FilteringDialog(QDialog, Ui_Dialog):
                 value = value * 2 + 1 if value >= 1 else 0
             label.setText(str(value))
 
-    def _scharr_filter(self, img):
-        grad_x = cv2.Scharr(img, cv2.CV_64F, 1, 0) / 16
-        grad_y = cv2.Scharr(img, cv2.CV_64F, 0, 1) / 16
-        grad = np.sqrt(grad_x ** 2 + grad_y ** 2)
-        return grad
-
-    def _perform_fft(self, img):
-        f = np.fft.fft2(img)
-        fshift = np.fft.fftshift(f)
-        return fshift
-
     def _focus_view(self, size):
         if not self.fit_allowed:
             self.fit_allowed = True
@@ -104,46 +262,20 @@ class FilteringDialog(QDialog, Ui_Dialog):
         self.scene.setSceneRect(rect)
 
     def _redraw(self):
-        self.scene.clear()
-        img = self.image.copy()
-
-        med_kernel = self.sliders[0].value() * 2 + 1
-        bi_kernel = self.sliders[1].value() * 2 + 1
-        bi_color = self.sliders[2].value()
-
-        med = cv2.medianBlur(img, med_kernel) if med_kernel > 1 else img
-        med_bi = cv2.bilateralFilter(med, bi_kernel, bi_color, 200) if bi_kernel > 1 else med
-
-        fshift = self._perform_fft(med_bi)
-        # scharr = np.array([[ -1/16-1/16j, 1/2-1/8j,  +1/16 -1/16j],
-        #                    [-1/8+0j, 1/2+0j, +1/8 +0j],
-        #                    [ -1/16+1/16j, 0+1/8j,  +1/16 +1/16j]]) # Gx + j*Gy
-        # fshift = signal.convolve2d(fshift, scharr, boundary='symm', mode='same')
-
-        if self.sliders[3].value() != 0:
-            rows, cols = img.shape
-            crow, ccol = rows / 2, cols / 2
-            mask = np.zeros(fshift.shape)
-            cv2.circle(mask, (ccol, crow), self.sliders[3].value(), 1, -1)
-            cv2.circle(mask, (ccol, crow), self.sliders[4].value(), 0, -1)
-            fshift *= mask
-
-        f_ishift = np.fft.ifftshift(fshift)
-        img_back = np.fft.ifft2(f_ishift)
-        img_back = np.abs(img_back)
-
-        grad_med_bi = self._scharr_filter(img_back)
-
-        # img = (img / img.max()) * 255
-        mag = 20 * np.log(np.abs(fshift))
-        mag = (mag / mag.max()) * 255
-        img_back = (img_back / img_back.max()) * 255
-        grad_med_bi = (grad_med_bi / grad_med_bi.max()) * 255
-
-        together = np.hstack(
-            (img.astype(np.uint8), mag.astype(np.uint8), img_back.astype(np.uint8), grad_med_bi.astype(np.uint8)))
-        cv2.imwrite("together.png", together)
+        '''
+        Requests preview for current settings. It's shown by _show_preview once the worker computes it.
+        '''
+        params = (self.sliders[0].value() * 2 + 1, self.sliders[1].value() * 2 + 1, self.sliders[2].value(),
+                  self.sliders[3].value(), self.sliders[4].value())
+        self.latest_generation = self.worker.submit(self.current_sampling_level, self.image, params,
+                                                    self.save_check_box.isChecked())
+
+    def _show_preview(self, generation, together):
+        # Ignore previews that were computed for older settings
+        if generation != self.latest_generation:
+            return
+
         qimg = toQImage(together)
-        self.scene.addPixmap(QPixmap.fromImage(qimg))
+        self.pixmap_item.setPixmap(QPixmap.fromImage(qimg))
 
         self._focus_view((qimg.width(), qimg.height()))
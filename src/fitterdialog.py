@@ -1,10 +1,11 @@
 import os
+from collections import deque
 from copy import deepcopy
 from time import sleep
 
 import numpy as np
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QRectF
-from PyQt5.QtGui import QColor, QPixmap, QPen, QBrush
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QRectF, QTimer
+from PyQt5.QtGui import QColor, QPixmap, QPen, QBrush, QPainterPath, QGuiApplication
 from PyQt5.QtWidgets import QDialog, QFileDialog, QGraphicsSceneMouseEvent, QSlider
 
 from gui.fitterdialog import Ui_fitterDialog
@@ -12,12 +13,15 @@ from src.ActiveShapeModel import ActiveShapeModel
 from src.InitialPoseModel import InitialPoseModel
 from src.MultiresFramework import MultiResolutionFramework, ResolutionLevel
 from src.datamanager import DataManager
-from src.filter import Filter
 from src.interactivegraphicsscene import InteractiveGraphicsScene
+from src.modelregistry import ModelRegistry
 from src.radiograph import Radiograph
 from src.sampler import Sampler
+from src.searchbudget import SearchBudget
+from src.tiledimage import TiledImage
 from src.tooth import Tooth
-from src.utils import toQImage, StopIterationToken
+from src.toothitem import ToothItem
+from src.utils import toQImage, StopIterationToken, SnapshotSlot
 
 __author__ = "Ivan Sevcik"
 
@@ -30,11 +34,23 @@ class Animator(QThread):
 
     run_config = False
     run_last_level = None
+    # SearchBudget of the full algorithm, None means no limit
+    budget = None
 
-    def __init__(self, asm):
+    # If True, the search runs at full speed and only publishes frames into snapshot_slot, which is read by GUI at its
+    # own pace. All published frames are recorded into trajectory so they can be replayed later.
+    full_speed = False
+    snapshot_slot = None
+    trajectory = None
+    max_trajectory_length = 10000
+
+    def __init__(self, asm, full_speed=False):
         super(Animator, self).__init__()
         self.active_shape_model = asm
         self.stop_token = StopIterationToken()
+        self.full_speed = full_speed
+        self.snapshot_slot = SnapshotSlot()
+        self.trajectory = deque(maxlen=self.max_trajectory_length)
 
     def __del__(self):
         # Notify worker that it's being destroyed so it can stop
@@ -45,15 +61,33 @@ class Animator(QThread):
         # thread environment has been set up.
 
         if self.run_config:
-            self.active_shape_model.run(self.stop_token, self.asm_run_callback)
+            self.active_shape_model.run(self.stop_token, self.asm_run_callback, self.budget)
             return
 
         while not self.stop_token.stop:
             self.active_shape_model.make_step()
-            self.tooth_signal.emit(deepcopy(self.active_shape_model.current_tooth),
-                                   deepcopy(self.active_shape_model.current_params))
+            if self.full_speed:
+                self._publish_frame()
+            else:
+                self.tooth_signal.emit(deepcopy(self.active_shape_model.current_tooth),
+                                       deepcopy(self.active_shape_model.current_params))
+
+    def _publish_frame(self):
+        """
+        Publishes current state of the search as a frame (tooth, params, level) and records it into trajectory.
+        """
+        asm = self.active_shape_model
+        tooth = Tooth(asm.current_tooth.landmarks.copy()) if asm.current_tooth is not None else None
+        params = asm.current_params.copy() if asm.current_params is not None else None
+        frame = (tooth, params, asm.current_level)
+        self.snapshot_slot.publish(frame)
+        self.trajectory.append(frame)
 
     def asm_run_callback(self):
+        if self.full_speed:
+            self._publish_frame()
+            return
+
         level_change = False
         if self.run_last_level != self.active_shape_model.current_level:
             self.run_last_level = self.active_shape_model.current_level
@@ -88,16 +122,40 @@ class FitterDialog(QDialog, Ui_fitterDialog):
     show_sampled_positions = None
 
     radiograph_image = None
-    cached_init_poses = None
+    radiograph_pyramid = None
+    # Key identifying the radiograph (see InitialPoseModel.find)
+    radiograph_key = None
+
+    # Timer presenting frames published by animator running at full speed, and state of trajectory replay
+    frame_timer = None
+    presented_version = 0
+    replay_fps = 10
+    replay_trajectory = None
+    replay_position = 0
+
+    # Items kept in the scene between redraws
+    pixmap_item = None
+    pixmap_source = None
+    pixmap_version = None
+    samples_item = None
+    pose_items = None
+    tooth_item = None
 
     @property
     def image(self):
-        return self.active_shape_model.current_image
-
-    @image.setter
-    def image(self, img):
-        self.radiograph_image = img
-        self.active_shape_model.set_image_to_search(img)
+        # Level shown by the dialog may lag behind the level of model running at full speed
+        return self.active_shape_model.multi_resolution_framework.get_level(self.current_sampling_level).image
+
+    def _set_radiograph(self, radiograph):
+        """
+        Sets radiograph on which the search is performed. Processed images are taken from the model registry.
+        :param radiograph: Radiograph instance
+        """
+        pyramid = ModelRegistry.get().get_radiograph_pyramid(radiograph)
+        self.active_shape_model.set_pyramid_to_search(pyramid)
+        self.radiograph_image = pyramid.default_images[0]
+        self.radiograph_pyramid = pyramid
+        self.radiograph_key = radiograph.path_to_img
 
     def __init__(self, data_manager, pca):
         super(FitterDialog, self).__init__()
@@ -107,15 +165,16 @@ class FitterDialog(QDialog, Ui_fitterDialog):
         assert isinstance(data_manager, DataManager)
         self.data_manager = data_manager
         self.pca = pca
-        self.active_shape_model = ActiveShapeModel(self.data_manager, self.pca)
+        self.active_shape_model = ActiveShapeModel(self.data_manager, self.pca,
+                                                   ModelRegistry.get().get_landmark_models(self.data_manager))
         self.initial_pose_model = InitialPoseModel(self.data_manager)
 
         self.scene = InteractiveGraphicsScene()
         self.graphicsView.setScene(self.scene)
         self.scene.clicked.connect(self._set_position)
+        self._create_scene_items()
 
-        self.image = self.data_manager.radiographs[0].image
-        self.radiograph_image = Filter.crop_image(self.data_manager.radiographs[0].image)
+        self._set_radiograph(self.data_manager.radiographs[0])
 
         self.openButton.clicked.connect(self._open_radiograph)
         self.exportButton.clicked.connect(self._export_result)
@@ -131,6 +190,11 @@ class FitterDialog(QDialog, Ui_fitterDialog):
 
         self.stepButton.clicked.connect(self._perform_one_step_asm)
         self.animateButton.clicked.connect(self._animator_entry)
+        self.replayButton.clicked.connect(self._replay_entry)
+        self.replayButton.setEnabled(False)
+
+        self.frame_timer = QTimer(self)
+        self.frame_timer.timeout.connect(self._present_frame)
 
         self._scales = np.empty(self.pca.eigen_values.shape)
         for i, deviation in enumerate(self.pca.get_allowed_deviation()):
@@ -147,6 +211,7 @@ class FitterDialog(QDialog, Ui_fitterDialog):
         self._redraw(self.active_shape_model.current_tooth)
 
     def closeEvent(self, event):
+        self.frame_timer.stop()
         if self.animator is not None:
             self.animator.stop()
 
@@ -160,9 +225,7 @@ class FitterDialog(QDialog, Ui_fitterDialog):
                 self.animator.stop()
             radiograph = Radiograph()
             radiograph.path_to_img = file_dialog.selectedFiles()[0]
-            self.image = radiograph.image
-            self.radiograph_image = Filter.crop_image(radiograph.image)
-            self.cached_init_poses = None
+            self._set_radiograph(radiograph)
             self._redraw(self.active_shape_model.current_tooth)
 
     def _export_result(self):
@@ -199,12 +262,12 @@ class FitterDialog(QDialog, Ui_fitterDialog):
         self.show_sampled_positions = self.sampledPositionsCheckBox.isChecked()
         self._redraw(self.active_shape_model.current_tooth)
 
-    def model_change_level(self, sampling_level):
+    def model_change_level(self, sampling_level, tooth=None):
         self.current_sampling_level = sampling_level
         self.levelSlider.setValue(self.current_sampling_level + 1)
 
         self.update_scale()
-        self._redraw(self.active_shape_model.current_tooth)
+        self._redraw(tooth if tooth is not None else self.active_shape_model.current_tooth)
 
     def update_scale(self):
         real_scale = 1 + self.current_scale * (0.1 if self.current_scale >= 0 else 0.05)
@@ -229,12 +292,15 @@ class FitterDialog(QDialog, Ui_fitterDialog):
     def _animation_start(self):
         self._disable_ui()
 
-        self.animator = Animator(self.active_shape_model)
+        self.animator = Animator(self.active_shape_model, self.fullSpeedCheckBox.isChecked())
 
         self.animator.run_config = self.fullAsmCheckBox.isChecked()
+        # Time limit of the full algorithm, it's counted including animation, so it's meant for running at full speed
+        if self.budgetSpinBox.value() > 0:
+            self.animator.budget = SearchBudget(self.budgetSpinBox.value())
         if self.animator.run_config:
             tooth_idx = self.startingPoseSpinBox.value()
-            pose = self.initial_pose_model.find(self.radiograph_image)[tooth_idx]
+            pose = self.initial_pose_model.find_in_pyramid(self.radiograph_pyramid, self.radiograph_key)[tooth_idx]
             position, rotation, scale = pose
             self.active_shape_model.set_up(position, rotation, scale)
 
@@ -242,13 +308,34 @@ class FitterDialog(QDialog, Ui_fitterDialog):
         self.animator.tooth_signal.connect(self.update_animation)
         self.animator.level_signal.connect(self.model_change_level)
 
+        if self.animator.full_speed:
+            self.presented_version = 0
+            self.frame_timer.start(self._get_frame_interval())
+
         self.animator.start()
 
     def _animator_end(self):
-        self.animateButton.setText("Animate")
+        if self.animator.full_speed:
+            # Show the final state and keep the recorded trajectory for replay
+            self.frame_timer.stop()
+            self._present_frame()
+            self.replay_trajectory = list(self.animator.trajectory)
+
+        if self.animator.run_config and not self.animator.stop_token.stop:
+            print "Search %s" % ("converged" if self.active_shape_model.search_converged else
+                                 "didn't converge" + (" in time" if self.active_shape_model.search_expired else ""))
+
         self.animator = None
+        self._enable_ui()
+
+    def _enable_ui(self):
+        self.animateButton.setText("Animate")
+        self.animateButton.setEnabled(True)
         self.stepButton.setEnabled(True)
         self.fullAsmCheckBox.setEnabled(True)
+        self.fullSpeedCheckBox.setEnabled(True)
+        self.budgetSpinBox.setEnabled(True)
+        self.replayButton.setEnabled(self.replay_trajectory is not None and len(self.replay_trajectory) > 0)
         self.scene.setEnabled(True)
         self.levelSlider.setEnabled(True)
         self.exportButton.setEnabled(self.active_shape_model.current_tooth is not None)
@@ -258,10 +345,86 @@ class FitterDialog(QDialog, Ui_fitterDialog):
         self.animateButton.setText("Stop")
         self.stepButton.setEnabled(False)
         self.fullAsmCheckBox.setEnabled(False)
+        self.fullSpeedCheckBox.setEnabled(False)
+        self.budgetSpinBox.setEnabled(False)
+        self.replayButton.setEnabled(False)
         self.scene.setEnabled(False)
         self.levelSlider.setEnabled(False)
         self.exportButton.setEnabled(False)
 
+    @staticmethod
+    def _get_frame_interval():
+        """
+        Returns interval between frames that matches refresh rate of the display.
+        :return: Interval in milliseconds.
+        """
+        refresh_rate = QGuiApplication.primaryScreen().refreshRate()
+        return int(1000 / refresh_rate) if refresh_rate > 0 else 16
+
+    def _present_frame(self):
+        """
+        Shows the latest frame published by the animator, if there is any new one.
+        """
+        if self.animator is None:
+            return
+
+        version, frame = self.animator.snapshot_slot.latest
+        if version == self.presented_version:
+            return
+
+        self.presented_version = version
+        self._show_frame(frame)
+
+    def _show_frame(self, frame):
+        """
+        Shows one frame of the animation.
+        :param frame: tuple of tooth, params and level
+        """
+        tooth, params, level = frame
+        self._set_sliders_from_params(params)
+        if level != self.current_sampling_level:
+            self.model_change_level(level, tooth)
+        else:
+            self._redraw(tooth)
+
+    def _replay_entry(self):
+        if self.frame_timer.isActive():
+            self._replay_end()
+        else:
+            self._replay_start()
+
+    def _replay_start(self):
+        self._disable_ui()
+        self.animateButton.setEnabled(False)
+        self.replayButton.setEnabled(True)
+        self.replayButton.setText("Stop")
+
+        self.replay_position = 0
+        self.frame_timer.timeout.disconnect(self._present_frame)
+        self.frame_timer.timeout.connect(self._present_replay_frame)
+        self.frame_timer.start(int(1000 / self.replay_fps))
+
+    def _present_replay_frame(self):
+        """
+        Shows next frame of recorded trajectory at fixed rate.
+        """
+        if self.replay_position >= len(self.replay_trajectory):
+            self._replay_end()
+            return
+
+        self._show_frame(self.replay_trajectory[self.replay_position])
+        self.replay_position += 1
+
+    def _replay_end(self):
+        self.frame_timer.stop()
+        self.frame_timer.timeout.disconnect(self._present_replay_frame)
+        self.frame_timer.timeout.connect(self._present_frame)
+
+        # Return to the final state of the search
+        self._show_frame(self.replay_trajectory[-1])
+        self.replayButton.setText("Replay")
+        self._enable_ui()
+
     def update_animation(self, tooth, params):
         self._set_sliders_from_params(params)
         self._redraw(tooth)
@@ -270,44 +433,72 @@ class FitterDialog(QDialog, Ui_fitterDialog):
         rect = QRectF(0, 0, size[0], size[1])
         self.scene.setSceneRect(rect)
 
-    def _redraw(self, tooth, normalize=True):
-        self.scene.clear()
+    def _create_scene_items(self):
+        """
+        Creates items that are kept in the scene and only updated by _redraw.
+        """
+        self.pixmap_item = self.scene.addPixmap(QPixmap())
+        self.samples_item = self.scene.addPath(QPainterPath(), QPen(Qt.NoPen), QBrush(QColor.fromRgb(255, 255, 255)))
+        self.pose_items = list()
+        self.tooth_item = ToothItem(self.scene, True, True)
+        self.tooth_item.set_visible(False)
+
+    def _update_pixmap(self, normalize):
+        """
+        Converts current image to pixmap, but only when the image has changed since last call.
+        :param normalize: If True, image values are stretched to full range.
+        """
+        image = self.image
+        # Lazily filtered image changes as more of its tiles are filtered
+        version = image.filtered_pixels if isinstance(image, TiledImage) else None
+        if self.pixmap_source is image and self.pixmap_version == (version, normalize):
+            return
 
-        img = self.image.copy()
+        # Lazily filtered image is shown only in the parts that were already filtered
+        img = image.to_array(False) if isinstance(image, TiledImage) else image.copy()
 
-        if normalize:
+        if normalize and img.max() > 0:
             img = (img / img.max()) * 255
 
-        # Draw sampled positions to image
-        if self.show_sampled_positions and tooth is not None:
-            resolution_level = self.active_shape_model.get_current_level()
-            assert isinstance(resolution_level, ResolutionLevel)
-            all_sample_positions = []
-            Sampler.sample(tooth, img, resolution_level.landmark_model.m, False, all_sample_positions)
-            for point_sample_positions in all_sample_positions:
-                for x, y in point_sample_positions:
-                    img[y, x] = 255
+        self.pixmap_item.setPixmap(QPixmap.fromImage(toQImage(img.astype(np.uint8))))
+        self.pixmap_source = image
+        self.pixmap_version = (version, normalize)
 
-        # Draw image
-        qimg = toQImage(img.astype(np.uint8))
-        self.scene.addPixmap(QPixmap.fromImage(qimg))
-
-        # Draw initial positions
-        if self.cached_init_poses is None:
-            self.cached_init_poses = self.initial_pose_model.find(self.radiograph_image)
+    def _redraw(self, tooth, normalize=True):
+        self._update_pixmap(normalize)
 
-        for pose in self.cached_init_poses:
-            position, scale, rotation = InitialPoseModel.downsample_pose(pose, self.current_sampling_level)
-            self.scene.addEllipse(position[0] - 2, position[1] - 2, 4, 4,
-                                  pen=QPen(QColor.fromRgb(0, 0, 255)), brush=QBrush(QColor.fromRgb(0, 0, 255)))
+        # Draw sampled positions over the image
+        samples_path = QPainterPath()
+        if self.show_sampled_positions and tooth is not None:
+            resolution_level = self.active_shape_model.multi_resolution_framework.get_level(
+                self.current_sampling_level)
+            assert isinstance(resolution_level, ResolutionLevel)
+            for i, center_point in enumerate(tooth.landmarks):
+                positions = Sampler._find_sample_positions(center_point, tooth.normals[i],
+                                                           resolution_level.landmark_model.m)
+                for x, y in positions:
+                    samples_path.addRect(x, y, 1, 1)
+        self.samples_item.setPath(samples_path)
+
+        # Draw initial positions, they are found only once for every radiograph
+        init_poses = self.initial_pose_model.find_in_pyramid(self.radiograph_pyramid, self.radiograph_key)
+        while len(self.pose_items) < len(init_poses):
+            self.pose_items.append(self.scene.addEllipse(0, 0, 0, 0, pen=QPen(QColor.fromRgb(0, 0, 255)),
+                                                         brush=QBrush(QColor.fromRgb(0, 0, 255))))
+        for i, pose_item in enumerate(self.pose_items):
+            pose_item.setVisible(i < len(init_poses))
+            if i < len(init_poses):
+                position, scale, rotation = InitialPoseModel.downsample_pose(init_poses[i], self.current_sampling_level)
+                pose_item.setRect(position[0] - 2, position[1] - 2, 4, 4)
 
         # Draw tooth from active shape model
         if tooth is not None:
-            tooth.outline_pen = QPen(QColor(255, 0, 0))
-            tooth.draw(self.scene, True, True)
+            self.tooth_item.update(tooth)
+        self.tooth_item.set_visible(tooth is not None)
 
-        # Set generated scene into the view
-        self._focus_view((qimg.width(), qimg.height()))
+        # Set size of the scene to the image
+        pixmap = self.pixmap_item.pixmap()
+        self._focus_view((pixmap.width(), pixmap.height()))
 
     def _perform_one_step_asm(self):
         if self.current_phase is None:
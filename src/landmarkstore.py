@@ -0,0 +1,158 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import tempfile
+from threading import Lock
+
+import numpy as np
+
+__author__ = "Ivan Sevcik"
+
+
+class LandmarkStore(object):
+    """
+    Landmarks of one set (e.g. "original") compiled from text files into single binary array of shape
+    (radiographs, teeth, points, 2), which is memory-mapped when loaded. An index next to the array stores numbers of
+    radiographs, signature of source files and checksum of their content. The store is rebuilt whenever the signature
+    doesn't match, i.e. some source file was added, removed or modified.
+    """
+    directory = "./data/Landmarks"
+    file_pattern = re.compile(r"landmarks(\d+)-(\d+)\.txt$")
+
+    _instances = dict()
+    _instances_lock = Lock()
+
+    set_name = None
+    landmarks = None
+    radiograph_numbers = None
+    checksum = None
+    _rows = None
+
+    def __init__(self, set_name="original", directory=None):
+        '''
+        Loads the store, building it first if needed.
+        :param set_name: Name of directory with landmark text files, e.g. "original" or "mirrored".
+        :param directory: Directory containing the sets.
+        '''
+        if directory is not None:
+            self.directory = directory
+        self.set_name = set_name
+
+        sources = self._find_sources()
+        signature = LandmarkStore._get_signature(sources)
+        index = self._read_index()
+        if index is None or index["signature"] != signature or not os.path.exists(self.array_path):
+            self._build(sources, signature)
+            index = self._read_index()
+
+        self.radiograph_numbers = index["radiographs"]
+        self.checksum = index["checksum"]
+        self._rows = dict((number, row) for row, number in enumerate(self.radiograph_numbers))
+        self.landmarks = np.load(self.array_path, mmap_mode="r")
+
+    @staticmethod
+    def get(set_name="original"):
+        '''
+        Returns shared store of the set from default directory.
+        :param set_name: Name of the set, e.g. "original" or "mirrored".
+        :return: LandmarkStore instance
+        '''
+        with LandmarkStore._instances_lock:
+            if set_name not in LandmarkStore._instances:
+                LandmarkStore._instances[set_name] = LandmarkStore(set_name)
+            return LandmarkStore._instances[set_name]
+
+    @property
+    def array_path(self):
+        return os.path.join(self.directory, "%s.npy" % self.set_name)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, "%s.json" % self.set_name)
+
+    def _find_sources(self):
+        '''
+        :return: dictionary mapping (radiograph number, tooth number) to path of the text file
+        '''
+        sources = dict()
+        for path in glob.glob(os.path.join(self.directory, self.set_name, "landmarks*-*.txt")):
+            match = self.file_pattern.search(os.path.basename(path))
+            if match is not None:
+                sources[(int(match.group(1)), int(match.group(2)))] = path
+        return sources
+
+    @staticmethod
+    def _get_signature(sources):
+        '''
+        Computes signature from names, sizes and modification times of source files, so it's cheap to check.
+        '''
+        digest = hashlib.sha1()
+        for key in sorted(sources):
+            stat = os.stat(sources[key])
+            digest.update("%d-%d:%d:%d;" % (key[0], key[1], stat.st_size, int(stat.st_mtime)))
+        return digest.hexdigest()
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path) as index_file:
+            return json.load(index_file)
+
+    def _build(self, sources, signature):
+        if len(sources) == 0:
+            raise IOError("No landmark files found in %s" % os.path.join(self.directory, self.set_name))
+
+        radiograph_numbers = sorted(set(key[0] for key in sources))
+        teeth_count = max(key[1] for key in sources)
+        rows = dict((number, row) for row, number in enumerate(radiograph_numbers))
+
+        checksum = hashlib.sha1()
+        landmarks = None
+        for key in sorted(sources):
+            with open(sources[key]) as landmarks_file:
+                content = landmarks_file.read()
+            checksum.update(content)
+            points = np.array(content.split(), dtype=float).reshape(-1, 2)
+            if landmarks is None:
+                # Missing teeth stay NaN
+                landmarks = np.full((len(radiograph_numbers), teeth_count) + points.shape, np.nan)
+            landmarks[rows[key[0]], key[1] - 1] = points
+
+        # Write to unique temporary files first, so other processes never see incomplete store
+        fd, array_tmp_path = tempfile.mkstemp(".tmp.npy", self.set_name + ".", self.directory)
+        with os.fdopen(fd, "wb") as array_file:
+            np.save(array_file, landmarks)
+        fd, index_tmp_path = tempfile.mkstemp(".tmp", self.set_name + ".", self.directory)
+        with os.fdopen(fd, "w") as index_file:
+            json.dump({"radiographs": radiograph_numbers, "teeth": teeth_count, "points": landmarks.shape[2],
+                       "signature": signature, "checksum": checksum.hexdigest()}, index_file)
+        # The array is replaced before the index, so the new signature never describes the old array. Rename replaces
+        # existing file at once, the store is never missing.
+        os.rename(array_tmp_path, self.array_path)
+        os.rename(index_tmp_path, self.index_path)
+
+    def verify(self):
+        '''
+        Checks content of source files against checksum stored when the store was built. Unlike the signature check
+        done on load, this reads all source files.
+        :return: True if the sources didn't change
+        '''
+        checksum = hashlib.sha1()
+        sources = self._find_sources()
+        for key in sorted(sources):
+            with open(sources[key]) as landmarks_file:
+                checksum.update(landmarks_file.read())
+        return checksum.hexdigest() == self.checksum
+
+    def has_radiograph(self, radiograph_idx):
+        return radiograph_idx + 1 in self._rows
+
+    def get_radiograph_landmarks(self, radiograph_idx):
+        '''
+        Returns landmarks of all teeth of the radiograph. The array is read-only view into the memory-mapped store.
+        :param radiograph_idx: Index of radiograph, i.e. its number - 1.
+        :return: array of shape (teeth, points, 2)
+        '''
+        return self.landmarks[self._rows[radiograph_idx + 1]]
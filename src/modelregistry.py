@@ -0,0 +1,202 @@
+from collections import OrderedDict
+from copy import copy
+from threading import Event, Lock, RLock, Thread
+
+from src.MultiresFramework import MultiResolutionFramework
+from src.StatisticalShapeModel import StatisticalShapeModel
+from src.config import Config
+from src.datamanager import DataManager
+from src.utils import image_fingerprint
+
+__author__ = "Ivan Sevcik"
+
+
+class ModelRegistry(object):
+    """
+    Process-wide cache of trained models and processed images. Returned objects are shared by all callers and must be
+    treated as read-only.
+    """
+    max_pyramids = 4
+
+    _instance = None
+    _instance_lock = Lock()
+    # Guards the caches only, models are trained and images processed without it
+    _lock = None
+    _pcas = None
+    _landmark_models = None
+    _pyramids = None
+    # Events of models that are being created, keyed by cache name and key
+    _pending = None
+
+    def __init__(self):
+        self._lock = RLock()
+        self._pcas = dict()
+        self._landmark_models = dict()
+        self._pyramids = OrderedDict()
+        self._pending = dict()
+
+    @staticmethod
+    def get():
+        '''
+        Returns the registry instance.
+        :return: ModelRegistry instance
+        '''
+        with ModelRegistry._instance_lock:
+            if ModelRegistry._instance is None:
+                ModelRegistry._instance = ModelRegistry()
+            return ModelRegistry._instance
+
+    def _get_or_create(self, cache_name, key, create, max_count=None):
+        '''
+        Returns cached model or creates it. Creation runs without the lock, so other models and images can be retrieved
+        meanwhile, while callers asking for the same model wait for the first one to create it.
+        :param cache_name: Name of attribute with the cache dictionary.
+        :param key: Key of the model in the cache.
+        :param create: Function creating the model.
+        :param max_count: If given, the cache is OrderedDict that keeps only this many most recently used models.
+        :return: cached or created model
+        '''
+        pending_key = (cache_name, key)
+        with self._lock:
+            cache = getattr(self, cache_name)
+            if key in cache:
+                model = cache[key]
+                if max_count is not None:
+                    # Reinsert to mark as most recently used, the entry is never missing for other callers
+                    del cache[key]
+                    cache[key] = model
+                return model
+            event = self._pending.get(pending_key)
+            creating = event is None
+            if creating:
+                event = Event()
+                self._pending[pending_key] = event
+
+        if not creating:
+            event.wait()
+            # If creation failed, this caller tries again
+            return self._get_or_create(cache_name, key, create)
+
+        try:
+            model = create()
+            with self._lock:
+                cache[key] = model
+                while max_count is not None and len(cache) > max_count:
+                    cache.popitem(last=False)
+            return model
+        finally:
+            with self._lock:
+                del self._pending[pending_key]
+            event.set()
+
+    @staticmethod
+    def _get_data_key(data_manager):
+        '''
+        Creates key describing training data that the data manager provides.
+        :param data_manager: Data manager instance
+        :return: tuple of jaw selector and indices of training radiographs
+        '''
+        assert isinstance(data_manager, DataManager)
+        return tuple(data_manager.selector), tuple(r.idx for r in data_manager.radiographs)
+
+    @staticmethod
+    def _get_processing_key():
+        '''
+        Creates key describing how the images are processed for the resolution levels.
+        :return: tuple of used filter presets, model parameters, image type settings and type of landmark models
+        '''
+        levels_count = MultiResolutionFramework.levels_count
+        return (tuple(MultiResolutionFramework._filter_presets[:levels_count]),
+                tuple(MultiResolutionFramework._model_params[:levels_count]),
+                str(Config.image_dtype), Config.quantize_images, Config.lazy_filtering,
+                Config.landmark_model, Config.appearance_shrinkage, Config.profile_pca_threshold,
+                Config.profile_pca_components)
+
+    def get_pca(self, data_manager, threshold):
+        '''
+        Returns statistical shape model for teeth currently selected in data manager, creating it if needed.
+        :param data_manager: Data manager supplying training data.
+        :param threshold: PCA threshold (see PCA.threshold)
+        :return: trained PCA
+        '''
+        key = (ModelRegistry._get_data_key(data_manager), round(threshold, 3))
+        def create():
+            pca = StatisticalShapeModel.create(data_manager)
+            pca.threshold(threshold)
+            return pca
+        return self._get_or_create("_pcas", key, create)
+
+    def get_landmark_models(self, data_manager):
+        '''
+        Returns landmark models of all resolution levels for teeth currently selected in data manager, training them if
+        needed.
+        :param data_manager: Data manager supplying training data.
+        :return: list of trained landmark models
+        '''
+        key = (ModelRegistry._get_data_key(data_manager), ModelRegistry._get_processing_key())
+        def create():
+            framework = MultiResolutionFramework(data_manager)
+            framework.train()
+            return framework.get_landmark_models()
+        return self._get_or_create("_landmark_models", key, create)
+
+    def get_pyramid(self, image, image_key=None):
+        '''
+        Returns processed images of all resolution levels for the image, processing it if needed. Only 'max_pyramids'
+        most recently used images are kept.
+        :param image: Original radiograph image or a function returning it. The function is called only when the image
+                      isn't cached yet.
+        :param image_key: Key identifying the image, e.g. its path. If None, fingerprint of the image is used.
+        :return: ImagePyramid instance
+        '''
+        if image_key is None:
+            image = image() if callable(image) else image
+            image_key = image_fingerprint(image)
+
+        return self._get_pyramid(image_key, lambda: MultiResolutionFramework.build_pyramid(
+            image() if callable(image) else image))
+
+    def _get_pyramid(self, image_key, build):
+        '''
+        Returns cached processed images or builds them.
+        :param image_key: Key identifying the image.
+        :param build: Function returning ImagePyramid of the image. It's called only when the image isn't cached yet.
+        :return: ImagePyramid instance
+        '''
+        # Different images are processed in parallel, the same image only once
+        key = (image_key, ModelRegistry._get_processing_key())
+        return self._get_or_create("_pyramids", key, build, self.max_pyramids)
+
+    def get_radiograph_pyramid(self, radiograph):
+        '''
+        Returns processed images of all resolution levels for the radiograph. Only region of interest of the image is
+        loaded and only if needed.
+        :param radiograph: Radiograph instance
+        :return: ImagePyramid instance
+        '''
+        return self._get_pyramid(radiograph.path_to_img, lambda: MultiResolutionFramework.build_pyramid_from_crop(
+            *radiograph.load_cropped()))
+
+    def preload(self, data_manager, thresholds, selectors):
+        '''
+        Creates models for given jaw selectors and processes the first radiograph in a background thread.
+        :param data_manager: Data manager supplying training data. Its selector is not modified.
+        :param thresholds: List of PCA thresholds for which to create shape models.
+        :param selectors: List of jaw selectors, e.g. range(0, 4).
+        :return: Started thread
+        '''
+        def run():
+            for selector in selectors:
+                view = copy(data_manager)
+                view.selector = selector
+                for threshold in thresholds:
+                    self.get_pca(view, threshold)
+                self.get_landmark_models(view)
+
+            if len(data_manager.radiographs) > 0:
+                self.get_radiograph_pyramid(data_manager.radiographs[0])
+
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
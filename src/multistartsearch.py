@@ -0,0 +1,166 @@
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from src.ActiveShapeModel import ActiveShapeModel
+from src.MultiresFramework import MultiResolutionFramework
+from src.searchbudget import SearchBudget
+
+__author__ = "Ivan Sevcik"
+
+
+class MultiStartSearch(object):
+    """
+    Searches a tooth from several initial poses randomly perturbed around the given one. All starts are searched for a
+    few steps at the coarsest level in parallel and scored by how well their profiles fit the image and how plausible
+    their shapes are. Only the best few starts are refined at finer levels and the best refined one is returned, so
+    a poor initial pose can be recovered. Every start is sampled separately, so the coarse stage costs about
+    starts_count / workers coarse searches of wall time.
+    """
+    # Number of searched poses including the given one
+    starts_count = 8
+    # Standard deviations of perturbations of translation (pixels in the original image), scale (relative) and
+    # rotation (radians)
+    translation_deviation = 8.0
+    scale_deviation = 0.08
+    rotation_deviation = 0.08
+    # Number of steps at the coarsest level made by every start
+    coarse_steps = 10
+    # Number of best starts that are refined at finer levels
+    refined_count = 2
+    # Share of time budget given to the coarse stage, the rest is left to refinement
+    coarse_time_share = 0.3
+    # Weight of shape cost relative to profile cost, both costs are standardized over all starts
+    shape_weight = 0.5
+    # Seed of perturbations, so the search is repeatable
+    seed = 0
+
+    data_manager = None
+    pca = None
+    landmark_models = None
+    pyramid = None
+    # Results of last search, tuples (pose, score at the coarsest level, score after refinement or None) for every start
+    start_results = None
+    # Index of the start whose result was returned by last search
+    best_start = None
+    # Whether refinement of the returned start converged (see ActiveShapeModel.search_converged)
+    search_converged = None
+    _pool = None
+
+    def __init__(self, data_manager, pca, landmark_models, pyramid, workers=4):
+        '''
+        :param data_manager: Data manager supplying training data of the jaw.
+        :param pca: Trained statistical shape model of the jaw.
+        :param landmark_models: Trained landmark models of all levels.
+        :param pyramid: ImagePyramid of the radiograph to search.
+        :param workers: Number of threads searching the starts.
+        '''
+        self.data_manager = data_manager
+        self.pca = pca
+        self.landmark_models = landmark_models
+        self.pyramid = pyramid
+        self._pool = ThreadPool(workers)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def generate_poses(self, pose):
+        '''
+        Generates initial poses of all starts.
+        :param pose: Initial pose in format (np.array(x position, y position), scale, rotation)
+        :return: list of poses, the first one is the given pose
+        '''
+        position, scale, rotation = pose
+        random = np.random.RandomState(self.seed)
+        poses = [pose]
+        for i in range(1, self.starts_count):
+            poses.append((position + random.normal(0, self.translation_deviation, 2),
+                          scale * np.exp(random.normal(0, self.scale_deviation)),
+                          rotation + random.normal(0, self.rotation_deviation)))
+        return poses
+
+    @staticmethod
+    def get_scores(costs, reference_costs, shape_weight):
+        '''
+        Combines profile and shape costs into single score.
+        :param costs: Costs in format [(profile cost, shape cost), ...]
+        :param reference_costs: Costs whose means and standard deviations are used to standardize the costs.
+        :param shape_weight: Weight of standardized shape cost.
+        :return: array of scores, lower is better
+        '''
+        reference_costs = np.array(reference_costs, dtype=np.float64)
+        deviations = reference_costs.std(axis=0)
+        deviations[deviations == 0] = 1
+        standardized = (np.array(costs, dtype=np.float64) - reference_costs.mean(axis=0)) / deviations
+        return standardized[:, 0] + shape_weight * standardized[:, 1]
+
+    def _search_coarse(self, task):
+        '''
+        Searches one start at the coarsest level.
+        :param task: tuple of the initial pose and SearchBudget of the coarse stage or None
+        :return: tuple of the ASM, costs at the coarsest level and costs at the finest level
+        '''
+        pose, budget = task
+        asm = ActiveShapeModel(self.data_manager, self.pca, self.landmark_models)
+        asm.set_pyramid_to_search(self.pyramid)
+        asm.set_up(*pose)
+        coarsest_level = MultiResolutionFramework.levels_count - 1
+        asm.run(budget=budget, first_level=coarsest_level, last_level=coarsest_level, max_steps=self.coarse_steps)
+        return asm, asm.get_fit_costs(coarsest_level), asm.get_fit_costs(0)
+
+    @staticmethod
+    def _refine(task):
+        asm, budget = task
+        first_level = max(MultiResolutionFramework.levels_count - 2, 0)
+        tooth = asm.run(budget=budget, first_level=first_level)
+        return tooth, asm.get_fit_costs(0), asm.search_converged
+
+    def split_budget(self, budget):
+        '''
+        Splits time of the whole search between the coarse stage and refinement.
+        :param budget: SearchBudget of the whole search or None.
+        :return: tuple of SearchBudget of the coarse stage and of refinement, both sharing limits of levels
+        '''
+        end_time = budget.get_end_time() if budget is not None else None
+        if end_time is None:
+            return budget, budget
+
+        now = time.time()
+        coarse_end_time = now + max(end_time - now, 0) * self.coarse_time_share
+        return SearchBudget(level_seconds=budget.level_seconds, deadline=coarse_end_time), \
+            SearchBudget(level_seconds=budget.level_seconds, deadline=end_time)
+
+    def search(self, pose, budget=None):
+        '''
+        Searches the tooth from all starts.
+        :param pose: Initial pose in format (np.array(x position, y position), scale, rotation)
+        :param budget: SearchBudget limiting the whole search (see ActiveShapeModel.run), coarse_time_share of it is
+                       given to the coarse stage.
+        :return: Found tooth positioned in the original radiograph.
+        '''
+        coarse_budget, refine_budget = self.split_budget(budget)
+        poses = self.generate_poses(pose)
+        coarse_results = self._pool.map(self._search_coarse, [(start_pose, coarse_budget) for start_pose in poses])
+
+        # Select the best starts at the coarsest level
+        coarse_costs = [costs for _, costs, _ in coarse_results]
+        coarse_scores = MultiStartSearch.get_scores(coarse_costs, coarse_costs, self.shape_weight)
+        refined_starts = list(np.argsort(coarse_scores)[:self.refined_count])
+        refined_results = self._pool.map(MultiStartSearch._refine,
+                                         [(coarse_results[i][0], refine_budget) for i in refined_starts])
+
+        # Refined shapes are compared at the finest level, standardized by costs of all starts at that level
+        fine_costs = [costs for _, _, costs in coarse_results]
+        refined_scores = MultiStartSearch.get_scores([costs for _, costs, _ in refined_results], fine_costs,
+                                                     self.shape_weight)
+        best = int(np.argmin(refined_scores))
+        self.best_start = refined_starts[best]
+        self.search_converged = refined_results[best][2]
+
+        self.start_results = list()
+        for i, (pose, coarse_score) in enumerate(zip(poses, coarse_scores)):
+            refined_score = refined_scores[refined_starts.index(i)] if i in refined_starts else None
+            self.start_results.append((pose, coarse_score, refined_score))
+        return refined_results[best][0]
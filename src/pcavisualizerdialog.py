@@ -10,6 +10,7 @@ from gui.pcavisualizer import Ui_PcaVisualizerDialog
 from src.datamanager import DataManager
 from src.pca import PCA
 from src.tooth import Tooth
+from src.toothitem import ToothItem
 from src.utils import to_landmarks_format
 
 __author__ = "Ivan Sevcik"
@@ -22,6 +23,8 @@ class PcaVisualizerDialog(QDialog, Ui_PcaVisualizerDialog):
     _scales = None
     combined = None
     data_manager = None
+    tooth_item = None
+    original_tooth_item = None
 
     def __init__(self, pca, data_manager):
         super(PcaVisualizerDialog, self).__init__()
@@ -105,20 +108,26 @@ class PcaVisualizerDialog(QDialog, Ui_PcaVisualizerDialog):
     def _redraw(self, original_tooth=None):
         tooth = Tooth(to_landmarks_format(self.combined))
 
-        self.scene.clear()
+        if self.tooth_item is None:
+            # Original tooth is created first so that it's drawn below
+            self.original_tooth_item = ToothItem(self.scene)
+            self.tooth_item = ToothItem(self.scene)
 
         if original_tooth is not None:
             original_tooth = Tooth(original_tooth.landmarks)
             original_tooth.outline_pen = QPen(QColor.fromRgb(0, 255, 255))
             original_tooth.outline_pen.setWidthF(0.02)
-            original_tooth.draw(self.scene, True, False, False)
+            self.original_tooth_item.update(original_tooth)
+        self.original_tooth_item.set_visible(original_tooth is not None)
 
         tooth.outline_pen.setWidthF(0.02)
-        tooth.draw(self.scene, True, False, False)
+        self.tooth_item.update(tooth)
 
         self._focus_view()
 
     def _focus_view(self):
-        rect = self.scene.itemsBoundingRect()
+        rect = self.tooth_item.bounding_rect()
+        if self.original_tooth_item.is_visible():
+            rect = rect.united(self.original_tooth_item.bounding_rect())
         self.scene.setSceneRect(rect)
         self.graphicsView.fitInView(rect, Qt.KeepAspectRatio)
@@ -0,0 +1,150 @@
+import time
+import traceback
+from Queue import Queue
+from threading import Lock, Thread
+
+__author__ = "Ivan Sevcik"
+
+
+class PipelineStage(object):
+    """
+    One stage of the pipeline processed by its own pool of worker threads. Statistics are updated by the workers.
+    """
+    name = None
+    function = None
+    workers = 1
+    processed = 0
+    failed = 0
+    # Sum of time spent in the function by all workers
+    busy_time = 0.0
+    start_time = None
+    end_time = None
+
+    _queue = None
+    _threads = None
+    _lock = None
+
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self._queue = Queue(queue_size)
+        self._threads = list()
+        self._lock = Lock()
+
+    @property
+    def wall_time(self):
+        if self.start_time is None:
+            return 0.0
+        return (self.end_time if self.end_time is not None else time.time()) - self.start_time
+
+    @property
+    def throughput(self):
+        '''
+        :return: Processed items per second of stage wall time.
+        '''
+        wall_time = self.wall_time
+        return self.processed / wall_time if wall_time > 0 else 0.0
+
+
+class Pipeline(object):
+    """
+    Processes items by a sequence of stages, each running on its own threads. Stages are connected by bounded queues,
+    so a slow stage blocks the preceding ones instead of letting unprocessed items pile up in memory. Items that fail in
+    some stage are reported and dropped.
+    """
+    queue_size = 4
+    stages = None
+
+    # Marks end of input for a worker
+    _end = object()
+
+    def __init__(self, queue_size=4):
+        self.queue_size = queue_size
+        self.stages = list()
+
+    def add_stage(self, name, function, workers=1):
+        '''
+        Appends stage to the pipeline.
+        :param name: Name used in the report.
+        :param function: Function taking an item and returning the processed item passed to next stage.
+        :param workers: Number of worker threads of the stage.
+        '''
+        self.stages.append(PipelineStage(name, function, workers, self.queue_size))
+
+    def _work(self, stage_idx, results):
+        stage = self.stages[stage_idx]
+        next_stage = self.stages[stage_idx + 1] if stage_idx + 1 < len(self.stages) else None
+        while True:
+            item = stage._queue.get()
+            if item is Pipeline._end:
+                return
+
+            start = time.time()
+            try:
+                item = stage.function(item)
+                failed = False
+            except Exception:
+                print "Stage '%s' failed on item %s:" % (stage.name, item)
+                traceback.print_exc()
+                failed = True
+            end = time.time()
+
+            with stage._lock:
+                if stage.start_time is None:
+                    stage.start_time = start
+                stage.busy_time += end - start
+                if failed:
+                    stage.failed += 1
+                else:
+                    stage.processed += 1
+
+            if failed:
+                continue
+            # Blocks while the next stage is busy
+            if next_stage is not None:
+                next_stage._queue.put(item)
+            else:
+                results.append(item)
+
+    def run(self, items):
+        '''
+        Processes all items and waits until the last one leaves the pipeline.
+        :param items: Iterable of input items. It's consumed only as fast as the first stage processes the items.
+        :return: list of items returned by the last stage, in order of completion
+        '''
+        results = list()
+        for i, stage in enumerate(self.stages):
+            stage._threads = [Thread(target=self._work, args=(i, results)) for w in range(0, stage.workers)]
+            for thread in stage._threads:
+                thread.daemon = True
+                thread.start()
+
+        for item in items:
+            self.stages[0]._queue.put(item)
+
+        # Stages are finished one by one, so every stage gets the end marker after all its items
+        for stage in self.stages:
+            for thread in stage._threads:
+                stage._queue.put(Pipeline._end)
+            for thread in stage._threads:
+                thread.join()
+            stage.end_time = time.time()
+
+        return results
+
+    def print_report(self, total_time=None):
+        '''
+        Prints throughput of the stages. The stage with lowest throughput limits the whole pipeline.
+        :param total_time: Time of the whole run in seconds.
+        '''
+        print "Stage      | Workers | Processed | Failed | Busy [s] | Utilization | Items/s"
+        print "-" * 78
+        for stage in self.stages:
+            capacity = stage.wall_time * stage.workers
+            print "{0: <10} | {1: >7} | {2: >9} | {3: >6} | {4: >8.2f} | {5: >11.2f} | {6: >7.2f}".format(
+                stage.name, stage.workers, stage.processed, stage.failed, stage.busy_time,
+                stage.busy_time / capacity if capacity > 0 else 0.0, stage.throughput)
+        if total_time is not None and total_time > 0:
+            print "Total: %d items in %.2f s (%.2f items/s)" % (self.stages[-1].processed, total_time,
+                                                                self.stages[-1].processed / total_time)
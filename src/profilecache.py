@@ -0,0 +1,73 @@
+import numpy as np
+
+from src.sampler import Sampler
+
+__author__ = "Ivan Sevcik"
+
+
+class ProfileCache(object):
+    """
+    Remembers where landmark points moved during last update by a landmark model (see LandmarkModel.update_positions).
+    A point is sampled and matched again only if its sampling positions changed, i.e. it moved or its normal rotated to
+    other pixels, or its search range changed. Other points move to the same positions as last time, so the results are
+    the same as without cache.
+    """
+    # If False, all points are always sampled and the cache only counts sampled profiles
+    incremental = None
+    model = None
+    image = None
+    # Keys of sampling positions of every point (see Sampler.get_position_keys)
+    keys = None
+    # Search ranges of every point, -1 for points that were not searched
+    ranges = None
+    # Positions found for every point during last update
+    new_landmarks = None
+    # Number of points that had to be sampled during last update
+    recomputed_count = 0
+    # Number of pixels that had to be sampled during last update
+    sampled_count = 0
+
+    def __init__(self, incremental=True):
+        self.incremental = incremental
+
+    def reset(self):
+        self.model = None
+        self.image = None
+        self.keys = None
+        self.ranges = None
+        self.new_landmarks = None
+        self.recomputed_count = 0
+        self.sampled_count = 0
+
+    def get_changed_points(self, model, tooth, image, search_ranges, frozen=None):
+        '''
+        Finds points that need to be sampled, i.e. their sampling positions or search range changed since the last
+        update, and remembers the new ones.
+        :param model: Landmark model that updates the tooth.
+        :param tooth: Tooth to update.
+        :param image: Image that is sampled.
+        :param search_ranges: Number of pixels sampled at each side of every point.
+        :param frozen: Boolean mask of points that are not searched.
+        :return: Indices of points that need to be sampled.
+        '''
+        keys = Sampler.get_position_keys(tooth, model.m)
+        ranges = np.array(search_ranges, np.int32)
+        if frozen is not None:
+            # Frozen points are not searched, so their cached positions become invalid
+            ranges[frozen] = -1
+
+        if not self.incremental or model is not self.model or image is not self.image or self.keys is None or \
+                self.keys.shape != keys.shape:
+            self.model = model
+            self.image = image
+            self.new_landmarks = np.empty(tooth.landmarks.shape)
+            changed = np.ones(keys.shape[0], bool)
+        else:
+            changed = np.any(keys != self.keys, axis=(1, 2)) | (ranges != self.ranges)
+
+        self.keys = keys
+        self.ranges = ranges
+        changed = np.flatnonzero(changed & (ranges >= 0))
+        self.recomputed_count = len(changed)
+        self.sampled_count = int(np.sum(2 * ranges[changed] + 1))
+        return changed
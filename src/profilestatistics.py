@@ -0,0 +1,72 @@
+import numpy as np
+
+__author__ = "Ivan Sevcik"
+
+
+class ProfileStatistics(object):
+    """
+    Running mean and covariance of profiles of every landmark, updated by Welford's algorithm one training tooth at a
+    time. Memory doesn't depend on number of added profiles and statistics collected separately (e.g. by different
+    workers or from different radiographs) can be merged, giving the same result as if all profiles were added to one
+    instance.
+    """
+    count = 0
+    # Mean profile of every landmark, shape (landmarks, length)
+    mean = None
+    # Sums of products of deviations from the mean, shape (landmarks, length, length)
+    comoments = None
+    track_covariance = None
+
+    def __init__(self, track_covariance=True):
+        '''
+        :param track_covariance: If False, only means are computed, which is cheaper.
+        '''
+        self.track_covariance = track_covariance
+
+    def add(self, sample_matrix):
+        '''
+        Adds profiles sampled for one tooth.
+        :param sample_matrix: Sampled profiles, one row for each landmark.
+        '''
+        sample_matrix = np.asarray(sample_matrix, dtype=np.float64)
+        if self.mean is None:
+            self.mean = np.zeros(sample_matrix.shape)
+            if self.track_covariance:
+                self.comoments = np.zeros(sample_matrix.shape + sample_matrix.shape[1:])
+
+        self.count += 1
+        delta = sample_matrix - self.mean
+        self.mean += delta / self.count
+        if self.track_covariance:
+            self.comoments += delta[:, :, np.newaxis] * (sample_matrix - self.mean)[:, np.newaxis, :]
+
+    def merge(self, other):
+        '''
+        Adds all profiles that were added to other statistics.
+        :param other: ProfileStatistics instance, it's not modified.
+        '''
+        assert isinstance(other, ProfileStatistics)
+        if other.count == 0:
+            return
+        if self.count == 0:
+            self.count = other.count
+            self.mean = other.mean.copy()
+            if self.track_covariance:
+                self.comoments = other.comoments.copy()
+            return
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * (float(other.count) / count)
+        if self.track_covariance:
+            self.comoments = self.comoments + other.comoments + \
+                delta[:, :, np.newaxis] * delta[:, np.newaxis, :] * (float(self.count) * other.count / count)
+        self.count = count
+
+    def get_covariances(self, ddof=1):
+        '''
+        :param ddof: Delta degrees of freedom, 1 gives unbiased estimate and 0 maximum likelihood estimate.
+        :return: covariance matrix of profiles of every landmark, shape (landmarks, length, length)
+        '''
+        assert self.track_covariance
+        return self.comoments / max(self.count - ddof, 1)
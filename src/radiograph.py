@@ -1,7 +1,7 @@
-import cv2
 import numpy as np
 
-from src.tooth import Tooth
+from src.landmarkstore import LandmarkStore
+from src.radiographloader import RadiographLoader
 
 __author__ = "Ivan Sevcik"
 
@@ -22,12 +22,13 @@ def read_landmarks(filename):
 
 
 class Radiograph:
-    _teeth = None
+    # Read-only array of shape (teeth, points, 2) or None if the radiograph isn't annotated
+    landmarks = None
     idx = None
     path_to_img = None
 
     def __init__(self):
-        self._teeth = list()
+        pass
 
     def load(self, idx, annotated=False):
         '''
@@ -37,14 +38,19 @@ class Radiograph:
         '''
         self.idx = idx
 
-        # Load and draw landmarks
+        # Load landmarks, they stay in the memory-mapped store until some tooth created from them is modified
         if annotated:
-            for i in range(0, 8):
-                landmarks = read_landmarks('./data/Landmarks/original/landmarks%d-%d.txt' % (idx + 1, i + 1))
-                self._teeth.append(Tooth(landmarks))
+            self.landmarks = LandmarkStore.get().get_radiograph_landmarks(idx)
 
         self.path_to_img = './data/Radiographs/%02d.tif' % (self.idx + 1)
 
     @property
     def image(self):
-        return cv2.cvtColor(cv2.imread(self.path_to_img), cv2.COLOR_BGR2GRAY)
+        return RadiographLoader.load(self.path_to_img)
+
+    def load_cropped(self):
+        '''
+        Loads only region of interest of the image (see RadiographLoader.load_cropped).
+        :return: tuple of translation from original to cropped image, cropped image and shape of the original image
+        '''
+        return RadiographLoader.load_cropped(self.path_to_img)
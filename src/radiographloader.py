@@ -0,0 +1,255 @@
+import hashlib
+import os
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+
+from src.config import Config
+from src.filter import Filter
+
+__author__ = "Ivan Sevcik"
+
+
+class RadiographLoader(object):
+    """
+    Decodes radiograph images straight to grayscale. Most of the frame is thrown away by cropping (see
+    Filter.get_cropping_region), so the region of interest can be loaded alone. Strip based TIFF images are decoded
+    only in strips covering the region, other images are decoded whole once and saved into raw cache, which is
+    memory-mapped afterwards, so only pages of the region are read.
+
+    Reduced resolution decoding is not offered, the first resolution level needs the full resolution and coarser levels
+    are computed from it by Gaussian pyramid (see MultiResolutionFramework.downsample_image), which decoding can't
+    reproduce.
+    """
+    cache_directory = "./data/Cache/Radiographs"
+
+    # Sizes of TIFF field types in bytes
+    _tiff_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+    # TIFF tags copied to the image with selected strips, tags describing strips are written anew and all other tags
+    # (metadata, offsets to other directories) are dropped
+    _tiff_copied_tags = (256, 258, 259, 262, 274, 277, 284, 317, 320, 338, 339)
+    _tiff_image_length = 257
+    _tiff_strip_offsets = 273
+    _tiff_rows_per_strip = 278
+    _tiff_strip_byte_counts = 279
+    _tiff_tile_width = 322
+
+    @staticmethod
+    def load(path):
+        '''
+        Loads whole grayscale image.
+        :param path: Path to the image.
+        :return: numpy array of type uint8
+        '''
+        image = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise IOError("Image %s can't be decoded" % path)
+        return image
+
+    @staticmethod
+    def decode(data):
+        '''
+        Decodes grayscale image from encoded file content.
+        :param data: String with content of an image file.
+        :return: numpy array of type uint8
+        '''
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise ValueError("Image can't be decoded")
+        return image
+
+    @staticmethod
+    def load_cropped(path):
+        '''
+        Loads only region of interest of grayscale image (see Filter.get_cropping_region). The result is the same as if
+        the whole image was loaded and cropped (see MultiResolutionFramework.crop_radiograph_image).
+        :param path: Path to the image.
+        :return: tuple of translation from original to cropped image, cropped image and shape of the original image
+        '''
+        result = RadiographLoader._load_cropped_tiff(path)
+        if result is None:
+            result = RadiographLoader._load_cropped_raw(path)
+        return result
+
+    @staticmethod
+    def _load_cropped_raw(path):
+        '''
+        Crops image memory-mapped from raw cache, creating the cache first if needed. If Config.use_file_cache isn't
+        set, the image is decoded whole and cropped.
+        '''
+        if not Config.use_file_cache:
+            image = RadiographLoader.load(path)
+        else:
+            cache_path = RadiographLoader.get_cache_path(path)
+            if not os.path.exists(cache_path):
+                RadiographLoader._save_raw(RadiographLoader.load(path), cache_path)
+            image = np.load(cache_path, mmap_mode="r")
+
+        region = Filter.get_cropping_region_of_shape(image.shape)
+        cropped = np.array(image[region.top:region.bottom, region.left:region.right])
+        return -region.left_top, cropped, image.shape
+
+    @staticmethod
+    def get_cache_path(path):
+        '''
+        Creates path of raw cache of the image. It's derived from path, size and modification time of the image, so the
+        cache is recreated whenever the image changes.
+        :param path: Path to the image.
+        :return: Path to .npy file
+        '''
+        stat = os.stat(path)
+        digest = hashlib.sha1("%s:%d:%d" % (os.path.abspath(path), stat.st_size, int(stat.st_mtime))).hexdigest()
+        return os.path.join(RadiographLoader.cache_directory, "%s.npy" % digest)
+
+    @staticmethod
+    def _save_raw(image, cache_path):
+        directory = os.path.dirname(cache_path)
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another thread may have created it meanwhile
+            if not os.path.isdir(directory):
+                raise
+
+        # Write to unique temporary file first, so other threads and processes never see incomplete cache
+        fd, tmp_path = tempfile.mkstemp(".tmp.npy", os.path.basename(cache_path) + ".", directory)
+        with os.fdopen(fd, "wb") as tmp_file:
+            np.save(tmp_file, image)
+        if os.path.exists(cache_path):
+            os.remove(tmp_path)
+        else:
+            os.rename(tmp_path, cache_path)
+
+    @staticmethod
+    def _load_cropped_tiff(path):
+        '''
+        Decodes only strips of TIFF image that cover region of interest. Strips are compressed independently, so they
+        are copied into new TIFF image in memory which is decoded instead of the whole file.
+        :return: Same as load_cropped or None if the file isn't TIFF image made of strips.
+        '''
+        with open(path, "rb") as image_file:
+            directory = RadiographLoader._read_tiff_directory(image_file)
+            if directory is None:
+                return None
+
+            byte_order, tags = directory
+            if RadiographLoader._tiff_tile_width in tags or RadiographLoader._tiff_strip_offsets not in tags or \
+                    RadiographLoader._tiff_strip_byte_counts not in tags or 256 not in tags or \
+                    tags.get(284, (3, [1]))[1][0] != 1 or tags.get(274, (3, [1]))[1][0] != 1:
+                # Tiled, planar or rotated images are decoded whole
+                return None
+
+            width = tags[256][1][0]
+            height = tags[RadiographLoader._tiff_image_length][1][0]
+            rows_per_strip = min(tags.get(RadiographLoader._tiff_rows_per_strip, (4, [height]))[1][0], height)
+            offsets = tags[RadiographLoader._tiff_strip_offsets][1]
+            byte_counts = tags[RadiographLoader._tiff_strip_byte_counts][1]
+
+            region = Filter.get_cropping_region_of_shape((height, width))
+            if region.left < 0 or region.right > width or region.top >= height:
+                # Cropping of whole image doesn't clip such region the same way, so the image is decoded whole
+                return None
+            # Cropping of whole image truncates the region at the bottom of the image
+            bottom = min(region.bottom, height)
+            first_strip = region.top // rows_per_strip
+            last_strip = (bottom - 1) // rows_per_strip
+            strips = list()
+            for i in range(first_strip, last_strip + 1):
+                image_file.seek(offsets[i])
+                strips.append(image_file.read(byte_counts[i]))
+
+        rows = min((last_strip + 1) * rows_per_strip, height) - first_strip * rows_per_strip
+        data = RadiographLoader._write_tiff(byte_order, tags, rows, rows_per_strip, strips)
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if image is None or image.shape != (rows, width):
+            return None
+
+        top = region.top - first_strip * rows_per_strip
+        cropped = image[top:top + bottom - region.top, region.left:region.right].copy()
+        return -region.left_top, cropped, (height, width)
+
+    @staticmethod
+    def _read_tiff_directory(image_file):
+        '''
+        Reads the first image file directory of TIFF file.
+        :return: tuple of byte order ("<" or ">") and dictionary mapping tag to tuple (type, list of values), or None if
+                 the file isn't TIFF
+        '''
+        header = image_file.read(8)
+        if len(header) < 8 or header[:2] not in ("II", "MM"):
+            return None
+        byte_order = "<" if header[:2] == "II" else ">"
+        magic, offset = struct.unpack(byte_order + "HI", header[2:])
+        if magic != 42:
+            return None
+
+        image_file.seek(offset)
+        count, = struct.unpack(byte_order + "H", image_file.read(2))
+        entries = [struct.unpack(byte_order + "HHI4s", image_file.read(12)) for _ in range(count)]
+
+        tags = dict()
+        for tag, field_type, values_count, value in entries:
+            if tag not in RadiographLoader._tiff_copied_tags + (RadiographLoader._tiff_image_length,
+                                                                RadiographLoader._tiff_strip_offsets,
+                                                                RadiographLoader._tiff_rows_per_strip,
+                                                                RadiographLoader._tiff_strip_byte_counts,
+                                                                RadiographLoader._tiff_tile_width):
+                continue
+            if field_type not in (3, 4):
+                # Only integer fields are needed
+                return None
+
+            size = RadiographLoader._tiff_type_sizes[field_type] * values_count
+            if size > 4:
+                image_file.seek(struct.unpack(byte_order + "I", value)[0])
+                value = image_file.read(size)
+            values = struct.unpack("%s%d%s" % (byte_order, values_count, "H" if field_type == 3 else "I"), value[:size])
+            tags[tag] = (field_type, list(values))
+        return byte_order, tags
+
+    @staticmethod
+    def _write_tiff(byte_order, tags, rows, rows_per_strip, strips):
+        '''
+        Creates TIFF file with given strips.
+        :param byte_order: Byte order of the file ("<" or ">").
+        :param tags: Tags of the original image (see _read_tiff_directory).
+        :param rows: Number of rows in the new image.
+        :param rows_per_strip: Number of rows in every strip.
+        :param strips: Compressed strips.
+        :return: String with content of the file.
+        '''
+        # Directory must start at word boundary
+        strips_size = sum(len(strip) for strip in strips)
+        padding = "\0" * (strips_size % 2)
+        new_tags = dict((tag, tags[tag]) for tag in RadiographLoader._tiff_copied_tags if tag in tags)
+        new_tags[RadiographLoader._tiff_image_length] = (4, [rows])
+        new_tags[RadiographLoader._tiff_rows_per_strip] = (4, [rows_per_strip])
+        new_tags[RadiographLoader._tiff_strip_byte_counts] = (4, [len(strip) for strip in strips])
+        offsets = list()
+        offset = 8
+        for strip in strips:
+            offsets.append(offset)
+            offset += len(strip)
+        new_tags[RadiographLoader._tiff_strip_offsets] = (4, offsets)
+
+        # Layout: header, strips, directory, values that don't fit into directory entries
+        directory_offset = 8 + strips_size + len(padding)
+        values_offset = directory_offset + 2 + 12 * len(new_tags) + 4
+        entries = list()
+        values = list()
+        for tag in sorted(new_tags):
+            field_type, tag_values = new_tags[tag]
+            data = struct.pack("%s%d%s" % (byte_order, len(tag_values), "H" if field_type == 3 else "I"), *tag_values)
+            if len(data) <= 4:
+                value = data.ljust(4, "\0")
+            else:
+                value = struct.pack(byte_order + "I", values_offset)
+                values.append(data)
+                values_offset += len(data)
+            entries.append(struct.pack(byte_order + "HHI", tag, field_type, len(tag_values)) + value)
+
+        header = ("II" if byte_order == "<" else "MM") + struct.pack(byte_order + "HI", 42, directory_offset)
+        directory = struct.pack(byte_order + "H", len(entries)) + "".join(entries) + struct.pack(byte_order + "I", 0)
+        return header + "".join(strips) + padding + directory + "".join(values)
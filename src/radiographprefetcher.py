@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from threading import Condition
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from src.MultiresFramework import MultiResolutionFramework
+from src.utils import toQImage
+
+__author__ = "Ivan Sevcik"
+
+
+class RadiographPrefetcher(QThread):
+    """
+    Worker thread that loads radiographs around the requested one and prepares images of all resolution levels, so
+    they can be shown without waiting for disk. Images are prepared as QImage, because QPixmap can be created only in
+    GUI thread.
+    """
+    image_ready = pyqtSignal(int)
+
+    # How many radiographs on each side of the requested one are prepared
+    radius = 2
+    # Maximum number of radiographs kept in memory, must be larger than 2 * radius + 1
+    max_cached = 7
+
+    radiographs = None
+    _condition = None
+    _images = None
+    _center = None
+    _stop = False
+
+    def __init__(self, radiographs):
+        super(RadiographPrefetcher, self).__init__()
+        self.radiographs = radiographs
+        self._condition = Condition()
+        self._images = OrderedDict()
+
+    def request(self, idx):
+        '''
+        Moves the prefetching window to the radiograph. The requested radiograph is always prepared first.
+        :param idx: Index of radiograph.
+        '''
+        with self._condition:
+            self._center = idx
+            self._condition.notify()
+
+    def get_image(self, idx, level):
+        '''
+        Returns prepared image of the radiograph without waiting.
+        :param idx: Index of radiograph.
+        :param level: Resolution level.
+        :return: QImage or None if it's not prepared yet.
+        '''
+        with self._condition:
+            images = self._images.get(idx)
+            return images[level] if images is not None else None
+
+    def stop(self):
+        with self._condition:
+            self._stop = True
+            self._condition.notify()
+        self.wait()
+
+    def _next_missing(self):
+        '''
+        Finds the closest radiograph to the requested one that isn't prepared yet. Must be called with lock held.
+        :return: Index of radiograph or None.
+        '''
+        if self._center is None:
+            return None
+
+        for distance in range(0, self.radius + 1):
+            for idx in (self._center + distance, self._center - distance):
+                if 0 <= idx < len(self.radiographs) and idx not in self._images:
+                    return idx
+        return None
+
+    def _load(self, idx):
+        '''
+        Loads radiograph and prepares images of all resolution levels.
+        :param idx: Index of radiograph.
+        :return: list of QImage, one for each level
+        '''
+        image = self.radiographs[idx].image
+        images = list()
+        for level in range(0, MultiResolutionFramework.levels_count):
+            if level > 0:
+                image = MultiResolutionFramework.downsample_image(image)
+            images.append(toQImage(image, True))
+        return images
+
+    def run(self):
+        # Note: This is never called directly. It is called by Qt once the
+        # thread environment has been set up.
+        while True:
+            with self._condition:
+                while not self._stop and self._next_missing() is None:
+                    self._condition.wait()
+                if self._stop:
+                    return
+                idx = self._next_missing()
+
+            # Load outside of lock so that GUI can still read prepared images
+            images = self._load(idx)
+
+            with self._condition:
+                self._images[idx] = images
+                while len(self._images) > self.max_cached:
+                    farthest = max(self._images, key=lambda i: abs(i - self._center))
+                    del self._images[farthest]
+
+            self.image_ready.emit(idx)
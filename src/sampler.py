@@ -1,5 +1,8 @@
 import numpy as np
 
+from src.config import Config
+from src.filter import Filter
+from src.tiledimage import TiledImage
 from src.tooth import Tooth
 
 __author__ = "Ivan Sevcik"
@@ -45,10 +48,13 @@ class Sampler(object):
     def _sample_image(image, positions):
         """
         Samples image at specified positions.
-        :param image: Image to sample.
+        :param image: Image to sample. Either numpy array or TiledImage.
         :param positions: Positions at which to sample.
         :return: A numpy array of sampled pixel values.
         """
+        if isinstance(image, TiledImage):
+            return image.sample(positions)
+
         samples = list()
         for position in positions:
             if position[0] < 0 or position[1] < 0 or position[0] >= image.shape[1] or position[1] >= image.shape[0]:
@@ -59,28 +65,51 @@ class Sampler(object):
         return np.array(samples)
 
     @staticmethod
-    def sample(tooth, radiograph_image, sample_count, normalize=False, return_positions=None):
+    def get_position_keys(tooth, sample_count):
+        """
+        Computes integer keys of sampling positions of every landmark point. Sampling positions (see
+        _find_sample_positions) are formed by pixels along the normal, each of them at most 3 half-pixel steps from the
+        previous one, so if the keys of a point didn't change, its sampling positions didn't change either.
+        :param tooth: Tooth whose landmark points would be sampled.
+        :param sample_count: Number of pixels that would be sampled at each side of a point.
+        :return: A numpy array of shape (points, 6*sample_count+2, 2)
+        """
+        scales = np.arange(-3 * sample_count, 3 * sample_count + 1) * 0.5
+        points = np.floor(tooth.landmarks[:, np.newaxis, :] + tooth.normals[:, np.newaxis, :] * scales[:, np.newaxis])
+        centers = tooth.landmarks.astype(np.int32)[:, np.newaxis, :]
+        return np.concatenate((points.astype(np.int32), centers), axis=1)
+
+    @staticmethod
+    def sample(tooth, radiograph_image, sample_count, normalize=False, return_positions=None, point_indices=None):
         """
         Samples the 'radiograph' image along normals of each landmark point creating 'tooth' shape.
         :param tooth: Tooth along which's landmark points should be sampled.
-        :param radiograph_image: A radiograph image to sample.
+        :param radiograph_image: A radiograph image to sample. Either numpy array or TiledImage.
         :param sample_count: Specifies how many pixels on each side of the point should be sampled/
         :param normalize: If true, the pixel values of the sampled vector are normalized into range <0, 1>
         :param return_positions: If list is passed as this argument, it will be filled by positions at which the pixels
                                  were sampled from the image.
-        :return: A numpy array of sampled pixel values.
+        :param point_indices: Indices of landmark points to sample. If None, all points are sampled.
+        :return: A numpy array of sampled pixel values, one row for each sampled point. Its type is given by
+                 Config.image_dtype.
         """
         assert isinstance(tooth, Tooth)
-        assert isinstance(radiograph_image, np.ndarray)
+        assert isinstance(radiograph_image, (np.ndarray, TiledImage))
 
-        result = np.empty((tooth.landmarks.shape[0], 2 * sample_count + 1))
+        if point_indices is None:
+            point_indices = range(0, tooth.landmarks.shape[0])
+        quantized = radiograph_image.dtype == np.uint16
+        result = np.empty((len(point_indices), 2 * sample_count + 1), dtype=Config.image_dtype)
 
-        for i, center_point in enumerate(tooth.landmarks):
-            normal = tooth.normals[i]
+        for i, point_idx in enumerate(point_indices):
+            center_point = tooth.landmarks[point_idx]
+            normal = tooth.normals[point_idx]
             positions = Sampler._find_sample_positions(center_point, normal, sample_count)
             samples = Sampler._sample_image(radiograph_image, positions)
             # Normalize samples (according to paper, this is 1 over sum of absolute values of samples)
-            samples = samples.astype(np.float64)
+            samples = samples.astype(Config.image_dtype)
+            if quantized:
+                samples = Filter.dequantize_samples(samples)
             abs_sum = np.sum(np.abs(samples))
             if normalize and not np.isclose(abs_sum, 0):
                 samples /= abs_sum
@@ -0,0 +1,44 @@
+import time
+
+__author__ = "Ivan Sevcik"
+
+
+class SearchBudget(object):
+    """
+    Wall-clock time limits of Active Shape Model search (see ActiveShapeModel.run). The same budget can be used for many
+    searches, every search gets its own time limit counted from its start, while the absolute deadline is shared, e.g. by
+    all searches in one radiograph.
+    """
+    seconds = None
+    level_seconds = None
+    deadline = None
+
+    def __init__(self, seconds=None, level_seconds=None, deadline=None):
+        '''
+        :param seconds: Time limit of one search in seconds. If None, only the deadline limits the search.
+        :param level_seconds: Time limits of individual levels indexed by level, None in the list means no limit.
+        :param deadline: Absolute time (see time.time) by which every search must finish.
+        '''
+        self.seconds = seconds
+        self.level_seconds = level_seconds
+        self.deadline = deadline
+
+    def get_end_time(self):
+        '''
+        :return: Absolute time by which a search started now must finish, or None if it's not limited.
+        '''
+        end_time = None
+        if self.seconds is not None:
+            end_time = time.time() + self.seconds
+        if self.deadline is not None:
+            end_time = self.deadline if end_time is None else min(end_time, self.deadline)
+        return end_time
+
+    def get_level_seconds(self, level):
+        '''
+        :param level: Index of resolution level.
+        :return: Time limit of the level in seconds or None if it's not limited.
+        '''
+        if self.level_seconds is None or level >= len(self.level_seconds):
+            return None
+        return self.level_seconds[level]
@@ -0,0 +1,144 @@
+import os
+from Queue import Queue
+from threading import Thread
+
+import cv2
+import numpy as np
+
+from src.tooth import Tooth
+
+__author__ = "Ivan Sevcik"
+
+
+class SegmentationExporter(object):
+    """
+    Exports found teeth of radiographs on a background thread. Segmentations of all teeth of one radiograph can be
+    written as a single image:
+      "labels" - uint8 image where every pixel holds number of the tooth (1-8) or 0 for background. Where teeth overlap,
+                 the later one is stored.
+      "bits" - uint8 image where bit i - 1 is set for pixels of tooth i, so overlapping teeth are preserved.
+      "separate" - one binary image per tooth, same as Tooth.export_segmentation.
+    Landmarks are written either as one compressed .npz file per radiograph or one text file per tooth ("txt").
+    """
+    segmentation_modes = ("labels", "bits", "separate")
+    landmarks_modes = ("npz", "txt")
+
+    directory = None
+    segmentation_mode = "labels"
+    landmarks_mode = "npz"
+    _queue = None
+    _thread = None
+    _errors = None
+
+    # Marks end of the queue
+    _end = object()
+
+    def __init__(self, directory="./data/Out", segmentation_mode="labels", landmarks_mode="npz", queue_size=8):
+        '''
+        :param directory: Directory where to write files.
+        :param segmentation_mode: One of 'segmentation_modes'.
+        :param landmarks_mode: One of 'landmarks_modes'.
+        :param queue_size: Maximum number of radiographs waiting to be written. Export blocks when the queue is full.
+        '''
+        if segmentation_mode not in self.segmentation_modes or landmarks_mode not in self.landmarks_modes:
+            raise ValueError("Unknown export mode")
+
+        self.directory = directory
+        self.segmentation_mode = segmentation_mode
+        self.landmarks_mode = landmarks_mode
+        self._queue = Queue(queue_size)
+        self._errors = list()
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self._thread = Thread(target=self._write_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def export(self, name, teeth, image_shape, tooth_numbers=None):
+        '''
+        Queues teeth of one radiograph for writing. The teeth are copied, so they can be modified after this returns.
+        :param name: Name of the radiograph used in file names.
+        :param teeth: List of teeth positioned in the radiograph.
+        :param image_shape: Shape of the radiograph.
+        :param tooth_numbers: Numbers (1-8) of the teeth. If None, teeth are numbered by their order.
+        '''
+        if tooth_numbers is None:
+            tooth_numbers = range(1, len(teeth) + 1)
+        landmarks = [np.array(tooth.landmarks) for tooth in teeth]
+        self._queue.put((name, landmarks, image_shape, list(tooth_numbers)))
+
+    def close(self):
+        '''
+        Waits until all queued radiographs are written and stops the writer.
+        :return: list of errors that occurred during writing
+        '''
+        self._queue.put(SegmentationExporter._end)
+        self._thread.join()
+        return self._errors
+
+    @staticmethod
+    def rasterize(landmarks, image_shape, tooth_numbers, bits=False):
+        '''
+        Draws all teeth into single uint8 image. Only bounding box of every tooth is touched.
+        :param landmarks: List of landmark arrays of the teeth.
+        :param image_shape: Shape of the radiograph.
+        :param tooth_numbers: Numbers (1-8) of the teeth.
+        :param bits: If True, bit (number - 1) is set for pixels of the tooth, otherwise the number is stored.
+        :return: uint8 image
+        '''
+        image = np.zeros(image_shape, np.uint8)
+        height, width = image_shape[:2]
+        for points, number in zip(landmarks, tooth_numbers):
+            points = points.astype(np.int32)
+            left, top = np.maximum(points.min(axis=0), 0)
+            right, bottom = np.minimum(points.max(axis=0) + 1, (width, height))
+            if left >= right or top >= bottom:
+                continue
+
+            mask = np.zeros((bottom - top, right - left), np.uint8)
+            cv2.fillConvexPoly(mask, points - (left, top), 1)
+            region = image[top:bottom, left:right]
+            if bits:
+                region |= mask << (number - 1)
+            else:
+                region[mask > 0] = number
+        return image
+
+    def _write(self, name, landmarks, image_shape, tooth_numbers):
+        if self.segmentation_mode == "separate":
+            for points, number in zip(landmarks, tooth_numbers):
+                Tooth(points).export_segmentation("%s-%d" % (name, number), image_shape, self.directory)
+        else:
+            image = SegmentationExporter.rasterize(landmarks, image_shape, tooth_numbers,
+                                                   self.segmentation_mode == "bits")
+            cv2.imwrite(os.path.join(self.directory, "%s-%s.png" % (self.segmentation_mode, name)), image)
+
+        if self.landmarks_mode == "txt":
+            for points, number in zip(landmarks, tooth_numbers):
+                Tooth(points).export_landmarks("%s-%d" % (name, number), self.directory)
+        else:
+            np.savez_compressed(os.path.join(self.directory, "landmarks-%s.npz" % name),
+                                landmarks=np.array(landmarks), teeth=np.array(tooth_numbers))
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is SegmentationExporter._end:
+                return
+
+            try:
+                self._write(*job)
+            except Exception as e:
+                print "Export of %s failed: %s" % (job[0], e)
+                self._errors.append((job[0], e))
+
+    @staticmethod
+    def load_landmarks(path):
+        '''
+        Loads landmarks written in "npz" mode.
+        :param path: Path to the .npz file.
+        :return: dictionary mapping tooth number to Tooth instance
+        '''
+        data = np.load(path)
+        return dict((int(number), Tooth(landmarks)) for number, landmarks in zip(data["teeth"], data["landmarks"]))
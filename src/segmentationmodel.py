@@ -0,0 +1,194 @@
+import cPickle
+import os
+from copy import copy
+
+from src.ActiveShapeModel import ActiveShapeModel
+from src.InitialPoseModel import InitialPoseModel
+from src.MultiresFramework import MultiResolutionFramework
+from src.ProfilePoseModel import ProfilePoseModel
+from src.config import Config
+from src.datamanager import DataManager
+from src.modelregistry import ModelRegistry
+from src.multistartsearch import MultiStartSearch
+
+__author__ = "Ivan Sevcik"
+
+
+class JawModel(object):
+    """
+    Trained models needed to search teeth of one jaw.
+    """
+    data_manager = None
+    pca = None
+    landmark_models = None
+
+    def __init__(self, data_manager, pca, landmark_models):
+        self.data_manager = data_manager
+        self.pca = pca
+        self.landmark_models = landmark_models
+
+    @property
+    def selector(self):
+        return self.data_manager.selector
+
+
+class SegmentationModel(object):
+    """
+    All trained models needed to find the 8 incisors in a new radiograph. The model can be saved to a file, so it
+    doesn't have to be trained in every process. Instances are read-only and can be used from multiple threads.
+    """
+    data_manager = None
+    jaw_models = None
+    # Settings of MultiResolutionFramework that the landmark models were trained with
+    levels_count = None
+    filter_presets = None
+    model_params = None
+
+    def __init__(self, data_manager, jaw_models):
+        assert isinstance(data_manager, DataManager)
+        self.data_manager = data_manager
+        self.jaw_models = jaw_models
+        self.levels_count = MultiResolutionFramework.levels_count
+        self.filter_presets = list(MultiResolutionFramework._filter_presets)
+        self.model_params = list(MultiResolutionFramework._model_params)
+
+    @staticmethod
+    def create(data_manager, threshold=0.9):
+        '''
+        Trains models for upper and lower jaw.
+        :param data_manager: Data manager supplying training data. Its selector is not modified.
+        :param threshold: PCA threshold (see PCA.threshold)
+        :return: SegmentationModel instance
+        '''
+        jaw_models = list()
+        for selector in (range(0, 4), range(4, 8)):
+            view = copy(data_manager)
+            view.selector = selector
+            jaw_models.append(JawModel(view, ModelRegistry.get().get_pca(view, threshold),
+                                       ModelRegistry.get().get_landmark_models(view)))
+
+        all_teeth = copy(data_manager)
+        all_teeth.select_all_teeth()
+        return SegmentationModel(all_teeth, jaw_models)
+
+    @staticmethod
+    def load(path):
+        '''
+        Loads model from file and sets MultiResolutionFramework to the settings the model was trained with.
+        :param path: Path to the file created by save.
+        :return: SegmentationModel instance
+        '''
+        with open(path, "rb") as model_file:
+            model = cPickle.load(model_file)
+        assert isinstance(model, SegmentationModel)
+
+        MultiResolutionFramework.levels_count = model.levels_count
+        MultiResolutionFramework._filter_presets = list(model.filter_presets)
+        MultiResolutionFramework._model_params = list(model.model_params)
+        return model
+
+    @staticmethod
+    def load_or_create(path, threshold=0.9):
+        '''
+        Loads model from file or, if the file doesn't exist, trains it from the data set and saves it there.
+        :param path: Path to the model file.
+        :param threshold: PCA threshold used for training.
+        :return: SegmentationModel instance
+        '''
+        if os.path.exists(path):
+            print "Loading model from %s." % path
+            return SegmentationModel.load(path)
+
+        print "Training model."
+        model = SegmentationModel.create(DataManager(), threshold)
+        model.save(path)
+        print "Model saved to %s." % path
+        return model
+
+    def save(self, path):
+        with open(path, "wb") as model_file:
+            cPickle.dump(self, model_file, cPickle.HIGHEST_PROTOCOL)
+
+    def find_initial_poses(self, pyramid):
+        '''
+        Finds initial poses of all 8 teeth.
+        :param pyramid: ImagePyramid of the radiograph (see MultiResolutionFramework.build_pyramid)
+        :return: array in format [(np.array(x position, y position), scale, rotation), ...]
+        '''
+        if Config.initial_pose_model == "profiles":
+            return [candidates[0] for candidates in self.find_candidate_poses(pyramid, 1)]
+        return InitialPoseModel(self.data_manager).find_in_pyramid(pyramid)
+
+    def supports_profile_poses(self):
+        '''
+        :return: True if landmark models of all jaws can be used to find initial poses by ProfilePoseModel
+        '''
+        return all(ProfilePoseModel.is_supported(jaw_model.landmark_models) for jaw_model in self.jaw_models)
+
+    def find_candidate_poses(self, pyramid, count):
+        '''
+        Finds several best initial poses of all 8 teeth by exhaustive search at the coarsest level (see
+        ProfilePoseModel).
+        :param pyramid: ImagePyramid of the radiograph (see MultiResolutionFramework.build_pyramid)
+        :param count: Maximal number of poses of every tooth.
+        :return: list of poses of every tooth ordered from the best one, in format
+                 [[(np.array(x position, y position), scale, rotation), ...], ...]
+        '''
+        if not self.supports_profile_poses():
+            raise ValueError("Profile pose search needs appearance or PCA landmark model, set Config.landmark_model "
+                             "before training")
+        jaw_lines = InitialPoseModel(self.data_manager).find_jaw_lines(pyramid.default_images[0])
+        candidates = [None] * 8
+        for jaw_model in self.jaw_models:
+            pose_model = ProfilePoseModel(jaw_model.data_manager, jaw_model.pca, jaw_model.landmark_models)
+            for tooth_idx, tooth_candidates in zip(jaw_model.selector,
+                                                   pose_model.find_candidates(pyramid, count, jaw_lines)):
+                candidates[tooth_idx] = tooth_candidates
+        return candidates
+
+    def segment(self, pyramid, initial_poses=None, tooth_indices=None, budget=None, converged=None, starts_count=1):
+        '''
+        Searches teeth in the radiograph.
+        :param pyramid: ImagePyramid of the radiograph (see MultiResolutionFramework.build_pyramid)
+        :param initial_poses: Initial poses of all 8 teeth. If None, they are found by find_initial_poses.
+        :param tooth_indices: Indices (0-7) of teeth to search. If None, all 8 teeth are searched.
+        :param budget: SearchBudget limiting search of every tooth (see ActiveShapeModel.run).
+        :param converged: If list is passed as this argument, it will be filled by flags whether search of each tooth
+                          converged, in order of tooth_indices.
+        :param starts_count: Number of initial poses searched for every tooth (see MultiStartSearch). If 1, only the
+                             initial pose is searched.
+        :return: list of teeth positioned in the original radiograph, in order of tooth_indices
+        '''
+        if initial_poses is None:
+            initial_poses = self.find_initial_poses(pyramid)
+        if tooth_indices is None:
+            tooth_indices = range(0, 8)
+
+        teeth = dict()
+        converged_teeth = dict()
+        for jaw_model in self.jaw_models:
+            jaw_indices = [i for i in jaw_model.selector if i in tooth_indices]
+            if len(jaw_indices) == 0:
+                continue
+
+            if starts_count > 1:
+                search = MultiStartSearch(jaw_model.data_manager, jaw_model.pca, jaw_model.landmark_models, pyramid)
+                search.starts_count = starts_count
+                try:
+                    for tooth_idx in jaw_indices:
+                        teeth[tooth_idx] = search.search(initial_poses[tooth_idx], budget)
+                        converged_teeth[tooth_idx] = search.search_converged
+                finally:
+                    search.close()
+                continue
+
+            asm = ActiveShapeModel(jaw_model.data_manager, jaw_model.pca, jaw_model.landmark_models)
+            asm.set_pyramid_to_search(pyramid)
+            for tooth_idx in jaw_indices:
+                position, scale, rotation = initial_poses[tooth_idx]
+                asm.set_up(position, scale, rotation)
+                teeth[tooth_idx] = asm.run(budget=budget)
+                converged_teeth[tooth_idx] = asm.search_converged
+        if converged is not None:
+            converged.extend(converged_teeth[i] for i in tooth_indices)
+        return [teeth[i] for i in tooth_indices]
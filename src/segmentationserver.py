@@ -0,0 +1,306 @@
+import base64
+import hashlib
+import json
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from collections import deque
+from threading import Condition, Event, Lock, Thread
+
+import cv2
+import numpy as np
+
+from src.modelregistry import ModelRegistry
+from src.radiograph import Radiograph
+from src.radiographloader import RadiographLoader
+from src.segmentationmodel import SegmentationModel
+
+__author__ = "Ivan Sevcik"
+
+
+class SegmentationRequest(object):
+    """
+    Single request waiting for segmentation. The result is set by a worker, after which 'done' is set.
+    """
+    image_data = None
+    path = None
+    tooth_indices = None
+    masks = True
+    submit_time = None
+    done = None
+    result = None
+    error = None
+    _image_key = None
+
+    def __init__(self, image_data=None, path=None, tooth_indices=None, masks=True):
+        '''
+        :param image_data: Encoded image, e.g. content of a .tif file. Either this or path must be supplied.
+        :param path: Path to radiograph image.
+        :param tooth_indices: Indices (0-7) of requested teeth. If None, all 8 teeth are returned.
+        :param masks: Boolean whether to return segmentation masks.
+        '''
+        self.image_data = image_data
+        self.path = path
+        self.tooth_indices = tooth_indices if tooth_indices is not None else range(0, 8)
+        self.masks = masks
+        self.submit_time = time.time()
+        self.done = Event()
+
+    @property
+    def image_key(self):
+        '''
+        :return: Key identifying the image, requests with same key are processed together.
+        '''
+        if self._image_key is None:
+            if self.path is not None:
+                self._image_key = "path:" + self.path
+            else:
+                self._image_key = "sha1:" + hashlib.sha1(self.image_data).hexdigest()
+        return self._image_key
+
+    def load_image(self):
+        if self.path is not None:
+            radiograph = Radiograph()
+            radiograph.path_to_img = self.path
+            return radiograph.image
+
+        return RadiographLoader.decode(self.image_data)
+
+
+class SegmentationServer(object):
+    """
+    Keeps trained models in memory and segments radiographs on a pool of worker threads. A worker takes the oldest waiting
+    request together with all requests for the same image (up to max_batch_size), so they share filtering, initial pose
+    search and search of teeth requested by more of them. Requests for other images are left to other workers.
+    """
+    model = None
+    workers = 2
+    max_batch_size = 8
+    # Time for which a worker waits for more requests after it received the first one
+    batch_window = 0.005
+    # Number of latest requests used for statistics
+    stats_size = 1000
+
+    # Waiting requests in order of submission, guarded by _condition
+    _pending = None
+    _condition = None
+    _threads = None
+    _lock = None
+    _in_progress = 0
+    _processed = 0
+    _failed = 0
+    _latencies = None
+    _batch_sizes = None
+
+    def __init__(self, model, workers=2, max_batch_size=8, batch_window=0.005):
+        assert isinstance(model, SegmentationModel)
+        self.model = model
+        self.workers = workers
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._pending = list()
+        self._condition = Condition()
+        self._lock = Lock()
+        self._latencies = deque(maxlen=self.stats_size)
+        self._batch_sizes = deque(maxlen=self.stats_size)
+
+        self._threads = [Thread(target=self._work) for i in range(0, workers)]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def segment(self, request, timeout=None):
+        '''
+        Submits request and waits until it's processed.
+        :param request: SegmentationRequest instance
+        :param timeout: Maximum time to wait in seconds or None to wait indefinitely.
+        :return: The request with result or error set.
+        '''
+        with self._condition:
+            self._pending.append(request)
+            # Wake all workers, one of them may be collecting requests for the same image
+            self._condition.notify_all()
+        request.done.wait(timeout)
+        return request
+
+    def _take_batch(self):
+        '''
+        Waits for the oldest request and collects requests for the same image that arrive within batch_window.
+        :return: list of SegmentationRequest with the same image key
+        '''
+        with self._condition:
+            while len(self._pending) == 0:
+                self._condition.wait()
+            batch = [self._pending.pop(0)]
+            key = batch[0].image_key
+            deadline = time.time() + self.batch_window
+            while True:
+                same = [request for request in self._pending if request.image_key == key]
+                for request in same[:self.max_batch_size - len(batch)]:
+                    self._pending.remove(request)
+                    batch.append(request)
+
+                remaining = deadline - time.time()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    return batch
+                self._condition.wait(remaining)
+
+    def _work(self):
+        while True:
+            requests = self._take_batch()
+            with self._lock:
+                self._in_progress += len(requests)
+                self._batch_sizes.append(len(requests))
+
+            try:
+                self._process(requests)
+            except Exception as e:
+                for request in requests:
+                    request.error = str(e)
+
+            end = time.time()
+            with self._lock:
+                self._in_progress -= len(requests)
+                for request in requests:
+                    self._latencies.append(end - request.submit_time)
+                    if request.error is None:
+                        self._processed += 1
+                    else:
+                        self._failed += 1
+            for request in requests:
+                request.done.set()
+
+    def _process(self, requests):
+        '''
+        Segments one image for all requests that asked for it.
+        :param requests: list of SegmentationRequest with the same image key
+        '''
+        key = requests[0].image_key
+        pyramid = ModelRegistry.get().get_pyramid(requests[0].load_image, key)
+        tooth_indices = sorted(set(i for request in requests for i in request.tooth_indices))
+        found_teeth = dict(zip(tooth_indices, self.model.segment(pyramid, None, tooth_indices)))
+
+        for request in requests:
+            teeth = list()
+            for i in request.tooth_indices:
+                tooth = {"tooth": i + 1, "landmarks": found_teeth[i].landmarks.tolist()}
+                if request.masks:
+                    mask = found_teeth[i].get_segmentation(pyramid.image_shape)
+                    tooth["mask"] = base64.b64encode(cv2.imencode(".png", mask)[1].tostring())
+                teeth.append(tooth)
+            request.result = {"teeth": teeth}
+
+    def get_stats(self):
+        '''
+        :return: dictionary with queue depth, request counts, latency percentiles in milliseconds and mean batch size
+        '''
+        with self._condition:
+            queue_depth = len(self._pending)
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            stats = {"queue_depth": queue_depth,
+                     "in_progress": self._in_progress,
+                     "processed": self._processed,
+                     "failed": self._failed,
+                     "workers": self.workers,
+                     "mean_batch_size": float(np.mean(self._batch_sizes)) if len(self._batch_sizes) > 0 else 0.0}
+        for percentile in (50, 90, 99):
+            stats["latency_p%d_ms" % percentile] = \
+                float(np.percentile(latencies, percentile)) if latencies.size > 0 else None
+        return stats
+
+
+class SegmentationRequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of SegmentationServer:
+      POST /segment with JSON body {"path": "...", "teeth": [1, 2], "masks": true} or with encoded image as body and
+                    optional query parameters teeth=1,2 and masks=0
+      GET /stats
+    Teeth are numbered from 1 to 8 and masks are returned as base64 encoded PNG images of size of the radiograph.
+    """
+    segmentation_server = None
+    request_timeout = 600
+
+    def _send_json(self, code, content):
+        body = json.dumps(content)
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse.urlparse(self.path).path == "/stats":
+            self._send_json(200, self.segmentation_server.get_stats())
+        else:
+            self._send_json(404, {"error": "Unknown path"})
+
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+        if url.path != "/segment":
+            self._send_json(404, {"error": "Unknown path"})
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.getheader("Content-Length", 0)))
+            if self.headers.getheader("Content-Type", "").startswith("application/json"):
+                params = json.loads(body)
+                path, image_data = params["path"], None
+                teeth = params.get("teeth")
+                masks = bool(params.get("masks", True))
+            else:
+                query = urlparse.parse_qs(url.query)
+                path, image_data = None, body
+                teeth = [int(t) for t in query["teeth"][0].split(",")] if "teeth" in query else None
+                masks = query.get("masks", ["1"])[0] != "0"
+
+            if teeth is not None and any(not 1 <= t <= 8 for t in teeth):
+                raise ValueError("Teeth must be numbered from 1 to 8")
+            tooth_indices = [t - 1 for t in teeth] if teeth is not None else None
+            request = SegmentationRequest(image_data, path, tooth_indices, masks)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+
+        request = self.segmentation_server.segment(request, self.request_timeout)
+        if request.error is not None:
+            self._send_json(500, {"error": request.error})
+        elif request.result is None:
+            self._send_json(503, {"error": "Request timed out"})
+        else:
+            self._send_json(200, request.result)
+
+    def address_string(self):
+        # Unix sockets don't have client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        # Needed by BaseHTTPRequestHandler
+        self.server_name = "localhost"
+        self.server_port = 0
+
+
+def create_http_server(segmentation_server, host="127.0.0.1", port=8765, socket_path=None):
+    '''
+    Creates HTTP server that forwards requests to the segmentation server.
+    :param segmentation_server: SegmentationServer instance
+    :param host: Host name to listen on, ignored if socket_path is set.
+    :param port: Port to listen on, ignored if socket_path is set.
+    :param socket_path: Path of Unix socket to listen on instead of TCP port.
+    :return: server instance, call serve_forever() to start it
+    '''
+    handler = type("BoundSegmentationRequestHandler", (SegmentationRequestHandler,),
+                   {"segmentation_server": segmentation_server})
+    if socket_path is not None:
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
@@ -0,0 +1,136 @@
+from threading import Lock
+
+import numpy as np
+
+from src.filter import Filter
+from src.utils import Rectangle
+
+__author__ = "Ivan Sevcik"
+
+
+class TiledImage(object):
+    """
+    Image that is filtered lazily. It is split into square tiles and each tile is filtered (see Filter.process_region)
+    only when some of its pixels are read for the first time. Filtered tiles are cached and reused afterwards. The image
+    can be sampled from multiple threads, every tile is filtered only once.
+    """
+    tile_size = 64
+    source = None
+    filter_presets = None
+    filter_dtype = None
+    dtype = None
+    quantize = False
+    filtered_pixels = 0
+    _tiles = None
+    _lock = None
+
+    def __init__(self, source, filter_presets, dtype=np.float64, quantize=False, tile_size=None):
+        '''
+        :param source: Image that should be filtered. It's not copied, so it must not be modified afterwards.
+        :param filter_presets: Tuple of median kernel size, bilateral kernel size and bilateral color delta.
+        :param dtype: Floating point type of the filtered image.
+        :param quantize: If True, filtered tiles are stored as uint16 (see Filter.quantize_image)
+        :param tile_size: Size of the tile in pixels. If None, the class default is used.
+        '''
+        self.source = source
+        self.filter_presets = filter_presets
+        self.filter_dtype = dtype
+        self.dtype = np.dtype(np.uint16 if quantize else dtype)
+        self.quantize = quantize
+        if tile_size is not None:
+            self.tile_size = tile_size
+        self.filtered_pixels = 0
+        self._tiles = dict()
+        self._lock = Lock()
+
+    @property
+    def shape(self):
+        return self.source.shape
+
+    @property
+    def filtered_fraction(self):
+        '''
+        Fraction of the image that has been filtered so far.
+        :return: Number in range <0, 1>
+        '''
+        return self.filtered_pixels / float(self.source.size)
+
+    def get_tile(self, tile_y, tile_x):
+        '''
+        Returns filtered tile, filtering it first if it's not cached yet.
+        :param tile_y: Row of the tile.
+        :param tile_x: Column of the tile.
+        :return: Filtered tile. Tiles at right and bottom border may be smaller than tile_size.
+        '''
+        tile = self._tiles.get((tile_y, tile_x))
+        if tile is not None:
+            return tile
+
+        with self._lock:
+            tile = self._tiles.get((tile_y, tile_x))
+            if tile is not None:
+                return tile
+
+            h, w = self.source.shape
+            top, left = tile_y * self.tile_size, tile_x * self.tile_size
+            region = Rectangle(left, top, min(left + self.tile_size, w), min(top + self.tile_size, h))
+            median_kernel, bilateral_kernel, bilateral_color = self.filter_presets
+            tile = Filter.process_region(self.source, region, median_kernel, bilateral_kernel, bilateral_color,
+                                         self.filter_dtype, self.quantize)
+            self._tiles[(tile_y, tile_x)] = tile
+            self.filtered_pixels += tile.size
+
+        return tile
+
+    def sample(self, positions):
+        '''
+        Samples filtered image at specified positions. Positions outside of the image are sampled as 0.
+        :param positions: Positions (x, y) at which to sample.
+        :return: A numpy array of sampled pixel values.
+        '''
+        h, w = self.source.shape
+        samples = np.zeros(len(positions), dtype=self.dtype)
+        for i, (x, y) in enumerate(positions):
+            if 0 <= x < w and 0 <= y < h:
+                tile = self.get_tile(y // self.tile_size, x // self.tile_size)
+                samples[i] = tile[y % self.tile_size, x % self.tile_size]
+
+        return samples
+
+    def get_region(self, region):
+        '''
+        Composes filtered region of the image, filtering only tiles that it covers.
+        :param region: Rectangle inside of the image.
+        :return: New numpy array with the filtered region.
+        '''
+        result = np.empty((region.bottom - region.top, region.right - region.left), dtype=self.dtype)
+        for tile_y in range(region.top // self.tile_size, (region.bottom + self.tile_size - 1) // self.tile_size):
+            for tile_x in range(region.left // self.tile_size, (region.right + self.tile_size - 1) // self.tile_size):
+                tile = self.get_tile(tile_y, tile_x)
+                top, left = tile_y * self.tile_size, tile_x * self.tile_size
+                # Part of the tile inside of the region
+                y0, y1 = max(top, region.top), min(top + tile.shape[0], region.bottom)
+                x0, x1 = max(left, region.left), min(left + tile.shape[1], region.right)
+                result[y0 - region.top:y1 - region.top, x0 - region.left:x1 - region.left] = \
+                    tile[y0 - top:y1 - top, x0 - left:x1 - left]
+
+        return result
+
+    def to_array(self, filter_missing=True):
+        '''
+        Composes whole filtered image.
+        :param filter_missing: If True, tiles that weren't filtered yet are filtered now. Otherwise they are left 0.
+        :return: New numpy array with the filtered image.
+        '''
+        h, w = self.source.shape
+        result = np.zeros((h, w), dtype=self.dtype)
+        for tile_y in range(0, (h + self.tile_size - 1) // self.tile_size):
+            for tile_x in range(0, (w + self.tile_size - 1) // self.tile_size):
+                if not filter_missing and (tile_y, tile_x) not in self._tiles:
+                    continue
+
+                tile = self.get_tile(tile_y, tile_x)
+                top, left = tile_y * self.tile_size, tile_x * self.tile_size
+                result[top:top + tile.shape[0], left:left + tile.shape[1]] = tile
+
+        return result
@@ -2,10 +2,10 @@ import os
 
 import cv2
 import numpy as np
-from PyQt5.QtGui import QColor, QBrush, QFont, QPen
-from PyQt5.QtWidgets import QGraphicsSimpleTextItem
+from PyQt5.QtGui import QColor, QBrush, QPen
 import math
 
+from src.toothitem import ToothItem
 from src.utils import line_normal, create_rotation_matrix
 
 __author__ = "Ivan Sevcik"
@@ -137,7 +137,8 @@ class Tooth(object):
         Scale this tooth.
         :param factor: scaling factor
         '''
-        self.landmarks *= factor
+        # New array is created, so landmarks shared with other teeth (see DataManager) are never modified
+        self.landmarks = self.landmarks * factor
         self._normals = None
         self._centroid = None
 
@@ -177,42 +178,11 @@ class Tooth(object):
         :param landmarks: Boolean whether to draw landmark points
         :param text: Boolean whether to draw positions as text
         :param normals: Boolean whether to draw normals
-        :return:
+        :return: ToothItem with the drawn items, which can be updated by another tooth later
         '''
-        count = self.landmarks.shape[0]
-
-        if outline:
-            for i in range(0, count):
-                scene.addLine(self.landmarks[i][0], self.landmarks[i][1], self.landmarks[(i + 1) % count][0],
-                              self.landmarks[(i + 1) % count][1], pen=self.outline_pen)
-
-        if landmarks:
-            for i in range(0, count):
-                scene.addEllipse(self.landmarks[i][0] - self.landmark_size, self.landmarks[i][1] - self.landmark_size,
-                                 self.landmark_size * 2, self.landmark_size * 2, pen=self.point_pen)
-
-            scene.addEllipse(self.centroid[0] - self.landmark_size, self.centroid[1] - self.landmark_size,
-                             self.landmark_size * 2, self.landmark_size * 2,
-                             pen=QPen(self.centroid_color), brush=QBrush(self.centroid_color))
-
-        if normals:
-            length = self.normals_pen.widthF() * 15
-            for i, normal in enumerate(self.normals):
-                landmark = self.landmarks[i]
-                assert isinstance(landmark, np.ndarray)
-
-                pt1 = landmark - normal * length
-                pt2 = landmark + normal * length
-                scene.addLine(pt1[0], pt1[1], pt2[0], pt2[1], pen=self.normals_pen)
-
-        if text:
-            for i in range(0, count):
-                font = QFont("Times", 6)
-                text = scene.addSimpleText(str(i), font=font)
-                assert isinstance(text, QGraphicsSimpleTextItem)
-                text.setPos(self.landmarks[i][0] + self.landmark_size,
-                            self.landmarks[i][1] - text.boundingRect().height() / 2)
-                text.setBrush(self.text_brush)
+        item = ToothItem(scene, outline, landmarks, text, normals)
+        item.update(self)
+        return item
 
     def export_landmarks(self, name_suffix, directory="./data/Out"):
         '''
@@ -237,9 +207,17 @@ class Tooth(object):
             os.makedirs(directory)
 
         filename = directory + ("/segment-%s.png" % name_suffix)
-        img = np.zeros(image_dimensions)
+        cv2.imwrite(filename, self.get_segmentation(image_dimensions))
+
+    def get_segmentation(self, image_dimensions):
+        '''
+        Creates segmentation of this landmarks as a binary image.
+        :param image_dimensions: dimensionality of the image
+        :return: uint8 image where the tooth is 255 and background 0
+        '''
+        img = np.zeros(image_dimensions, np.uint8)
         cv2.fillConvexPoly(img, self.landmarks.astype(np.int32), 255)
-        cv2.imwrite(filename, img)
+        return img
 
     @property
     def normals(self):
@@ -0,0 +1,135 @@
+from PyQt5.QtCore import QPointF, QRectF
+from PyQt5.QtGui import QBrush, QFont, QPainterPath, QPen, QPolygonF
+from PyQt5.QtWidgets import QGraphicsEllipseItem, QGraphicsPathItem, QGraphicsPolygonItem, QGraphicsSimpleTextItem
+
+__author__ = "Ivan Sevcik"
+
+
+class ToothItem(object):
+    """
+    Retained graphical representation of a tooth in a scene. The scene items are created once and update() only changes
+    their geometry, which is much cheaper than clearing the scene and drawing the tooth again.
+    """
+    scene = None
+    outline_item = None
+    landmarks_item = None
+    centroid_item = None
+    normals_item = None
+    text_items = None
+    show_text = False
+
+    def __init__(self, scene, outline=True, landmarks=False, text=False, normals=False):
+        '''
+        Creates items in the scene. They stay empty until update() is called.
+        :param scene: scene where to draw
+        :param outline: Boolean whether to draw outline of the tooth
+        :param landmarks: Boolean whether to draw landmark points
+        :param text: Boolean whether to draw positions as text
+        :param normals: Boolean whether to draw normals
+        '''
+        self.scene = scene
+        self.text_items = list()
+        self.show_text = text
+
+        if outline:
+            self.outline_item = QGraphicsPolygonItem()
+            scene.addItem(self.outline_item)
+
+        if landmarks:
+            self.landmarks_item = QGraphicsPathItem()
+            self.centroid_item = QGraphicsEllipseItem()
+            scene.addItem(self.landmarks_item)
+            scene.addItem(self.centroid_item)
+
+        if normals:
+            self.normals_item = QGraphicsPathItem()
+            scene.addItem(self.normals_item)
+
+    def _get_items(self):
+        items = [self.outline_item, self.landmarks_item, self.centroid_item, self.normals_item] + self.text_items
+        return [item for item in items if item is not None]
+
+    @staticmethod
+    def _set_pen(item, pen):
+        if item.pen() != pen:
+            item.setPen(pen)
+
+    def update(self, tooth):
+        '''
+        Updates geometry of the items to match the tooth. Pens are taken from the tooth.
+        :param tooth: Tooth that should be shown.
+        '''
+        landmarks = tooth.landmarks
+        size = tooth.landmark_size
+
+        if self.outline_item is not None:
+            ToothItem._set_pen(self.outline_item, tooth.outline_pen)
+            self.outline_item.setPolygon(QPolygonF([QPointF(x, y) for x, y in landmarks]))
+
+        if self.landmarks_item is not None:
+            path = QPainterPath()
+            for x, y in landmarks:
+                path.addEllipse(x - size, y - size, size * 2, size * 2)
+            ToothItem._set_pen(self.landmarks_item, tooth.point_pen)
+            self.landmarks_item.setPath(path)
+
+            centroid = tooth.centroid
+            ToothItem._set_pen(self.centroid_item, QPen(tooth.centroid_color))
+            self.centroid_item.setBrush(QBrush(tooth.centroid_color))
+            self.centroid_item.setRect(centroid[0] - size, centroid[1] - size, size * 2, size * 2)
+
+        if self.normals_item is not None:
+            length = tooth.normals_pen.widthF() * 15
+            path = QPainterPath()
+            for landmark, normal in zip(landmarks, tooth.normals):
+                pt1 = landmark - normal * length
+                pt2 = landmark + normal * length
+                path.moveTo(pt1[0], pt1[1])
+                path.lineTo(pt2[0], pt2[1])
+            ToothItem._set_pen(self.normals_item, tooth.normals_pen)
+            self.normals_item.setPath(path)
+
+        if self.show_text:
+            font = QFont("Times", 6)
+            while len(self.text_items) < len(landmarks):
+                text_item = QGraphicsSimpleTextItem(str(len(self.text_items)))
+                text_item.setFont(font)
+                text_item.setBrush(tooth.text_brush)
+                self.scene.addItem(text_item)
+                self.text_items.append(text_item)
+
+            for i, text_item in enumerate(self.text_items):
+                text_item.setVisible(i < len(landmarks))
+                if i < len(landmarks):
+                    text_item.setPos(landmarks[i][0] + size, landmarks[i][1] - text_item.boundingRect().height() / 2)
+
+    def set_visible(self, visible):
+        '''
+        Shows or hides all items of the tooth.
+        :param visible: Boolean whether the tooth should be visible
+        '''
+        for item in self._get_items():
+            item.setVisible(visible)
+
+    def is_visible(self):
+        items = self._get_items()
+        return len(items) > 0 and items[0].isVisible()
+
+    def bounding_rect(self):
+        '''
+        Returns bounding rectangle of all items in scene coordinates.
+        :return: QRectF
+        '''
+        rect = QRectF()
+        for item in self._get_items():
+            rect = rect.united(item.sceneBoundingRect())
+        return rect
+
+    def remove(self):
+        '''
+        Removes all items from the scene. The instance can't be used afterwards.
+        '''
+        for item in self._get_items():
+            self.scene.removeItem(item)
+        self.text_items = list()
+        self.outline_item = self.landmarks_item = self.centroid_item = self.normals_item = None
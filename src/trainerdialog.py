@@ -6,8 +6,8 @@ from PyQt5.QtGui import QPen, QColor, QBrush
 from PyQt5.QtWidgets import QDialog, QGraphicsScene
 
 from gui.trainer import Ui_Trainer
-from src.StatisticalShapeModel import StatisticalShapeModel
 from src.datamanager import DataManager
+from src.modelregistry import ModelRegistry
 from src.pca import PCA
 from src.tooth import Tooth
 from src.utils import to_landmarks_format
@@ -42,14 +42,12 @@ class TrainerDialog(QDialog, Ui_Trainer):
         self.data_manager = data_manager
 
         self.change_teeth(1)
-        teeth = data_manager.get_all_teeth(False)
-        self.choiceSlider.setRange(1, len(teeth) - 1)
+        self.choiceSlider.setRange(1, data_manager.count_all_teeth() - 1)
         self.choiceSlider.valueChanged.connect(self.change_teeth)
 
     def change_teeth(self, idx):
-        teeth = self.data_manager.get_all_teeth(True)
-        self.tooth1 = teeth[0]
-        self.tooth2 = teeth[idx]
+        self.tooth1 = self.data_manager.get_tooth_from_all(0)
+        self.tooth2 = self.data_manager.get_tooth_from_all(idx)
 
         self.tooth1.outline_pen = QPen(QColor.fromRgb(255, 0, 0))
         self.tooth2.outline_pen = QPen(QColor.fromRgb(0, 255, 0))
@@ -89,8 +87,7 @@ class TrainerDialog(QDialog, Ui_Trainer):
         self.graphicsView.fitInView(rect, Qt.KeepAspectRatio)
 
     def train(self):
-        self.pca = StatisticalShapeModel.create(self.data_manager)
-        self.pca.threshold(self.thresholdSpinBox.value())
+        self.pca = ModelRegistry.get().get_pca(self.data_manager, self.thresholdSpinBox.value())
         self._show_training_result()
 
         self.trained.emit(self.pca)
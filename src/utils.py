@@ -1,3 +1,5 @@
+import hashlib
+
 import numpy as np
 from PyQt5.QtGui import QImage, qRgb
 
@@ -42,6 +44,16 @@ def to_landmarks_format(vec):
     return vec.reshape(vec.size / 2, 2)
 
 
+def image_fingerprint(image):
+    '''
+    Computes fingerprint that identifies content of the image.
+    :param image: numpy array
+    :return: string fingerprint
+    '''
+    digest = hashlib.sha1(np.ascontiguousarray(image).data).hexdigest()
+    return "%s-%s-%s" % (image.dtype, "x".join(str(d) for d in image.shape), digest)
+
+
 def create_rotation_matrix(angle):
     return np.array([[np.cos(angle), -np.sin(angle)],
                      [np.sin(angle), np.cos(angle)]])
@@ -66,3 +78,15 @@ class Rectangle:
 
 class StopIterationToken(object):
     stop = False
+
+
+class SnapshotSlot(object):
+    """
+    Holds the latest snapshot published by a single worker thread. Publishing replaces the previous snapshot, so a reader that
+    is slower than the worker skips the intermediate ones. The version and snapshot are replaced by a single reference
+    assignment, which is atomic, so neither side ever waits for a lock.
+    """
+    latest = (0, None)
+
+    def publish(self, snapshot):
+        self.latest = (self.latest[0] + 1, snapshot)
@@ -1,7 +1,9 @@
 import numpy as np
 import sys
 
-from src.LandmarkAppearenceModel import LandmarkAppearanceModel
+from src.LandmarkModel import LandmarkModel
+from src.MultiresFramework import MultiResolutionFramework
+from src.config import Config
 from src.datamanager import DataManager
 
 import matplotlib
@@ -29,9 +31,13 @@ def cov(a, b):
 
     return sum/(len(a)-1)
 
+Config.landmark_model = "appearance"
+LandmarkModel.keep_samples = True
 data_manager = DataManager()
-model = LandmarkAppearanceModel(data_manager)
-samples = model._get_samples_across_radiographs()
+framework = MultiResolutionFramework(data_manager)
+framework.train()
+model = framework.get_level(0).landmark_model
+samples = np.array(model.radiograph_samples)
 one_point_samples = samples[:, 0, :].T
 print "Data rank: %d" % (np.linalg.matrix_rank(one_point_samples))
 